@@ -0,0 +1,181 @@
+"""OPR army building rules shared by one-shot and live roster validation.
+
+``validate_roster`` checks a whole roster at once. ``IncrementalValidator``
+keeps each unit's contribution (points, hero, over the 35% cap) so a single
+edit updates the totals without walking the roster again; both produce the
+same ``ValidationResult`` shape and messages.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+POINTS_PER_HERO = 375
+MAX_UNIT_SHARE = 0.35
+
+
+def calculate_army_points(units: List[dict]) -> int:
+    """Calculate total points for an army"""
+    total = 0
+    for unit in units:
+        total += unit.get("total_cost", unit.get("base_cost", 0))
+    return total
+
+
+def max_hero_count(points_limit: int) -> int:
+    return points_limit // POINTS_PER_HERO
+
+
+def max_unit_cost(points_limit: int) -> int:
+    return int(points_limit * MAX_UNIT_SHARE)
+
+
+def hero_limit_error(points_limit: int) -> Dict[str, Any]:
+    return {
+        "type": "error",
+        "message": f"Trop de héros! Maximum {max_hero_count(points_limit)} héros pour {points_limit} pts (1 héros / 375 pts)",
+        "unit_id": None
+    }
+
+
+def unit_cost_error(unit: Dict[str, Any], points_limit: int) -> Dict[str, Any]:
+    return {
+        "type": "error",
+        "message": f"L'unité '{unit.get('unit_name', 'Unknown')}' coûte {unit.get('total_cost', 0)} pts, maximum autorisé: {max_unit_cost(points_limit)} pts (35% de {points_limit})",
+        "unit_id": unit.get("id")
+    }
+
+
+def points_limit_error(total_points: int, points_limit: int) -> Dict[str, Any]:
+    return {
+        "type": "error",
+        "message": f"L'armée dépasse la limite de points! {total_points}/{points_limit} pts",
+        "unit_id": None
+    }
+
+
+def _result(errors: List[Dict[str, Any]], total_points: int, points_limit: int, hero_count: int) -> Dict[str, Any]:
+    return {
+        "valid": len([e for e in errors if e["type"] == "error"]) == 0,
+        "errors": errors,
+        "total_points": total_points,
+        "max_hero_count": max_hero_count(points_limit),
+        "current_hero_count": hero_count
+    }
+
+
+def validate_roster(army_data: dict) -> Dict[str, Any]:
+    """Check a roster against the OPR army building rules"""
+    errors = []
+    points_limit = army_data.get("points_limit", 1000)
+    units = army_data.get("units", [])
+
+    total_points = calculate_army_points(units)
+
+    # Check hero limit
+    hero_count = sum(1 for u in units if u.get("unit_type") == "hero")
+    if hero_count > max_hero_count(points_limit):
+        errors.append(hero_limit_error(points_limit))
+
+    # Check 35% rule for each unit
+    for unit in units:
+        if unit.get("total_cost", 0) > max_unit_cost(points_limit):
+            errors.append(unit_cost_error(unit, points_limit))
+
+    # Check total points
+    if total_points > points_limit:
+        errors.append(points_limit_error(total_points, points_limit))
+
+    return _result(errors, total_points, points_limit, hero_count)
+
+
+class IncrementalValidator:
+    """Roster validation maintained unit by unit.
+
+    Units are keyed by their roster ``id``. Adding, replacing or removing a
+    unit adjusts the running totals by that unit's contribution only; a
+    points limit change re-checks the 35% cap for every unit.
+    """
+
+    def __init__(self, points_limit: int = 1000, units: Optional[List[Dict[str, Any]]] = None):
+        self.points_limit = points_limit
+        self.total_points = 0
+        self.hero_count = 0
+        # id -> unit, in roster order
+        self.units: Dict[Any, Dict[str, Any]] = {}
+        # ids of units over the 35% cap
+        self._over_cap: set = set()
+        for unit in units or []:
+            self.put(unit)
+
+    @staticmethod
+    def _contribution(unit: Dict[str, Any]) -> Tuple[int, int]:
+        """Points and hero count one unit adds to the totals"""
+        return unit.get("total_cost", unit.get("base_cost", 0)), int(unit.get("unit_type") == "hero")
+
+    def _contribute(self, unit: Dict[str, Any], sign: int) -> None:
+        points, heroes = self._contribution(unit)
+        self.total_points += sign * points
+        self.hero_count += sign * heroes
+
+    def put(self, unit: Dict[str, Any], index: Optional[int] = None) -> None:
+        """Add a unit, or replace the unit with the same id in place"""
+        unit_id = unit.get("id")
+        previous = self.units.get(unit_id)
+        # Compute everything that can fail before touching the totals
+        points, heroes = self._contribution(unit)
+        total_points = self.total_points + points
+        over_cap = unit.get("total_cost", 0) > max_unit_cost(self.points_limit)
+        if previous is not None:
+            old_points, old_heroes = self._contribution(previous)
+            total_points -= old_points
+            heroes -= old_heroes
+        self.total_points = total_points
+        self.hero_count += heroes
+        if index is not None and previous is None:
+            items = list(self.units.items())
+            items.insert(index, (unit_id, unit))
+            self.units = dict(items)
+        else:
+            self.units[unit_id] = unit
+        if over_cap:
+            self._over_cap.add(unit_id)
+        else:
+            self._over_cap.discard(unit_id)
+
+    def remove(self, unit_id: Any) -> Optional[Dict[str, Any]]:
+        unit = self.units.pop(unit_id, None)
+        if unit is not None:
+            self._contribute(unit, -1)
+            self._over_cap.discard(unit_id)
+        return unit
+
+    def move(self, unit_id: Any, index: int) -> None:
+        unit = self.units.pop(unit_id)
+        items = list(self.units.items())
+        items.insert(index, (unit_id, unit))
+        self.units = dict(items)
+
+    def set_points_limit(self, points_limit: int) -> None:
+        self.points_limit = points_limit
+        self._over_cap.clear()
+        for unit_id, unit in self.units.items():
+            self._check_cap(unit_id, unit)
+
+    def _check_cap(self, unit_id: Any, unit: Dict[str, Any]) -> None:
+        if unit.get("total_cost", 0) > max_unit_cost(self.points_limit):
+            self._over_cap.add(unit_id)
+        else:
+            self._over_cap.discard(unit_id)
+
+    def result(self) -> Dict[str, Any]:
+        """The same ValidationResult validate_roster gives for the current roster"""
+        errors = []
+        if self.hero_count > max_hero_count(self.points_limit):
+            errors.append(hero_limit_error(self.points_limit))
+        if self._over_cap:
+            errors.extend(
+                unit_cost_error(unit, self.points_limit)
+                for unit_id, unit in self.units.items() if unit_id in self._over_cap
+            )
+        if self.total_points > self.points_limit:
+            errors.append(points_limit_error(self.total_points, self.points_limit))
+        return _result(errors, self.total_points, self.points_limit, self.hero_count)
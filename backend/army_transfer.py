@@ -0,0 +1,117 @@
+"""Streaming NDJSON export and import of armies.
+
+``export_ndjson`` walks a storage cursor and yields one JSON document per
+line, buffered into chunks of about ``chunk_size`` bytes, so memory stays flat
+however many armies are exported. ``import_ndjson`` reads a body chunk by
+chunk, splits it into lines and parses and writes ``batch_size`` lines at a
+time: each line goes through ``build``, which turns an army into a bulk write
+operation or raises ``ValueError``. Bad lines are reported by line number and
+skipped; only the first ``max_errors`` are kept in the report.
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from storage import Collection
+
+Line = Tuple[int, Optional[bytes]]
+
+
+async def export_ndjson(cursor: AsyncIterator[Dict[str, Any]], chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """NDJSON chunks for every document of the cursor"""
+    buffer = bytearray()
+    async for doc in cursor:
+        buffer += json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        buffer += b"\n"
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line: int) -> AsyncIterator[Line]:
+    """(line number, line) for each non-blank line; the line is None when over max_line bytes"""
+    pending = bytearray()
+    number = 0
+    too_long = False
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not too_long:
+                    pending += chunk[start:]
+                    if len(pending) > max_line:
+                        # Drop the rest of this line rather than buffer it
+                        too_long = True
+                        pending.clear()
+                break
+            number += 1
+            if too_long:
+                yield number, None
+            else:
+                pending += chunk[start:end]
+                if len(pending) > max_line:
+                    yield number, None
+                elif pending.strip():
+                    yield number, bytes(pending)
+            pending.clear()
+            too_long = False
+            start = end + 1
+    if too_long:
+        yield number + 1, None
+    elif pending.strip():
+        yield number + 1, bytes(pending)
+
+
+def parse_lines(lines: List[Line], build: Callable[[Dict[str, Any]], Any]) -> Tuple[list, List[Dict[str, Any]]]:
+    """Bulk write operations for the valid lines, and an error for each other one"""
+    operations, errors = [], []
+    for number, line in lines:
+        try:
+            if line is None:
+                raise ValueError("Line too long")
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            operations.append(build(data))
+        except ValueError as e:
+            errors.append({"line": number, "error": str(e).splitlines()[0] if str(e) else type(e).__name__})
+    return operations, errors
+
+
+async def import_ndjson(
+    collection: Collection,
+    chunks: AsyncIterator[bytes],
+    build: Callable[[Dict[str, Any]], Any],
+    batch_size: int = 500,
+    max_errors: int = 100,
+    max_line: int = 1024 * 1024,
+) -> Dict[str, Any]:
+    """Write every valid NDJSON line in unordered bulk writes of batch_size"""
+    loop = asyncio.get_running_loop()
+    report: Dict[str, Any] = {"lines": 0, "imported": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    async def write(batch: List[Line]) -> None:
+        # Parsing and model validation are CPU-bound; keep them off the event loop
+        operations, errors = await loop.run_in_executor(None, parse_lines, batch, build)
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        report["lines"] += len(batch)
+        report["imported"] += len(operations)
+        report["failed"] += len(errors)
+        room = max_errors - len(report["errors"])
+        report["errors"].extend(errors[:room])
+        report["errors_truncated"] |= len(errors) > room
+
+    batch: List[Line] = []
+    async for line in ndjson_lines(chunks, max_line):
+        batch.append(line)
+        if len(batch) >= batch_size:
+            await write(batch)
+            batch = []
+    if batch:
+        await write(batch)
+    return report
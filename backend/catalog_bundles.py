@@ -0,0 +1,112 @@
+"""Per-game catalog bundles for client prefetch.
+
+A bundle is every faction of one game as a single JSON document,
+gzip-compressed once when it is built. A client (the PWA) reads the small
+manifest, compares bundle versions with what it has cached, and fetches a
+whole game in one request it can keep for offline use.
+
+The version of a bundle is a hash of its factions' ids and content hashes,
+so it changes exactly when a faction of the game is added, changed or
+removed, and every worker computes the same version for the same data.
+``update`` gets the whole faction list whenever a worker reloads its
+catalog (after its own faction writes, or when the catalog generation in
+storage shows another worker wrote) and rebuilds only the games whose
+version moved. Bundles are served from
+memory as is, with ``Content-Encoding: gzip``, and a versioned URL is
+immutable.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+from faction_history import content_hash
+
+
+@dataclass(frozen=True)
+class Bundle:
+    game: str
+    version: str
+    factions: int
+    size: int
+    body: bytes  # gzip-compressed JSON
+
+    def manifest_entry(self) -> Dict[str, Any]:
+        return {
+            "game": self.game,
+            "version": self.version,
+            "factions": self.factions,
+            "size": self.size,
+            "compressed_size": len(self.body),
+            "url": f"/api/bundles/{self.game}/{self.version}",
+        }
+
+
+def bundle_version(factions: Iterable[Dict[str, Any]]) -> str:
+    """Hash of the (id, content hash) pairs of a game's factions"""
+    digest = hashlib.sha256()
+    for key in sorted(f"{f.get('id')}:{f.get('content_hash') or content_hash(f)}" for f in factions):
+        digest.update(key.encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()[:16]
+
+
+def build_bundle(game: Dict[str, Any], factions: List[Dict[str, Any]], version: str) -> Bundle:
+    """Serialize and compress one game's factions (pure CPU, run it off the event loop)"""
+    ordered = sorted(factions, key=lambda f: (str(f.get("faction")), str(f.get("id"))))
+    payload = {"game": game, "version": version, "factions": ordered}
+    raw = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the bytes identical across rebuilds and workers
+    return Bundle(game=game["id"], version=version, factions=len(ordered), size=len(raw),
+                  body=gzip.compress(raw, compresslevel=9, mtime=0))
+
+
+def group_by_game(games: List[Dict[str, Any]], factions: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Factions per game id; factions name their game by name or id"""
+    ids = {}
+    for game in games:
+        ids[game["id"]] = ids[game["name"]] = game["id"]
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for faction in factions:
+        game_id = ids.get(faction.get("game"))
+        if game_id:
+            grouped.setdefault(game_id, []).append(faction)
+    return grouped
+
+
+class CatalogBundles:
+    def __init__(self):
+        self.bundles: Dict[str, Bundle] = {}
+        self.builds = 0
+
+    def get(self, game_id: str) -> Optional[Bundle]:
+        return self.bundles.get(game_id)
+
+    async def update(self, games: List[Dict[str, Any]], factions: List[Dict[str, Any]]) -> List[str]:
+        """Rebuild the bundles of games whose factions changed; return their ids"""
+        grouped = group_by_game(games, factions)
+        loop = asyncio.get_running_loop()
+        rebuilt = []
+        bundles = {}
+        for game in games:
+            members = grouped.get(game["id"])
+            if not members:
+                continue
+            version = bundle_version(members)
+            current = self.bundles.get(game["id"])
+            if current and current.version == version:
+                bundles[game["id"]] = current
+                continue
+            bundles[game["id"]] = await loop.run_in_executor(None, build_bundle, game, members, version)
+            rebuilt.append(game["id"])
+        self.builds += len(rebuilt)
+        self.bundles = bundles
+        return rebuilt
+
+    def manifest(self) -> Dict[str, Any]:
+        entries = [bundle.manifest_entry() for _, bundle in sorted(self.bundles.items())]
+        return {"version": bundle_version({"id": e["game"], "content_hash": e["version"]} for e in entries),
+                "bundles": entries}
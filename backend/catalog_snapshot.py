@@ -0,0 +1,224 @@
+"""Compiled, memory-mapped faction catalog shared by every worker on a host.
+
+``compile`` serializes all factions into one versioned binary file::
+
+    header   magic, format version, entry count, index offset/length,
+             sha256 catalog version
+    payload  each faction as compact UTF-8 JSON, back to back
+    index    JSON list of {id, faction, game, offset, length}, and the
+             catalog generation the factions were read at
+
+Workers map the file read-only, so the page cache holds a single physical
+copy of the catalog no matter how many processes serve it. Factions are
+sliced out of the map on demand and served as raw JSON without being
+decoded. Rebuilds write a temporary file and ``os.replace`` it over the old
+snapshot; readers notice the new inode on their next access and remap.
+
+A snapshot is only served while its generation matches the worker's
+catalog generation (``catalog_state`` in storage), so a faction write by
+any worker stops every worker from serving the old file until it is
+recompiled. Factions always come from storage, so snapshot ids are the
+ids every other endpoint knows.
+
+Usage:
+    python catalog_snapshot.py compile [--output PATH]
+"""
+
+import argparse
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"OPRCAT\x00\x01"
+FORMAT_VERSION = 1
+# magic, format version, reserved, entry count, index offset, index length, catalog version
+HEADER = struct.Struct("<8sHHIQQ32s")
+
+class SnapshotError(Exception):
+    """The snapshot file is missing, truncated or from another format version"""
+
+
+def _encode(faction: Dict[str, Any]) -> bytes:
+    return json.dumps(faction, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_snapshot(factions: Iterable[Dict[str, Any]], path: Path, generation: Optional[int] = None) -> Dict[str, Any]:
+    """Compile factions into a snapshot at path, atomically replacing any existing one"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+    digest = hashlib.sha256()
+    index: List[Dict[str, Any]] = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        offset = HEADER.size
+        for faction in factions:
+            payload = _encode(faction)
+            digest.update(payload)
+            f.write(payload)
+            index.append({
+                "id": faction["id"],
+                "faction": faction.get("faction"),
+                "game": faction.get("game"),
+                "offset": offset,
+                "length": len(payload),
+            })
+            offset += len(payload)
+        index_bytes = _encode({"entries": index, "generation": generation})
+        f.write(index_bytes)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(index), offset, len(index_bytes), digest.digest()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return {"path": str(path), "version": digest.hexdigest(), "generation": generation, "factions": len(index),
+            "bytes": offset + len(index_bytes)}
+
+
+class CatalogSnapshot:
+    """A read-only mapping of one snapshot file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER.size:
+                raise SnapshotError(f"{self.path} is truncated")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        magic, fmt, _, count, index_offset, index_length, version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise SnapshotError(f"{self.path} is not a format {FORMAT_VERSION} catalog snapshot")
+        self.version = version.hex()
+        index = json.loads(self._map[index_offset:index_offset + index_length])
+        entries = index["entries"]
+        # Catalog generation the factions were read at (None if unknown)
+        self.generation: Optional[int] = index.get("generation")
+        if len(entries) != count:
+            raise SnapshotError(f"{self.path} index is corrupt")
+        self.entries: List[Dict[str, Any]] = entries
+        self._by_id: Dict[str, Tuple[int, int]] = {e["id"]: (e["offset"], e["length"]) for e in entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, faction_id: str) -> bool:
+        return faction_id in self._by_id
+
+    def raw(self, faction_id: str) -> Optional[memoryview]:
+        """Zero-copy view of a faction's JSON bytes"""
+        location = self._by_id.get(faction_id)
+        if location is None:
+            return None
+        offset, length = location
+        return memoryview(self._map)[offset:offset + length]
+
+    def get(self, faction_id: str) -> Optional[Dict[str, Any]]:
+        """Decode a single faction"""
+        view = self.raw(faction_id)
+        return None if view is None else json.loads(bytes(view))
+
+    def raw_list(self, game: Optional[str] = None) -> bytes:
+        """JSON array of all factions (optionally for one game) built from raw slices"""
+        parts = [self.raw(e["id"]) for e in self.entries if game is None or e["game"] == game]
+        return b"[" + b",".join(parts) + b"]"
+
+
+class SnapshotStore:
+    """Per-process handle that follows atomic swaps of the snapshot file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._snapshot: Optional[CatalogSnapshot] = None
+
+    def current(self) -> Optional[CatalogSnapshot]:
+        """The latest snapshot, remapped if another process swapped the file"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._snapshot = None
+            return None
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._snapshot is None or self._snapshot.identity != identity:
+            try:
+                # The old mapping is released once in-flight readers drop it
+                self._snapshot = CatalogSnapshot(self.path)
+            except (OSError, ValueError, SnapshotError) as e:
+                logger.error(f"Cannot map catalog snapshot {self.path}: {e}")
+                self._snapshot = None
+        return self._snapshot
+
+    async def rebuild(self, storage, generation: Optional[int] = None,
+                      factions: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """Recompile from storage (or the given factions, read at `generation`).
+
+        An exclusive file lock makes workers on the same host compile one at a
+        time, and a worker that finds the snapshot already at `generation`
+        maps it instead of compiling again.
+        """
+        loop = asyncio.get_running_loop()
+        lock = await loop.run_in_executor(None, self._acquire_lock)
+        try:
+            snapshot = self.current()
+            if generation is not None and snapshot is not None and snapshot.generation == generation:
+                return None
+            if factions is None:
+                factions = await storage.factions.find({}).to_list(None)
+            info = await loop.run_in_executor(None, write_snapshot, factions, self.path, generation)
+        finally:
+            # Closing the descriptor releases the flock
+            lock.close()
+        self.current()
+        logger.info(f"Compiled catalog snapshot {info['version'][:12]} ({info['factions']} factions, {info['bytes']} bytes)")
+        return info
+
+    def _acquire_lock(self):
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock = open(self.lock_path, "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compile the faction catalog snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compile_cmd = sub.add_parser("compile", help="compile the factions in storage into a snapshot file")
+    compile_cmd.add_argument("--output", help="snapshot path (default: CATALOG_SNAPSHOT_PATH)")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    import server
+
+    output = Path(args.output or server.CATALOG_SNAPSHOT_PATH or server.ROOT_DIR / "catalog.snapshot")
+
+    async def from_storage():
+        await server.storage.open()
+        try:
+            # Read the generation first: a write landing meanwhile leaves the snapshot stale, not served
+            generation = await server.read_catalog_generation()
+            info = await SnapshotStore(output).rebuild(server.storage, generation)
+            return info or {"path": str(output), "generation": generation, "up_to_date": True}
+        finally:
+            await server.storage.close()
+
+    info = asyncio.run(from_storage())
+    print(json.dumps(info, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""Compact, deduplicated in-memory representation of the faction catalog.
+
+Faction documents are very repetitive: the same weapon profiles, mounts,
+rule lists and upgrade groups appear on many units, and Regiments variants
+repeat whole Age of Fantasy units. ``CompactCatalog`` stores each distinct
+weapon, mount, rule list, upgrade option, upgrade group and unit once, in
+shared tables, as ``__slots__`` records whose strings are interned. Records
+reference each other by table index (``array``-backed lists), across units
+and across factions.
+
+Conversion is lossless: ``CompactCatalog.get_dict(id)`` returns a document
+equal to the one that was loaded, including unknown keys and key order.
+
+Usage:
+    python compact_catalog.py measure [--source storage|files]
+"""
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import json
+import sys
+import tracemalloc
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# ===== FROZEN VALUES =====
+# Arbitrary JSON (spells, rule descriptions, unknown keys) is kept as nested
+# tuples tagged with their JSON type, with interned strings.
+
+_DICT, _LIST, _BOOL, _FLOAT = "d", "l", "b", "f"
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return (_DICT, tuple((sys.intern(k), freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return (_LIST, tuple(freeze(v) for v in value))
+    # Tag bools and floats so True, 1 and 1.0 never deduplicate together
+    if isinstance(value, bool):
+        return (_BOOL, value)
+    if isinstance(value, float):
+        return (_FLOAT, value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    if isinstance(value, tuple):
+        tag, body = value
+        if tag == _DICT:
+            return {k: thaw(v) for k, v in body}
+        if tag == _LIST:
+            return [thaw(v) for v in body]
+        return body
+    return value
+
+
+class _Raw:
+    """A value that didn't have the shape its field expects, kept verbatim"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = freeze(value)
+
+
+# ===== TABLES & RECORDS =====
+
+def _digest(value: Any) -> bytes:
+    # Table keys are 128-bit digests of the JSON text rather than the values
+    # themselves, so the dedup index doesn't hold a second copy of the catalog
+    return hashlib.blake2b(json.dumps(value, ensure_ascii=False).encode("utf-8"), digest_size=16).digest()
+
+
+class _Table:
+    """Hash-consed list of records: equal inputs share one record and index"""
+
+    __slots__ = ("items", "_index")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self._index: Dict[Any, int] = {}
+
+    def add(self, key: Any, build: Callable[[], Any]) -> int:
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self.items)
+            self.items.append(build())
+        return index
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class _Record:
+    """Base for slotted records; absent keys simply leave their slot unset"""
+
+    __slots__ = ("extra", "order")
+    # (key, kind) pairs; kind selects how the value is packed, see CatalogTables
+    FIELDS: Tuple[Tuple[str, str], ...] = ()
+
+    @classmethod
+    def pack(cls, data: Dict[str, Any], tables: "CatalogTables") -> "_Record":
+        record = cls.__new__(cls)
+        known = []
+        for key, kind in cls.FIELDS:
+            if key in data:
+                setattr(record, key, tables.pack(kind, data[key]))
+                known.append(key)
+        extra = {k: v for k, v in data.items() if k not in known}
+        record.extra = freeze(extra) if extra else None
+        # Only remember key order when it differs from FIELDS order
+        keys = list(data)
+        record.order = tuple(sys.intern(k) for k in keys) if keys != known + list(extra) else None
+        return record
+
+    def unpack(self, tables: "CatalogTables") -> Dict[str, Any]:
+        data = {}
+        for key, kind in self.FIELDS:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                continue
+            data[key] = tables.unpack(kind, value)
+        if self.extra is not None:
+            data.update(thaw(self.extra))
+        if self.order is not None:
+            data = {k: data[k] for k in self.order}
+        return data
+
+
+class WeaponRecord(_Record):
+    __slots__ = ("name", "range", "attacks", "armor_piercing", "special_rules")
+    FIELDS = (("name", "value"), ("range", "value"), ("attacks", "value"),
+              ("armor_piercing", "value"), ("special_rules", "rules"))
+
+
+class MountRecord(_Record):
+    __slots__ = ("name", "special_rules")
+    FIELDS = (("name", "value"), ("special_rules", "rules"))
+
+
+class OptionRecord(_Record):
+    __slots__ = ("name", "cost", "weapon", "mount", "special_rules")
+    FIELDS = (("name", "value"), ("cost", "value"), ("weapon", "weapon"),
+              ("mount", "mount"), ("special_rules", "rules"))
+
+
+class GroupRecord(_Record):
+    __slots__ = ("group", "type", "description", "options")
+    FIELDS = (("group", "value"), ("type", "value"), ("description", "value"), ("options", "options"))
+
+
+class UnitRecord(_Record):
+    __slots__ = ("name", "original_name", "type", "size", "base_cost", "quality", "defense",
+                 "equipment", "special_rules", "weapons", "upgrade_groups")
+    FIELDS = (("name", "value"), ("original_name", "value"), ("type", "value"), ("size", "value"),
+              ("base_cost", "value"), ("quality", "value"), ("defense", "value"),
+              ("equipment", "rules"), ("special_rules", "rules"), ("weapons", "weapons"),
+              ("upgrade_groups", "groups"))
+
+
+class FactionRecord(_Record):
+    __slots__ = ("id", "faction", "game", "version", "status", "description",
+                 "special_rules_descriptions", "spells", "units")
+    FIELDS = (("id", "value"), ("faction", "value"), ("game", "value"), ("version", "value"),
+              ("status", "value"), ("description", "value"), ("special_rules_descriptions", "value"),
+              ("spells", "value"), ("units", "units"))
+
+
+class CatalogTables:
+    """Shared tables referenced by index from every record in the catalog"""
+
+    def __init__(self):
+        self.rules = _Table()      # rule/equipment lists as tuples of interned strings
+        self.weapons = _Table()
+        self.mounts = _Table()
+        self.options = _Table()
+        self.groups = _Table()
+        self.units = _Table()
+        self._record_tables = {
+            "weapon": (self.weapons, WeaponRecord),
+            "mount": (self.mounts, MountRecord),
+            "option": (self.options, OptionRecord),
+            "group": (self.groups, GroupRecord),
+            "unit": (self.units, UnitRecord),
+        }
+        self._list_kinds = {"weapons": "weapon", "options": "option", "groups": "group", "units": "unit"}
+
+    def _ref(self, kind: str, value: Any) -> Any:
+        if not isinstance(value, dict):
+            return _Raw(value)
+        table, record_cls = self._record_tables[kind]
+        return table.add(_digest(value), lambda: record_cls.pack(value, self))
+
+    def pack(self, kind: str, value: Any) -> Any:
+        if kind == "value":
+            return freeze(value)
+        if kind == "rules":
+            if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+                return _Raw(value)
+            frozen = tuple(sys.intern(v) for v in value)
+            return self.rules.add(frozen, lambda: frozen)
+        if kind in self._list_kinds:
+            if not isinstance(value, list):
+                return _Raw(value)
+            refs = [self._ref(self._list_kinds[kind], item) for item in value]
+            if any(isinstance(ref, _Raw) for ref in refs):
+                return _Raw(value)
+            return array("I", refs)
+        return self._ref(kind, value)
+
+    def unpack(self, kind: str, value: Any) -> Any:
+        if isinstance(value, _Raw):
+            return thaw(value.value)
+        if kind == "value":
+            return thaw(value)
+        if kind == "rules":
+            return list(self.rules.items[value])
+        if kind in self._list_kinds:
+            table = self._record_tables[self._list_kinds[kind]][0]
+            return [table.items[i].unpack(self) for i in value]
+        return self._record_tables[kind][0].items[value].unpack(self)
+
+    def counts(self) -> Dict[str, int]:
+        return {name: len(getattr(self, name)) for name in ("rules", "weapons", "mounts", "options", "groups", "units")}
+
+
+class CompactCatalog:
+    """All loaded factions, sharing one set of tables"""
+
+    def __init__(self):
+        self.tables = CatalogTables()
+        self.factions: Dict[str, FactionRecord] = {}
+
+    @classmethod
+    def build(cls, factions: Iterable[Dict[str, Any]]) -> "CompactCatalog":
+        catalog = cls()
+        for faction in factions:
+            catalog.add(faction)
+        return catalog
+
+    def add(self, faction: Dict[str, Any]) -> FactionRecord:
+        record = FactionRecord.pack(faction, self.tables)
+        self.factions[faction["id"]] = record
+        return record
+
+    def __len__(self) -> int:
+        return len(self.factions)
+
+    def __contains__(self, faction_id: str) -> bool:
+        return faction_id in self.factions
+
+    def get(self, faction_id: str) -> Optional[FactionRecord]:
+        return self.factions.get(faction_id)
+
+    def get_dict(self, faction_id: str) -> Optional[Dict[str, Any]]:
+        """The faction in its original JSON shape"""
+        record = self.factions.get(faction_id)
+        return None if record is None else record.unpack(self.tables)
+
+    def ids(self, game: Optional[str] = None) -> List[str]:
+        """Faction ids in load order, optionally only those of one game"""
+        return [fid for fid, record in self.factions.items() if game is None or getattr(record, "game", None) == game]
+
+    def units(self, faction_id: str) -> List[UnitRecord]:
+        record = self.factions.get(faction_id)
+        units = getattr(record, "units", None) if record else None
+        if units is None or isinstance(units, _Raw):
+            return []
+        return [self.tables.units.items[i] for i in units]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"factions": len(self.factions), "tables": self.tables.counts()}
+
+
+def measure_memory(raw_factions: List[bytes]) -> Dict[str, Any]:
+    """Bytes held by the catalog as plain dicts vs as a CompactCatalog"""
+    def traced(build: Callable[[], Any]) -> int:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            held = build()
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del held
+        return size
+
+    dict_bytes = traced(lambda: [json.loads(raw) for raw in raw_factions])
+    # Built straight from freshly parsed dicts, which are dropped right away, so
+    # only memory retained by the compact form is counted
+    compact_bytes = traced(lambda: CompactCatalog.build(json.loads(raw) for raw in raw_factions))
+    catalog = CompactCatalog.build(json.loads(raw) for raw in raw_factions)
+    return {
+        "factions": len(raw_factions),
+        "json_bytes": sum(len(raw) for raw in raw_factions),
+        "dict_bytes": dict_bytes,
+        "compact_bytes": compact_bytes,
+        "reduction": round(1 - compact_bytes / dict_bytes, 3) if dict_bytes else 0.0,
+        "tables": catalog.tables.counts(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the compact catalog's memory footprint")
+    sub = parser.add_subparsers(dest="command", required=True)
+    measure_cmd = sub.add_parser("measure", help="compare dict vs compact memory for the catalog")
+    measure_cmd.add_argument("--source", choices=["storage", "files"], default="storage")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    import server
+
+    if args.source == "files":
+        from faction_watcher import read_faction_files
+        # Ids only need to be unique for measuring
+        factions, _ = read_faction_files(sorted(server.DATA_DIR.glob("*.json")))
+        factions = [{**f, "id": f"file-{i}"} for i, f in enumerate(factions)]
+        factions += [{**f, "id": f"sample-{i}"} for i, f in enumerate(server.load_sample_factions())]
+    else:
+        async def from_storage():
+            await server.storage.open()
+            try:
+                return await server.storage.factions.find({}).to_list(None)
+            finally:
+                await server.storage.close()
+        factions = asyncio.run(from_storage())
+
+    raw = [json.dumps(f, ensure_ascii=False).encode("utf-8") for f in factions]
+    print(json.dumps(measure_memory(raw), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""MongoDB connection management.
+
+Pool sizing, timeouts and wire compression are read from the environment
+(see ``MongoSettings.from_env``). The manager pre-opens the pool before the
+app accepts traffic and exposes pool statistics for the readiness probe.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Compressor name -> module pymongo needs to use it
+_COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+def _int_env(env: Mapping[str, str], name: str, default: Optional[int]) -> Optional[int]:
+    value = env.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+@dataclass
+class MongoSettings:
+    url: str
+    db_name: str
+    min_pool_size: int = 0
+    max_pool_size: int = 100
+    max_idle_time_ms: Optional[int] = None
+    server_selection_timeout_ms: int = 5000
+    connect_timeout_ms: int = 5000
+    socket_timeout_ms: Optional[int] = None
+    compressors: Tuple[str, ...] = ("zstd", "snappy")
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "MongoSettings":
+        compressors = env.get("MONGO_COMPRESSORS", "zstd,snappy")
+        return cls(
+            url=env["MONGO_URL"],
+            db_name=env["DB_NAME"],
+            min_pool_size=_int_env(env, "MONGO_MIN_POOL_SIZE", 0),
+            max_pool_size=_int_env(env, "MONGO_MAX_POOL_SIZE", 100),
+            max_idle_time_ms=_int_env(env, "MONGO_MAX_IDLE_TIME_MS", None),
+            server_selection_timeout_ms=_int_env(env, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+            connect_timeout_ms=_int_env(env, "MONGO_CONNECT_TIMEOUT_MS", 5000),
+            socket_timeout_ms=_int_env(env, "MONGO_SOCKET_TIMEOUT_MS", None),
+            compressors=tuple(c.strip() for c in compressors.split(",") if c.strip()),
+        )
+
+    def available_compressors(self) -> Tuple[str, ...]:
+        """Configured compressors whose optional dependency is installed"""
+        available = []
+        for name in self.compressors:
+            module = _COMPRESSOR_MODULES.get(name)
+            if module and importlib.util.find_spec(module) is not None:
+                available.append(name)
+            else:
+                logger.warning(f"Mongo compressor '{name}' unavailable, skipping")
+        return tuple(available)
+
+    def client_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {
+            "minPoolSize": self.min_pool_size,
+            "maxPoolSize": self.max_pool_size,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+        }
+        if self.max_idle_time_ms is not None:
+            options["maxIdleTimeMS"] = self.max_idle_time_ms
+        if self.socket_timeout_ms is not None:
+            options["socketTimeoutMS"] = self.socket_timeout_ms
+        compressors = self.available_compressors()
+        if compressors:
+            options["compressors"] = ",".join(compressors)
+        return options
+
+
+@dataclass
+class _PoolCounters:
+    created: int = 0
+    closed: int = 0
+    checked_out: int = 0
+    check_out_failures: int = 0
+    cleared: int = 0
+
+    @property
+    def open(self) -> int:
+        return self.created - self.closed
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks connection pool activity per server; events arrive on driver threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, _PoolCounters] = defaultdict(_PoolCounters)
+
+    def _update(self, event, **deltas):
+        address = "%s:%s" % event.address
+        with self._lock:
+            counters = self._pools[address]
+            for name, delta in deltas.items():
+                setattr(counters, name, getattr(counters, name) + delta)
+
+    def pool_created(self, event):
+        self._update(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(event, check_out_failures=1)
+
+    def connection_checked_out(self, event):
+        self._update(event, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._update(event, checked_out=-1)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                address: {
+                    "open": c.open,
+                    "in_use": c.checked_out,
+                    "idle": c.open - c.checked_out,
+                    "created": c.created,
+                    "closed": c.closed,
+                    "check_out_failures": c.check_out_failures,
+                    "cleared": c.cleared,
+                }
+                for address, c in self._pools.items()
+            }
+
+
+@dataclass
+class MongoConnectionManager:
+    settings: MongoSettings
+    monitor: PoolMonitor = field(default_factory=PoolMonitor)
+
+    def __post_init__(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        # Motor connects lazily; nothing touches the network until open()
+        self.options = self.settings.client_options()
+        self.client = AsyncIOMotorClient(self.settings.url, event_listeners=[self.monitor], **self.options)
+        self.database = self.client[self.settings.db_name]
+
+    async def open(self) -> None:
+        """Select a server and pre-open min_pool_size connections"""
+        # Each concurrent ping checks out its own connection, filling the pool
+        await asyncio.gather(*(
+            self.database.command("ping") for _ in range(max(1, self.settings.min_pool_size))
+        ))
+        logger.info(f"MongoDB pool ready: {self.stats()['totals']}")
+
+    async def ping(self) -> bool:
+        try:
+            await self.database.command("ping")
+            return True
+        except Exception as e:
+            logger.warning(f"MongoDB ping failed: {e}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        pools = self.monitor.snapshot()
+        totals = {"open": 0, "in_use": 0, "idle": 0}
+        for counters in pools.values():
+            for key in totals:
+                totals[key] += counters[key]
+        return {
+            "min_pool_size": self.settings.min_pool_size,
+            "max_pool_size": self.settings.max_pool_size,
+            "compressors": [c for c in self.options.get("compressors", "").split(",") if c],
+            "totals": totals,
+            "servers": pools,
+        }
+
+    def close(self) -> None:
+        self.client.close()
@@ -0,0 +1,209 @@
+"""Off-loop execution of CPU-heavy work, with deadlines and metrics.
+
+``ExecutionLayer`` owns two pools shared by the whole worker:
+
+- a process pool for pure-Python CPU work (validation, compilation, ...),
+  which would otherwise hold the GIL and stall the event loop
+- a thread pool for work that releases the GIL or is mostly I/O
+
+``run`` submits a call to either pool and awaits it under a deadline. A
+call still queued when its deadline passes is cancelled; one already
+running in a process cannot be interrupted, but the process checks the
+deadline before starting, so work queued behind a burst is skipped rather
+than done late. Either way the caller gets ``DeadlineExceeded``.
+
+Request context follows the call: threads run in a copy of the caller's
+``contextvars`` context, and processes get the values of the variables in
+``PROPAGATED`` (the request id set by ``RequestContextMiddleware``).
+
+``offload`` turns a plain function into an awaitable that runs through the
+shared layer::
+
+    @offload("process", timeout=2.0)
+    def solve(roster): ...
+
+    result = await solve(roster)
+
+Functions sent to the process pool are looked up by module and name in the
+worker process, so they must be importable module-level functions.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import logging
+import multiprocessing
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROCESS, THREAD = "process", "thread"
+
+# Request id of the current request, for log lines and traces
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# Context variables whose values are carried into worker processes
+PROPAGATED = [request_id]
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call did not finish before its deadline"""
+
+
+# ===== WORKER SIDE =====
+
+def _resolve(module: str, qualname: str) -> Callable:
+    target: Any = importlib.import_module(module)
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    # A module-level @offload leaves the wrapper under the name; call the original
+    return getattr(target, "__wrapped__", target)
+
+
+def _call_in_process(module: str, qualname: str, args, kwargs, context: Dict[str, Any], deadline: Optional[float]):
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded("deadline passed while queued")
+    for var in PROPAGATED:
+        if var.name in context:
+            var.set(context[var.name])
+    return _resolve(module, qualname)(*args, **kwargs)
+
+
+# ===== LAYER =====
+
+def _percentiles(values) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"avg_ms": None, "p95_ms": None}
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {"avg_ms": round(sum(ordered) / len(ordered) * 1000, 2), "p95_ms": round(p95 * 1000, 2)}
+
+
+class ExecutionLayer:
+    def __init__(self, processes: int = 2, threads: int = 4, default_timeout: Optional[float] = None):
+        self.processes = processes
+        self.threads = threads
+        self.default_timeout = default_timeout
+        self._pools: Dict[str, Any] = {}
+        self._counts = {kind: {"submitted": 0, "completed": 0, "failed": 0, "timed_out": 0, "in_flight": 0}
+                        for kind in (PROCESS, THREAD)}
+        # Submit-to-result latencies of recent calls, in seconds
+        self._latency: Dict[str, Deque[float]] = {PROCESS: deque(maxlen=1024), THREAD: deque(maxlen=1024)}
+
+    def configure(self, processes: int, threads: int, default_timeout: Optional[float] = None) -> None:
+        """Set pool sizes and the default deadline; takes effect at the next start"""
+        self.processes = processes
+        self.threads = threads
+        self.default_timeout = default_timeout
+
+    def start(self) -> None:
+        if self._pools:
+            return
+        self._pools[THREAD] = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="offload")
+        if self.processes > 0:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            self._pools[PROCESS] = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        logger.info(f"Execution layer started ({self.processes} processes, {self.threads} threads)")
+
+    async def close(self) -> None:
+        pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(pool.shutdown, wait=True, cancel_futures=True)
+            )
+
+    async def run(self, func: Callable, *args, kind: str = PROCESS, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Run func(*args, **kwargs) in a pool; DeadlineExceeded after `timeout` seconds"""
+        self.start()
+        if kind == PROCESS and PROCESS not in self._pools:
+            kind = THREAD  # no process pool configured
+        timeout = self.default_timeout if timeout is None else timeout
+        deadline = time.time() + timeout if timeout is not None else None
+        if kind == THREAD:
+            future = self._pools[THREAD].submit(contextvars.copy_context().run, func, *args, **kwargs)
+        else:
+            context = {var.name: var.get() for var in PROPAGATED}
+            future = self._pools[PROCESS].submit(
+                _call_in_process, func.__module__, func.__qualname__, args, kwargs, context, deadline
+            )
+
+        counts = self._counts[kind]
+        counts["submitted"] += 1
+        counts["in_flight"] += 1
+        submitted = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except TimeoutError:
+            # Cancels the call if it hasn't started; a running call finishes unobserved
+            future.cancel()
+            counts["timed_out"] += 1
+            raise DeadlineExceeded(f"{func.__qualname__} exceeded its {timeout}s deadline") from None
+        except BaseException:
+            counts["failed"] += 1
+            raise
+        finally:
+            counts["in_flight"] -= 1
+        counts["completed"] += 1
+        self._latency[kind].append(time.perf_counter() - submitted)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for kind, counts in self._counts.items():
+            workers = self.processes if kind == PROCESS else self.threads
+            stats[kind] = {
+                "workers": workers,
+                **counts,
+                # Calls beyond the worker count are waiting for a free worker
+                "queued": max(0, counts["in_flight"] - workers),
+                "latency": _percentiles(self._latency[kind]),
+            }
+        return stats
+
+
+# Shared by every module of the worker; the server configures, starts and closes it
+execution = ExecutionLayer()
+
+
+def offload(kind: str = PROCESS, timeout: Optional[float] = None, layer: Optional[ExecutionLayer] = None):
+    """Make a sync function awaitable, running through the execution layer"""
+    def decorate(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await (layer or execution).run(func, *args, kind=kind, timeout=timeout, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ===== REQUEST CONTEXT =====
+
+class RequestContextMiddleware:
+    """Set ``request_id`` from X-Request-ID (or a new id) and echo it on the response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        given = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:128]
+        value = given or uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-request-id", value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
@@ -0,0 +1,180 @@
+"""Unit- and upgrade-group-level diff between a stored faction and a re-import.
+
+``diff_faction`` turns a re-imported faction into the smallest ``$set`` /
+``$unset`` update that makes the stored document equal to it, plus a summary
+of what changed for the caller. Units are matched by name (and occurrence,
+for duplicate names). When the unit list keeps its names and order, changed
+units are updated field by field and changed upgrade groups one by one;
+when units are added, removed or reordered the ``units`` array is written
+whole, since positional paths would shift.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from json_patch import json_equal
+
+# Fields of the stored document the importer never owns
+_STORED_ONLY_FIELDS = ("id", "_id")
+# Bookkeeping fields, not reported as content changes
+_UNREPORTED_FIELDS = ("units", "content_hash")
+
+
+def _addressable(key: Any) -> bool:
+    """Whether key can be one segment of a dotted update path"""
+    return isinstance(key, str) and key != "" and "." not in key and not key.startswith("$")
+
+
+def _unit_keys(units: List[Dict[str, Any]]) -> List[Tuple[Optional[str], int]]:
+    """(name, occurrence) for each unit, so duplicate names still pair up in order"""
+    seen: Dict[Optional[str], int] = {}
+    keys = []
+    for unit in units:
+        name = unit.get("name")
+        keys.append((name, seen.get(name, 0)))
+        seen[name] = seen.get(name, 0) + 1
+    return keys
+
+
+def _label(key: Tuple[Optional[str], int]) -> str:
+    name, occurrence = key
+    label = name if name is not None else "(unnamed)"
+    return f"{label} #{occurrence + 1}" if occurrence else label
+
+
+def _costs(unit: Dict[str, Any]) -> Any:
+    """Everything that feeds a unit's points: base cost and every option's cost"""
+    groups = unit.get("upgrade_groups")
+    options = []
+    if isinstance(groups, list):
+        for group in groups:
+            if isinstance(group, dict) and isinstance(group.get("options"), list):
+                options.append([
+                    (option.get("name"), option.get("cost")) if isinstance(option, dict) else option
+                    for option in group["options"]
+                ])
+    return unit.get("base_cost"), options
+
+
+def _without_costs(unit: Dict[str, Any]) -> Dict[str, Any]:
+    stripped = {k: v for k, v in unit.items() if k != "base_cost"}
+    groups = stripped.get("upgrade_groups")
+    if isinstance(groups, list):
+        stripped["upgrade_groups"] = [
+            {**group, "options": [
+                {k: v for k, v in option.items() if k != "cost"} if isinstance(option, dict) else option
+                for option in group["options"]
+            ]} if isinstance(group, dict) and isinstance(group.get("options"), list) else group
+            for group in groups
+        ]
+    return stripped
+
+
+@dataclass
+class FactionChanges:
+    """Update document for a re-import and a summary of what it changes"""
+
+    set: Dict[str, Any] = field(default_factory=dict)
+    unset: List[str] = field(default_factory=list)
+    units_added: List[str] = field(default_factory=list)
+    units_removed: List[str] = field(default_factory=list)
+    # Units whose base cost or upgrade option costs changed
+    units_recosted: List[str] = field(default_factory=list)
+    # Units with changes other than costs (profiles, rules, weapons, options)
+    units_modified: List[str] = field(default_factory=list)
+    fields_changed: List[str] = field(default_factory=list)
+    # Top-level keys that can't be dotted paths: write the whole document
+    replace: bool = False
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.set or self.unset)
+
+    def update(self) -> Dict[str, Any]:
+        update: Dict[str, Any] = {}
+        if self.set:
+            update["$set"] = self.set
+        if self.unset:
+            update["$unset"] = {path: "" for path in self.unset}
+        return update
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "changed": self.changed,
+            "units_added": self.units_added,
+            "units_removed": self.units_removed,
+            "units_recosted": self.units_recosted,
+            "units_modified": self.units_modified,
+            "fields_changed": self.fields_changed,
+        }
+
+
+def _diff_unit(path: str, old: Dict[str, Any], new: Dict[str, Any], changes: FactionChanges) -> None:
+    if not all(_addressable(key) for key in list(old) + list(new)):
+        changes.set[path] = new
+        return
+    for key in old:
+        if key not in new:
+            changes.unset.append(f"{path}.{key}")
+    for key, value in new.items():
+        if key in old and json_equal(old[key], value):
+            continue
+        old_groups = old.get(key)
+        if (
+            key == "upgrade_groups" and isinstance(old_groups, list) and isinstance(value, list)
+            and len(old_groups) == len(value)
+        ):
+            for index, (old_group, new_group) in enumerate(zip(old_groups, value)):
+                if not json_equal(old_group, new_group):
+                    changes.set[f"{path}.{key}.{index}"] = new_group
+        else:
+            changes.set[f"{path}.{key}"] = value
+
+
+def _diff_units(old_units: List[Dict[str, Any]], new_units: List[Dict[str, Any]], changes: FactionChanges) -> None:
+    old_keys, new_keys = _unit_keys(old_units), _unit_keys(new_units)
+    old_by_key = dict(zip(old_keys, old_units))
+    new_key_set = set(new_keys)
+    changes.units_added = [_label(key) for key in new_keys if key not in old_by_key]
+    changes.units_removed = [_label(key) for key in old_keys if key not in new_key_set]
+
+    same_layout = old_keys == new_keys
+    for index, (key, new_unit) in enumerate(zip(new_keys, new_units)):
+        old_unit = old_by_key.get(key)
+        if old_unit is None or json_equal(old_unit, new_unit):
+            continue
+        if not json_equal(_costs(old_unit), _costs(new_unit)):
+            changes.units_recosted.append(_label(key))
+        if not json_equal(_without_costs(old_unit), _without_costs(new_unit)):
+            changes.units_modified.append(_label(key))
+        if same_layout:
+            _diff_unit(f"units.{index}", old_unit, new_unit, changes)
+
+    if not same_layout:
+        changes.set["units"] = new_units
+
+
+def diff_faction(stored: Dict[str, Any], incoming: Dict[str, Any]) -> FactionChanges:
+    """Targeted update turning the stored faction into the incoming one"""
+    changes = FactionChanges()
+    for key in stored:
+        if key not in incoming and key not in _STORED_ONLY_FIELDS:
+            changes.unset.append(key)
+            if key not in _UNREPORTED_FIELDS:
+                changes.fields_changed.append(key)
+
+    for key, value in incoming.items():
+        if key in _STORED_ONLY_FIELDS or (key in stored and json_equal(stored[key], value)):
+            continue
+        old_units = stored.get("units")
+        if (
+            key == "units" and isinstance(old_units, list) and isinstance(value, list)
+            and all(isinstance(unit, dict) for unit in old_units + value)
+        ):
+            _diff_units(old_units, value, changes)
+            continue
+        changes.set[key] = value
+        if key not in _UNREPORTED_FIELDS:
+            changes.fields_changed.append(key)
+    changes.replace = changes.changed and not all(_addressable(key) for key in list(stored) + list(incoming))
+    return changes
@@ -0,0 +1,129 @@
+"""Content-hashed faction revisions and cached JSON Patch deltas.
+
+Every stored faction carries a ``content_hash``: the sha256 of its canonical
+JSON, ignoring ``id`` and the hash itself. Each time a faction's content
+changes, ``FactionHistory.record`` stores the new revision in the
+``faction_revisions`` collection and, for every older revision still kept,
+the RFC 6902 patch that brings it up to date. Serving ``changes`` is then a
+single indexed lookup; nothing is diffed on the request path.
+
+Diffing is pure-Python CPU work, so patches are computed in the execution
+layer's process pool rather than on the event loop.
+"""
+
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from execution import PROCESS, execution
+from json_patch import make_patch
+from storage import DESCENDING, ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_LIMIT = 20
+
+# Fields that identify a stored faction rather than describe it
+_UNHASHED_FIELDS = ("id", "content_hash")
+
+
+def content_hash(faction: Dict[str, Any]) -> str:
+    """sha256 of the faction's canonical JSON, excluding id and content_hash"""
+    body = {k: v for k, v in faction.items() if k not in _UNHASHED_FIELDS}
+    canonical = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def stamp(faction: Dict[str, Any]) -> Dict[str, Any]:
+    """Set the faction's content_hash in place"""
+    faction["content_hash"] = content_hash(faction)
+    return faction
+
+
+def patches_to(documents: List[Dict[str, Any]], target: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+    """JSON Patch from each document to target (run it off the event loop)"""
+    return [make_patch(document, target) for document in documents]
+
+
+def _revision_id(faction_id: str, revision_hash: str) -> str:
+    return f"{faction_id}:{revision_hash}"
+
+
+class FactionHistory:
+    """Bounded per-faction revision history in the faction_revisions collection"""
+
+    def __init__(self, storage, limit: int = DEFAULT_HISTORY_LIMIT):
+        self.storage = storage
+        self.limit = max(1, limit)
+
+    @property
+    def revisions(self):
+        return self.storage.collection("faction_revisions")
+
+    async def record(self, faction: Dict[str, Any]) -> bool:
+        """Store the faction's current content as a revision; False if it was already current"""
+        faction_id = faction["id"]
+        current = faction.get("content_hash") or content_hash(faction)
+        history = await self.revisions.find(
+            {"faction_id": faction_id}, sort=[("seq", DESCENDING)], limit=self.limit,
+        ).to_list(None)
+        if history and history[0]["hash"] == current:
+            return False
+
+        seq = history[0]["seq"] + 1 if history else 1
+        operations: List[Any] = [ReplaceOne(
+            {"id": _revision_id(faction_id, current)},
+            {
+                "id": _revision_id(faction_id, current),
+                "faction_id": faction_id,
+                "hash": current,
+                "seq": seq,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "document": faction,
+                "current_hash": current,
+                "patch_to_current": [],
+            },
+            upsert=True,
+        )]
+        # Keep the newest `limit` sequence numbers; a faction reverted to an
+        # earlier content reuses (and renumbers) that revision's document
+        oldest_kept = seq - self.limit + 1
+        stale = [rev for rev in history if rev["hash"] != current and rev["seq"] >= oldest_kept]
+        if stale:
+            patches = await execution.run(patches_to, [rev["document"] for rev in stale], faction, kind=PROCESS)
+            for rev, patch in zip(stale, patches):
+                operations.append(UpdateOne({"id": rev["id"]}, {"$set": {
+                    "current_hash": current,
+                    "patch_to_current": patch,
+                }}))
+        await self.revisions.bulk_write(operations)
+        await self.revisions.delete_many({"faction_id": faction_id, "seq": {"$lt": oldest_kept}})
+        logger.info(f"Recorded faction {faction_id} revision {seq} ({current[:12]})")
+        return True
+
+    async def changes(self, faction: Dict[str, Any], since: str) -> Optional[List[Dict[str, Any]]]:
+        """JSON Patch from revision `since` to the faction's current content, or None if unknown"""
+        current = faction.get("content_hash") or content_hash(faction)
+        if since == current:
+            return []
+        revision = await self.revisions.get(_revision_id(faction["id"], since))
+        if revision is None:
+            return None
+        if revision["current_hash"] == current:
+            return revision["patch_to_current"]
+        # The faction was written without going through record(); diff now and cache it
+        patch = await execution.run(make_patch, revision["document"], faction, kind=PROCESS)
+        await self.revisions.update_one(
+            {"id": revision["id"]}, {"$set": {"current_hash": current, "patch_to_current": patch}},
+        )
+        return patch
+
+    async def find(self, hash_prefix: str) -> Optional[Dict[str, Any]]:
+        """A kept revision whose hash starts with the given hex prefix"""
+        # Hashes are lowercase hex, so a prefix is the range [prefix, prefix + "g")
+        return await self.revisions.find_one({"hash": {"$gte": hash_prefix, "$lt": hash_prefix + "g"}})
+
+    async def forget(self, faction_id: str) -> None:
+        await self.revisions.delete_many({"faction_id": faction_id})
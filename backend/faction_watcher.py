@@ -0,0 +1,213 @@
+"""Watching the faction data directory for edited JSON files.
+
+``DirectoryWatcher`` reports changed ``*.json`` files in a directory to an
+async callback. On Linux it uses inotify (through ctypes, no extra
+dependency) and wakes only when a file is written, moved in or removed;
+elsewhere, or if inotify is unavailable, it polls the directory's
+modification times. Changes are debounced: the callback runs once the
+directory has been quiet for ``debounce`` seconds, with every path touched
+in the meantime, so an editor's save-and-rename or a bulk copy is one
+reload.
+
+``read_faction_files`` parses files and stamps their content hash; it does
+blocking I/O and is meant to run in an executor.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from faction_history import stamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+def read_faction_files(paths: Iterable[Path]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Parsed, hash-stamped factions, and an error message per unreadable file"""
+    factions, errors = [], {}
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                faction = json.load(f)
+            if not isinstance(faction, dict) or not faction.get("faction") or not faction.get("game"):
+                raise ValueError("not a faction document (needs faction and game)")
+        except FileNotFoundError:
+            continue  # removed since the change was seen
+        except (OSError, ValueError) as e:
+            errors[str(path)] = str(e)
+            continue
+        faction.pop("id", None)
+        factions.append(stamp(faction))
+    return factions, errors
+
+
+def _watched(name: str) -> bool:
+    return name.endswith(".json") and not name.startswith(".")
+
+
+# ===== INOTIFY =====
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding: one watch, events read without blocking"""
+
+    def __init__(self, directory: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def read(self) -> Tuple[Set[str], bool]:
+        """Names of changed entries, and whether the kernel queue overflowed"""
+        names, overflow = set(), False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return names, overflow
+            pos = 0
+            while pos + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = data[pos:pos + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+                pos += length
+                overflow |= bool(mask & IN_Q_OVERFLOW)
+                if name:
+                    names.add(name)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# ===== WATCHER =====
+
+class DirectoryWatcher:
+    def __init__(self, directory: Path, on_change: Callable[[List[Path]], Awaitable[Any]],
+                 debounce: float = DEFAULT_DEBOUNCE, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 use_inotify: bool = True):
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.mode: Optional[str] = None
+        self.reloads = 0
+        self._pending: Set[str] = set()
+        self._last_event = 0.0
+        self._inotify: Optional[Inotify] = None
+        self._poller: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self.directory.is_dir():
+            logger.warning(f"Not watching {self.directory}: no such directory")
+            return
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify(self.directory)
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_inotify)
+                self.mode = "inotify"
+            except (OSError, AttributeError, NotImplementedError) as e:
+                # No inotify (not Linux, watch limit reached, ...); poll instead
+                logger.info(f"inotify unavailable ({e}), polling {self.directory}")
+                if self._inotify:
+                    self._inotify.close()
+                    self._inotify = None
+        if self._inotify is None:
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+            self.mode = "poll"
+        logger.info(f"Watching {self.directory} for faction changes ({self.mode})")
+
+    async def close(self) -> None:
+        if self._inotify:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+        for task in (self._poller, self._flusher):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._poller = self._flusher = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "directory": str(self.directory), "reloads": self.reloads,
+                "pending": len(self._pending)}
+
+    def _on_inotify(self) -> None:
+        names, overflow = self._inotify.read()
+        if overflow:
+            # Events were dropped; treat every file as changed
+            names |= {entry.name for entry in os.scandir(self.directory)}
+        self._changed(names)
+
+    def _changed(self, names: Iterable[str]) -> None:
+        names = {name for name in names if _watched(name)}
+        if not names:
+            return
+        loop = asyncio.get_running_loop()
+        self._pending |= names
+        self._last_event = loop.time()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_when_quiet())
+
+    async def _flush_when_quiet(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            due = self._last_event + self.debounce
+            if loop.time() < due:
+                await asyncio.sleep(due - loop.time())
+                continue
+            names, self._pending = self._pending, set()
+            try:
+                await self.on_change(sorted(self.directory / name for name in names))
+                self.reloads += 1
+            except Exception as e:
+                logger.error(f"Reloading changed faction files failed: {e}")
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for entry in os.scandir(self.directory):
+            if _watched(entry.name):
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.name] = (info.st_mtime_ns, info.st_size)
+        return snapshot
+
+    async def _poll(self) -> None:
+        loop = asyncio.get_running_loop()
+        previous = await loop.run_in_executor(None, self._snapshot)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                current = await loop.run_in_executor(None, self._snapshot)
+            except OSError as e:
+                logger.error(f"Polling {self.directory} failed: {e}")
+                continue
+            changed = {name for name in current.keys() | previous.keys() if current.get(name) != previous.get(name)}
+            previous = current
+            self._changed(changed)
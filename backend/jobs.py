@@ -0,0 +1,168 @@
+"""Bounded background job queue for faction imports.
+
+``JobQueue`` runs submitted coroutines on a fixed number of worker tasks
+and records each job's status, timings, result and error in the ``jobs``
+collection, so any worker process can answer a status request. The queue
+has a fixed capacity: ``submit`` raises ``QueueFull`` (with a Retry-After
+estimate) instead of letting a burst of imports pile up behind the
+request path.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+
+class QueueFull(Exception):
+    """The job queue is at capacity; retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobError(Exception):
+    """Expected job failure (bad input); recorded without a traceback"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobQueue:
+    def __init__(self, storage, workers: int = 2, max_queued: int = 16, retention: timedelta = timedelta(days=1)):
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.max_queued = max(1, max_queued)
+        self.retention = retention
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # Jobs this process has queued or is running, by id
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._recent_run_times: Deque[float] = deque(maxlen=20)
+
+    @property
+    def jobs(self):
+        return self.storage.collection("jobs")
+
+    def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def prune(self) -> int:
+        """Drop records of jobs that finished longer than `retention` ago"""
+        cutoff = (_now() - self.retention).isoformat()
+        result = await self.jobs.delete_many({"finished_at": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def close(self) -> None:
+        """Stop the workers; jobs still queued or running are recorded as failed"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        for job in list(self._active.values()):
+            await self._finish(job, error="Interrupted by server shutdown")
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up"""
+        average = sum(self._recent_run_times) / len(self._recent_run_times) if self._recent_run_times else 1.0
+        queued = self._queue.qsize() if self._queue else self.max_queued
+        return max(1, min(60, round(average * queued / self.workers)))
+
+    async def submit(self, kind: str, run: Callable[[], Awaitable[Dict[str, Any]]], **meta) -> Dict[str, Any]:
+        """Queue run() and return its job record; raises QueueFull at capacity"""
+        if self._queue is None or self._queue.full():
+            raise QueueFull(self.retry_after())
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "status": QUEUED,
+            **meta,
+            "created_at": _now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_ms": None,
+            "run_ms": None,
+            "result": None,
+            "error": None,
+        }
+        await self.jobs.insert_one(dict(job))
+        try:
+            self._queue.put_nowait((job, run))
+        except (asyncio.QueueFull, AttributeError):
+            # Filled up (or shut down) while the record was being written
+            await self.jobs.delete_one({"id": job["id"]})
+            raise QueueFull(self.retry_after())
+        self._active[job["id"]] = job
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        active = self._active.get(job_id)
+        if active is not None:
+            return dict(active)
+        return await self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        running = sum(1 for job in self._active.values() if job["status"] == RUNNING)
+        return {
+            "workers": self.workers,
+            "capacity": self.max_queued,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": running,
+        }
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        while True:
+            job, run = await queue.get()
+            try:
+                await self._execute(job, run)
+            finally:
+                queue.task_done()
+
+    async def _execute(self, job: Dict[str, Any], run: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        started = _now()
+        job.update(status=RUNNING, started_at=started.isoformat(),
+                   queue_ms=round((started - datetime.fromisoformat(job["created_at"])).total_seconds() * 1000, 1))
+        await self.jobs.update_one({"id": job["id"]}, {"$set": {
+            "status": RUNNING, "started_at": job["started_at"], "queue_ms": job["queue_ms"],
+        }})
+        clock = time.perf_counter()
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            raise
+        except JobError as e:
+            await self._finish(job, error=str(e), run_seconds=time.perf_counter() - clock)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} ({job['kind']}) failed")
+            await self._finish(job, error=str(e), run_seconds=time.perf_counter() - clock)
+        else:
+            await self._finish(job, result=result, run_seconds=time.perf_counter() - clock)
+
+    async def _finish(self, job: Dict[str, Any], result: Any = None, error: Optional[str] = None,
+                      run_seconds: Optional[float] = None) -> None:
+        self._active.pop(job["id"], None)
+        if run_seconds is not None:
+            self._recent_run_times.append(run_seconds)
+        update = {
+            "status": FAILED if error else SUCCEEDED,
+            "finished_at": _now().isoformat(),
+            "run_ms": round(run_seconds * 1000, 1) if run_seconds is not None else None,
+            "result": result,
+            "error": error,
+        }
+        job.update(update)
+        await self.jobs.update_one({"id": job["id"]}, {"$set": update})
@@ -0,0 +1,134 @@
+"""Minimal RFC 6902 JSON Patch: diff two documents and apply patches.
+
+``make_patch`` emits only ``add``, ``remove`` and ``replace`` operations.
+Arrays are diffed after trimming their common prefix and suffix, so
+inserting or removing one unit in the middle of a faction produces a single
+operation instead of shifting every following element.
+"""
+
+import copy
+from typing import Any, Dict, List
+
+
+class JsonPatchError(Exception):
+    """A patch could not be applied to the target document"""
+
+
+def escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def json_equal(a: Any, b: Any) -> bool:
+    """Equality of JSON values: unlike ==, 1, 1.0 and True all differ"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(json_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _diff(src: Any, dst: Any, path: str, ops: List[Dict[str, Any]]) -> None:
+    if isinstance(src, dict) and isinstance(dst, dict):
+        for key in src:
+            if key not in dst:
+                ops.append({"op": "remove", "path": f"{path}/{escape(key)}"})
+        for key, value in dst.items():
+            if key not in src:
+                ops.append({"op": "add", "path": f"{path}/{escape(key)}", "value": copy.deepcopy(value)})
+            else:
+                _diff(src[key], value, f"{path}/{escape(key)}", ops)
+    elif isinstance(src, list) and isinstance(dst, list):
+        start = 0
+        while start < min(len(src), len(dst)) and json_equal(src[start], dst[start]):
+            start += 1
+        end_src, end_dst = len(src), len(dst)
+        while end_src > start and end_dst > start and json_equal(src[end_src - 1], dst[end_dst - 1]):
+            end_src -= 1
+            end_dst -= 1
+        common = min(end_src, end_dst) - start
+        for i in range(start, start + common):
+            _diff(src[i], dst[i], f"{path}/{i}", ops)
+        for i in range(start + common, end_dst):
+            ops.append({"op": "add", "path": f"{path}/{i}", "value": copy.deepcopy(dst[i])})
+        for _ in range(start + common, end_src):
+            ops.append({"op": "remove", "path": f"{path}/{start + common}"})
+    elif not json_equal(src, dst):
+        ops.append({"op": "replace", "path": path, "value": copy.deepcopy(dst)})
+
+
+def make_patch(src: Any, dst: Any) -> List[Dict[str, Any]]:
+    """Operations that turn src into dst"""
+    ops: List[Dict[str, Any]] = []
+    _diff(src, dst, "", ops)
+    return ops
+
+
+def _resolve(doc: Any, pointer: str):
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    tokens = [unescape(t) for t in pointer[1:].split("/")]
+    parent = doc
+    for token in tokens[:-1]:
+        try:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise JsonPatchError(f"Path not found: {pointer}")
+    return parent, tokens[-1]
+
+
+def apply_patch(doc: Any, patch: List[Dict[str, Any]]) -> Any:
+    """Apply add/remove/replace/test operations, returning a new document"""
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        kind, pointer = op.get("op"), op.get("path", "")
+        if pointer == "":
+            if kind in ("add", "replace"):
+                doc = copy.deepcopy(op["value"])
+                continue
+            if kind == "test":
+                if not json_equal(doc, op["value"]):
+                    raise JsonPatchError("Test failed at document root")
+                continue
+            raise JsonPatchError(f"Cannot {kind} the document root")
+        parent, token = _resolve(doc, pointer)
+        try:
+            if isinstance(parent, list):
+                index = len(parent) if token == "-" else int(token)
+                if kind == "add":
+                    if index > len(parent):
+                        raise IndexError(index)
+                    parent.insert(index, copy.deepcopy(op["value"]))
+                elif kind == "remove":
+                    del parent[index]
+                elif kind == "replace":
+                    parent[index] = copy.deepcopy(op["value"])
+                elif kind == "test":
+                    if not json_equal(parent[index], op["value"]):
+                        raise JsonPatchError(f"Test failed at {pointer}")
+                else:
+                    raise JsonPatchError(f"Unsupported operation: {kind}")
+            elif isinstance(parent, dict):
+                if kind == "add":
+                    parent[token] = copy.deepcopy(op["value"])
+                elif kind == "remove":
+                    del parent[token]
+                elif kind == "replace":
+                    if token not in parent:
+                        raise KeyError(token)
+                    parent[token] = copy.deepcopy(op["value"])
+                elif kind == "test":
+                    if not json_equal(parent[token], op["value"]):
+                        raise JsonPatchError(f"Test failed at {pointer}")
+                else:
+                    raise JsonPatchError(f"Unsupported operation: {kind}")
+            else:
+                raise JsonPatchError(f"Path not found: {pointer}")
+        except (KeyError, IndexError, ValueError) as e:
+            raise JsonPatchError(f"Cannot {kind} {pointer}: {e}")
+    return doc
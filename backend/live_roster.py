@@ -0,0 +1,193 @@
+"""Server-side state of a live army editing session.
+
+A ``LiveRosterSession`` holds one army while a builder is connected. Each
+edit operation is applied to the in-memory roster and revalidated through
+``IncrementalValidator``. Only the fields of the ``ValidationResult`` that
+changed are returned. Changes are written back in debounced batches: after
+``debounce`` seconds without edits, and at least every ``max_delay`` seconds
+while edits keep coming.
+
+Edit operations (JSON objects)::
+
+    {"op": "add_unit", "unit": {...}, "index": 2}      index is optional
+    {"op": "update_unit", "unit_id": "...", "changes": {"total_cost": 140}}
+    {"op": "remove_unit", "unit_id": "..."}
+    {"op": "move_unit", "unit_id": "...", "index": 0}
+    {"op": "set", "field": "name" | "points_limit", "value": ...}
+
+Units must carry numeric costs and a known ``unit_type``; anything else is
+an ``EditError`` and leaves the roster unchanged.
+"""
+
+import asyncio
+import logging
+import math
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from army_rules import IncrementalValidator
+
+logger = logging.getLogger(__name__)
+
+
+class EditError(ValueError):
+    """The edit operation is malformed or doesn't apply to the roster"""
+
+
+# Unit types the roster rules know about (see server.ArmyUnit)
+UNIT_TYPES = ("hero", "unit")
+
+
+def _checked_unit(unit: Dict[str, Any]) -> Dict[str, Any]:
+    """The unit, if its costs and type are values the validator can total"""
+    for field in ("base_cost", "total_cost"):
+        value = unit.get(field, 0)
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            raise EditError(f"{field} must be a number")
+    if unit.get("unit_type", "unit") not in UNIT_TYPES:
+        raise EditError(f"unit_type must be one of {', '.join(UNIT_TYPES)}")
+    return unit
+
+
+class LiveRosterSession:
+    def __init__(self, army: Dict[str, Any], persist: Callable[[Dict[str, Any]], Awaitable[None]],
+                 debounce: float = 1.0, max_delay: float = 5.0):
+        self.army = army
+        self.persist = persist
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.edits = 0
+        self.writes = 0
+        # Set by the owner when a save found the army changed elsewhere
+        self.conflicted = False
+
+        units, seen = [], set()
+        for unit in army.get("units", []):
+            # The session keys units by id; give missing or repeated ids a fresh one
+            if unit.get("id") is None or unit.get("id") in seen:
+                unit = {**unit, "id": str(uuid.uuid4())}
+            seen.add(unit["id"])
+            units.append(unit)
+        self.validator = IncrementalValidator(army.get("points_limit", 1000), units)
+        self.validation = self.validator.result()
+
+        self._dirty_since: Optional[float] = None
+        self._last_edit = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+
+    def state(self) -> Dict[str, Any]:
+        """The army as it would be saved now"""
+        return {
+            **self.army,
+            "points_limit": self.validator.points_limit,
+            "units": list(self.validator.units.values()),
+            "total_points": self.validator.total_points,
+        }
+
+    def apply(self, op: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply one edit and return the changed ValidationResult fields"""
+        kind = op.get("op")
+        validator = self.validator
+        if kind == "add_unit":
+            unit = op.get("unit")
+            if not isinstance(unit, dict):
+                raise EditError("add_unit needs a unit object")
+            unit = {**unit, "id": unit.get("id") or str(uuid.uuid4())}
+            if unit["id"] in validator.units:
+                raise EditError(f"Unit {unit['id']} is already in the roster")
+            validator.put(_checked_unit(unit), self._index(op, len(validator.units)))
+        elif kind == "update_unit":
+            unit = self._unit(op)
+            changes = op.get("changes")
+            if not isinstance(changes, dict) or "id" in changes:
+                raise EditError("update_unit needs a changes object that doesn't touch the id")
+            validator.put(_checked_unit({**unit, **changes}))
+        elif kind == "remove_unit":
+            validator.remove(self._unit(op)["id"])
+        elif kind == "move_unit":
+            unit = self._unit(op)
+            validator.move(unit["id"], self._index(op, len(validator.units) - 1, required=True))
+        elif kind == "set":
+            field, value = op.get("field"), op.get("value")
+            if field == "points_limit":
+                if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                    raise EditError("points_limit must be a positive integer")
+                validator.set_points_limit(value)
+            elif field == "name":
+                if not isinstance(value, str) or not value.strip():
+                    raise EditError("name must be a non-empty string")
+                self.army["name"] = value
+            else:
+                raise EditError(f"Field {field!r} can't be edited live")
+        else:
+            raise EditError(f"Unknown edit operation {kind!r}")
+
+        self.edits += 1
+        self._mark_dirty()
+        result = validator.result()
+        delta = {key: value for key, value in result.items() if self.validation.get(key) != value}
+        self.validation = result
+        return delta
+
+    def _unit(self, op: Dict[str, Any]) -> Dict[str, Any]:
+        unit = self.validator.units.get(op.get("unit_id"))
+        if unit is None:
+            raise EditError(f"Unit {op.get('unit_id')!r} is not in the roster")
+        return unit
+
+    def _index(self, op: Dict[str, Any], last: int, required: bool = False) -> Optional[int]:
+        index = op.get("index")
+        if index is None and not required:
+            return None
+        if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index <= last:
+            raise EditError(f"index must be between 0 and {last}")
+        return index
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty_since is not None
+
+    def _mark_dirty(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._last_edit = loop.time()
+        if self._dirty_since is None:
+            self._dirty_since = self._last_edit
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_when_quiet())
+
+    async def _flush_when_quiet(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._dirty_since is not None:
+            due = min(self._last_edit + self.debounce, self._dirty_since + self.max_delay)
+            if loop.time() >= due:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # Still dirty; try again after another debounce period
+                    logger.error(f"Saving live roster {self.army.get('id')} failed: {e}")
+                    self._last_edit = self._dirty_since = loop.time()
+            else:
+                await asyncio.sleep(due - loop.time())
+
+    async def flush(self) -> None:
+        """Write pending edits now"""
+        if self._dirty_since is None:
+            return
+        # Edits arriving during the write mark the session dirty again
+        dirty_since, self._dirty_since = self._dirty_since, None
+        try:
+            await self.persist(self.state())
+        except BaseException:
+            if self._dirty_since is None:
+                self._dirty_since = dirty_since
+            raise
+        self.writes += 1
+
+    async def close(self, save: bool = True) -> None:
+        """Stop the debounce timer and write anything still pending (drop it if not `save`)"""
+        if self._flusher is not None and self._flusher is not asyncio.current_task():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        if not save:
+            self._dirty_since = None
+        await self.flush()
@@ -0,0 +1,249 @@
+"""On-demand profiling of individual requests.
+
+A request is profiled when it carries the profiling token (``X-Profile``
+header or ``profile`` query parameter), or, with sampling enabled, when it
+is the Nth request to its route. The mode comes from ``X-Profile-Mode`` /
+``profile_mode``, or the configured default:
+
+- ``sample``: a background thread snapshots the event loop thread's stack
+  every ``interval`` and keeps only the samples taken inside this request's
+  call, so requests running concurrently don't show up in its profile. The
+  result is written as collapsed stacks (``.folded``), which speedscope and
+  flamegraph.pl open directly.
+- ``cprofile``: deterministic cProfile of the event loop thread while the
+  request runs, written as a pstats file (``.prof``). Other requests running
+  at the same time are included, and the overhead is much higher.
+
+Work handed to an executor, including plain ``def`` endpoints that FastAPI
+runs in its threadpool, happens on other threads and is not captured.
+
+Each capture gets a JSON sidecar (route, status, duration, samples) for
+``ProfileStore.list``. Paths under an ``exclude`` prefix (the admin
+endpoints serving the captures) are never profiled, so reading the
+captures doesn't push real ones out of the store.
+``ProfilingMiddleware`` is only installed when
+profiling is configured. Even then, an unprofiled request pays one header
+scan, plus a counter increment per route when sampling.
+"""
+
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+MODES = {"sample": ".folded", "cprofile": ".prof"}
+MEDIA_TYPES = {".folded": "text/plain; charset=utf-8", ".prof": "application/octet-stream"}
+_NAME = re.compile(r"^[\w-]+\.(folded|prof|json)$")
+
+
+# ===== PROFILERS =====
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one thread's stack, counting only stacks running below ``anchor``"""
+
+    def __init__(self, anchor, thread_id: int, interval: float):
+        self.anchor = anchor
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame)
+                if frame is self.anchor:
+                    break
+                frame = frame.f_back
+            else:
+                continue  # the loop was busy with another request, or idle
+            self.samples[";".join(_label(f) for f in reversed(stack))] += 1
+
+    def write(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class DeterministicProfiler:
+    """cProfile for the calling thread"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.samples = None
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def write(self, path: Path) -> None:
+        self.profile.dump_stats(str(path))
+
+
+# ===== STORE =====
+
+class ProfileStore:
+    """Capture files in one directory, newest ``keep`` kept"""
+
+    def __init__(self, directory: Path, keep: int = 200):
+        self.directory = Path(directory)
+        self.keep = keep
+
+    def save(self, meta: Dict[str, Any], suffix: str, write: Callable[[Path], None]) -> Dict[str, Any]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^\w]+", "_", f"{meta['method']}_{meta['route']}").strip("_")[:60]
+        stem = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(meta['started']))}-{slug}-{uuid.uuid4().hex[:8]}"
+        path = self.directory / f"{stem}{suffix}"
+        write(path)
+        meta = {**meta, "name": path.name, "size": path.stat().st_size}
+        (self.directory / f"{stem}.json").write_text(json.dumps(meta), encoding="utf-8")
+        self._prune()
+        return meta
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Capture metadata, newest first"""
+        if not self.directory.is_dir():
+            return []
+        captures = []
+        for sidecar in self.directory.glob("*.json"):
+            try:
+                captures.append(json.loads(sidecar.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue  # being pruned or written
+        return sorted(captures, key=lambda meta: meta["started"], reverse=True)
+
+    def path(self, name: str) -> Optional[Path]:
+        """The capture file called ``name``, or None (names never leave the directory)"""
+        if not _NAME.match(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+    def _prune(self) -> None:
+        sidecars = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime_ns, reverse=True)
+        for sidecar in sidecars[self.keep:]:
+            for path in self.directory.glob(f"{sidecar.stem}.*"):
+                path.unlink(missing_ok=True)
+
+
+# ===== MIDDLEWARE =====
+
+def route_template(routes) -> Callable[[Dict[str, Any]], str]:
+    """Map an ASGI scope to the path template of the route it matches"""
+    from starlette.routing import Match
+
+    def key(scope: Dict[str, Any]) -> str:
+        for route in routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return scope["path"]
+    return key
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None, sample_every: int = 0,
+                 mode: str = "sample", interval: float = 0.005, max_active: int = 4,
+                 route_key: Optional[Callable[[Dict[str, Any]], str]] = None, exclude: Tuple[str, ...] = ()):
+        self.app = app
+        self.store = store
+        self.token = token.encode() if token else None
+        self.sample_every = sample_every
+        self.mode = mode
+        self.interval = interval
+        self.max_active = max_active
+        self.route_key = route_key or (lambda scope: scope["path"])
+        self.exclude = exclude
+        self.requests: Counter = Counter()
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        requested = self._requested(scope)
+        if requested is None or self.active >= self.max_active:
+            return await self.app(scope, receive, send)
+        await self._profile(scope, receive, send, *requested)
+
+    def _requested(self, scope) -> Optional[Tuple[str, str]]:
+        """(mode, trigger) if this request should be profiled"""
+        if self.exclude and scope["path"].startswith(self.exclude):
+            return None
+        if self.token:
+            headers = dict(scope["headers"])
+            given = headers.get(b"x-profile")
+            query = {}
+            if given is None and b"profile=" in scope["query_string"]:
+                query = parse_qs(scope["query_string"].decode("latin-1"))
+                given = query.get("profile", [""])[0].encode()
+            if given is not None and hmac.compare_digest(given, self.token):
+                mode = headers.get(b"x-profile-mode", b"").decode() or query.get("profile_mode", [self.mode])[0]
+                return (mode if mode in MODES else self.mode), "token"
+        if self.sample_every:
+            route = self.route_key(scope)
+            self.requests[route] += 1
+            if self.requests[route] % self.sample_every == 0:
+                return self.mode, "sampled"
+        return None
+
+    async def _profile(self, scope, receive, send, mode: str, trigger: str):
+        status = {}
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        if mode == "cprofile":
+            profiler = DeterministicProfiler()
+        else:
+            profiler = StackSampler(sys._getframe(), threading.get_ident(), self.interval)
+        self.active += 1
+        started, clock = time.time(), time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            profiler.stop()
+            self.active -= 1
+            meta = {
+                "method": scope["method"], "path": scope["path"], "route": self.route_key(scope),
+                "status": status.get("code"), "mode": mode, "trigger": trigger, "started": started,
+                "duration_ms": round((time.perf_counter() - clock) * 1000, 2),
+                "samples": sum(profiler.samples.values()) if profiler.samples is not None else None,
+            }
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.store.save, meta, MODES[mode], profiler.write
+                )
+            except Exception as e:
+                logger.error(f"Saving profile of {scope['path']} failed: {e}")
@@ -0,0 +1,249 @@
+"""Background re-pricing of stored armies after a faction's costs change.
+
+Army rosters store each unit's ``base_cost``, the cost of every selected
+upgrade and the resulting ``total_cost``/``total_points``, so they go stale
+when a faction is re-imported with new costs. ``ArmyRepricer`` streams the
+armies of one (game, faction) in id order, re-prices them against the
+faction document in batches and writes only the armies that changed with
+one ``bulk_write`` per batch.
+
+Jobs are persisted in the ``repricing_jobs`` collection with their progress
+and the id of the last army processed, so a job interrupted by a restart
+resumes from its checkpoint (``resume``). A semaphore bounds how many jobs
+run at once and each batch yields to the event loop, keeping the request
+path responsive while 100k armies are re-priced.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import ASCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+PENDING, RUNNING, COMPLETED, FAILED, SUPERSEDED = "pending", "running", "completed", "failed", "superseded"
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _at_revision(revision: int) -> Dict[str, Any]:
+    # Armies saved before revisions existed have no field, which counts as 0
+    if revision == 0:
+        return {"$or": [{"revision": 0}, {"revision": {"$exists": False}}]}
+    return {"revision": revision}
+
+
+# ===== PRICING =====
+
+class PriceList:
+    """Unit and upgrade option costs of one faction, by name"""
+
+    def __init__(self, faction: Dict[str, Any]):
+        self.units: Dict[str, Tuple[int, Dict[Tuple[str, str], int]]] = {}
+        for unit in faction.get("units", []):
+            name = unit.get("name")
+            if name in self.units or "base_cost" not in unit:
+                continue
+            options = {}
+            for group in unit.get("upgrade_groups", []):
+                for option in group.get("options", []):
+                    options.setdefault((group.get("group"), option.get("name")), option.get("cost", 0))
+            self.units[name] = (unit["base_cost"], options)
+
+    def price_unit(self, roster_unit: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The roster unit with current costs, or None if the unit isn't in the faction"""
+        prices = self.units.get(roster_unit.get("unit_name"))
+        if prices is None:
+            return None
+        base_cost, options = prices
+        upgrades = []
+        for upgrade in roster_unit.get("selected_upgrades", []):
+            cost = options.get((upgrade.get("group"), upgrade.get("option_name")))
+            # Keep the recorded cost of options the faction no longer offers
+            upgrades.append(upgrade if cost is None else {**upgrade, "cost": cost})
+        # The client owns the cost model (combined units and so on), so the
+        # recorded total only moves by what the base and upgrade costs moved
+        old_costs = roster_unit.get("base_cost", 0) + sum(u.get("cost", 0) for u in roster_unit.get("selected_upgrades", []))
+        new_costs = base_cost + sum(upgrade.get("cost", 0) for upgrade in upgrades)
+        total = roster_unit.get("total_cost", old_costs) + new_costs - old_costs
+        return {**roster_unit, "base_cost": base_cost, "selected_upgrades": upgrades, "total_cost": total}
+
+    def price_army(self, army: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        """$set fields bringing the army up to date (empty if current) and the count of unknown units"""
+        units, unmatched = [], 0
+        for roster_unit in army.get("units", []):
+            priced = self.price_unit(roster_unit)
+            if priced is None:
+                unmatched += 1
+                priced = roster_unit
+            units.append(priced)
+        total_points = sum(u.get("total_cost", u.get("base_cost", 0)) for u in units)
+        if units == army.get("units", []) and total_points == army.get("total_points"):
+            return {}, unmatched
+        return {"units": units, "total_points": total_points}, unmatched
+
+
+# ===== JOBS =====
+
+class ArmyRepricer:
+    """Runs and tracks re-pricing jobs; at most max_concurrent run at a time"""
+
+    def __init__(self, storage, batch_size: int = DEFAULT_BATCH_SIZE, max_concurrent: int = 1,
+                 batch_pause: float = 0.0):
+        self.storage = storage
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = batch_pause
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def jobs(self):
+        return self.storage.collection("repricing_jobs")
+
+    async def start(self, faction: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a job re-pricing every army of the faction; supersedes active jobs for it"""
+        key = {"game": faction.get("game"), "faction": faction.get("faction")}
+        for job in await self.jobs.find({**key, "status": {"$in": list(ACTIVE_STATUSES)}}).to_list(None):
+            task = self._tasks.pop(job["id"], None)
+            if task:
+                task.cancel()
+            await self.jobs.update_one({"id": job["id"]}, {"$set": {"status": SUPERSEDED, "updated_at": _now()}})
+
+        job = {
+            "id": str(uuid.uuid4()),
+            **key,
+            "faction_id": faction.get("id"),
+            "content_hash": faction.get("content_hash"),
+            "status": PENDING,
+            "total": await self.storage.armies.count_documents(key),
+            "processed": 0,
+            "updated": 0,
+            "conflicts": 0,
+            "unmatched_units": 0,
+            "checkpoint": None,
+            "created_at": _now(),
+            "updated_at": _now(),
+            "finished_at": None,
+            "error": None,
+        }
+        await self.jobs.insert_one(job)
+        self._spawn(job["id"])
+        return job
+
+    async def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.jobs.get(job_id)
+        if job:
+            job["progress"] = round(job["processed"] / job["total"], 4) if job["total"] else 1.0
+        return job
+
+    async def resume(self) -> int:
+        """Restart jobs a previous process left pending or running, from their checkpoints"""
+        resumed = 0
+        for job in await self.jobs.find({"status": {"$in": list(ACTIVE_STATUSES)}}).to_list(None):
+            if job["id"] not in self._tasks:
+                self._spawn(job["id"])
+                resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} army re-pricing job(s)")
+        return resumed
+
+    async def close(self) -> None:
+        """Stop running jobs; they stay active in storage and resume on next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def wait(self, job_id: str) -> None:
+        task = self._tasks.get(job_id)
+        if task:
+            await asyncio.gather(task, return_exceptions=True)
+
+    def _spawn(self, job_id: str) -> None:
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None) if self._tasks.get(job_id) is task else None)
+
+    async def _run(self, job_id: str) -> None:
+        async with self._semaphore:
+            job = await self.jobs.get(job_id)
+            if not job or job["status"] not in ACTIVE_STATUSES:
+                return
+            try:
+                await self._reprice(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Army re-pricing job {job_id} failed: {e}")
+                await self.jobs.update_one({"id": job_id}, {"$set": {
+                    "status": FAILED, "error": str(e), "updated_at": _now(), "finished_at": _now(),
+                }})
+
+    async def _reprice(self, job: Dict[str, Any]) -> None:
+        faction = await self.storage.factions.get(job["faction_id"]) if job.get("faction_id") else None
+        if faction is None:
+            raise LookupError(f"Faction {job.get('faction_id')} not found")
+        prices = PriceList(faction)
+        await self.jobs.update_one({"id": job["id"]}, {"$set": {"status": RUNNING, "updated_at": _now()}})
+
+        query: Dict[str, Any] = {"game": job["game"], "faction": job["faction"]}
+        if job["checkpoint"]:
+            query["id"] = {"$gt": job["checkpoint"]}
+        cursor = self.storage.armies.find(
+            query, projection={"id": 1, "units": 1, "total_points": 1, "revision": 1},
+            sort=[("id", ASCENDING)], batch_size=self.batch_size,
+        )
+        batch: List[Dict[str, Any]] = []
+        async for army in cursor:
+            batch.append(army)
+            if len(batch) >= self.batch_size:
+                await self._write_batch(job, prices, batch)
+                batch = []
+                # Let request handlers run between batches
+                await asyncio.sleep(self.batch_pause)
+        if batch:
+            await self._write_batch(job, prices, batch)
+
+        await self.jobs.update_one({"id": job["id"]}, {"$set": {
+            "status": COMPLETED, "updated_at": _now(), "finished_at": _now(),
+        }})
+        logger.info(
+            f"Re-priced armies of {job['faction']} ({job['game']}): "
+            f"{job['updated']}/{job['processed']} updated, {job['conflicts']} edited meanwhile"
+        )
+
+    async def _write_batch(self, job: Dict[str, Any], prices: PriceList, armies: List[Dict[str, Any]]) -> None:
+        operations, unmatched = [], 0
+        for army in armies:
+            update, missing = prices.price_army(army)
+            unmatched += missing
+            if update:
+                # Matching the revision lets a concurrent edit by the user win;
+                # every army write bumps it, unlike updated_at which two writes
+                # in the same instant can share
+                operations.append(UpdateOne(
+                    {"id": army["id"], **_at_revision(army.get("revision", 0))},
+                    {"$set": update, "$inc": {"revision": 1}},
+                ))
+        updated = 0
+        if operations:
+            result = await self.storage.armies.bulk_write(operations, ordered=False)
+            updated = result.modified_count
+        job["processed"] += len(armies)
+        job["updated"] += updated
+        job["conflicts"] += len(operations) - updated
+        job["unmatched_units"] += unmatched
+        job["checkpoint"] = armies[-1]["id"]
+        progress = {key: job[key] for key in ("processed", "updated", "conflicts", "unmatched_units", "checkpoint")}
+        progress["updated_at"] = _now()
+        await self.jobs.update_one({"id": job["id"]}, {"$set": progress})
+        logger.info(f"Re-pricing {job['faction']}: {job['processed']}/{job['total']} armies")
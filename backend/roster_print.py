@@ -0,0 +1,213 @@
+"""Printable army rosters, as HTML or plain text.
+
+A roster is joined with its faction (unit profiles, weapons, the options
+behind each selected upgrade) and rendered through templates parsed once at
+import. Output is produced piece by piece, so the response can stream it.
+Finished renders are cached by (army id, army revision, faction content
+hash, format). Reprinting an unchanged list is a cache hit, and any edit
+or faction change makes a new key. The rule-reference appendix depends on
+the faction only, so it is rendered once per faction revision and shared by
+every roster of that faction.
+"""
+
+import html
+from string import Template
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from validation_cache import LRUCache
+
+FORMATS = {"html": "text/html; charset=utf-8", "text": "text/plain; charset=utf-8"}
+
+# ===== TEMPLATES =====
+
+HTML_TEMPLATES = {name: Template(source) for name, source in {
+    "header": (
+        '<!DOCTYPE html>\n<html lang="fr">\n<head><meta charset="utf-8"><title>$name</title></head>\n<body>\n'
+        '<header><h1>$name</h1><p>$game — $faction — $total_points / $points_limit pts</p></header>\n'
+    ),
+    "unit": (
+        '<section class="unit">\n<h2>$name [$size] <span class="cost">$cost pts</span></h2>\n'
+        '<p class="stats">Qualité $quality+ Défense $defense+</p>\n$rules$equipment$weapons$upgrades</section>\n'
+    ),
+    "rules": '<p class="rules">$rules</p>\n',
+    "equipment": '<p class="equipment">$equipment</p>\n',
+    "weapons": '<table class="weapons">\n<tr><th>Arme</th><th>Portée</th><th>Att</th><th>PA</th><th>Spécial</th></tr>\n$rows</table>\n',
+    "weapon": '<tr><td>$name</td><td>$range</td><td>A$attacks</td><td>$armor_piercing</td><td>$rules</td></tr>\n',
+    "weapon_rules": "$rules",
+    "upgrades": '<ul class="upgrades">\n$items</ul>\n',
+    "upgrade": '<li>$group : $option (+$cost pts)</li>\n',
+    "appendix": '<section class="rules-reference">\n<h2>Référence des règles</h2>\n<dl>\n$items</dl>\n</section>\n',
+    "rule": '<dt>$name</dt><dd>$description</dd>\n',
+    "footer": '</body>\n</html>\n',
+}.items()}
+
+TEXT_TEMPLATES = {name: Template(source) for name, source in {
+    "header": "$name\n$game — $faction — $total_points / $points_limit pts\n\n",
+    "unit": "$name [$size] — $cost pts\n  Qualité $quality+ Défense $defense+\n$rules$equipment$weapons$upgrades\n",
+    "rules": "  Règles : $rules\n",
+    "equipment": "  Équipement : $equipment\n",
+    "weapons": "$rows",
+    "weapon": "  - $name ($range, A$attacks, PA $armor_piercing)$rules\n",
+    "weapon_rules": " — $rules",
+    "upgrades": "$items",
+    "upgrade": "  + $group : $option (+$cost pts)\n",
+    "appendix": "Référence des règles\n\n$items",
+    "rule": "$name : $description\n",
+    "footer": "",
+}.items()}
+
+
+class _Renderer:
+    """Fills one format's templates; values are escaped for that format"""
+
+    def __init__(self, templates: Dict[str, Template], escape: Callable[[str], str]):
+        self.templates = templates
+        self.escape = escape
+
+    def fill(self, template: str, **values: Any) -> str:
+        return self.templates[template].substitute({k: self.escape(str(v)) for k, v in values.items()})
+
+    def raw(self, template: str, **parts: str) -> str:
+        # For values that are already rendered fragments
+        return self.templates[template].substitute(parts)
+
+
+RENDERERS = {
+    "html": _Renderer(HTML_TEMPLATES, html.escape),
+    "text": _Renderer(TEXT_TEMPLATES, lambda value: value),
+}
+
+
+# ===== JOINING =====
+
+def _faction_units(faction: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    units: Dict[str, Dict[str, Any]] = {}
+    for unit in faction.get("units", []):
+        units.setdefault(unit.get("name"), unit)
+    return units
+
+
+def _option(unit: Dict[str, Any], group: Optional[str], option_name: Optional[str]) -> Optional[Dict[str, Any]]:
+    for upgrade_group in unit.get("upgrade_groups", []):
+        if upgrade_group.get("group") == group:
+            for option in upgrade_group.get("options", []):
+                if option.get("name") == option_name:
+                    return option
+    return None
+
+
+def join_unit(roster_unit: Dict[str, Any], profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """What the sheet shows for one roster unit: its profile with the selected options applied"""
+    profile = profile or {}
+    rules = list(profile.get("special_rules", []))
+    equipment = list(profile.get("equipment", []))
+    weapons = list(profile.get("weapons", []))
+    for upgrade in roster_unit.get("selected_upgrades", []):
+        option = _option(profile, upgrade.get("group"), upgrade.get("option_name")) or {}
+        rules.extend(rule for rule in option.get("special_rules", []) if rule not in rules)
+        if option.get("weapon"):
+            weapons.append(option["weapon"])
+        if option.get("mount"):
+            equipment.append(option["mount"].get("name", ""))
+            rules.extend(rule for rule in option["mount"].get("special_rules", []) if rule not in rules)
+    size = profile.get("size", 1) * (2 if roster_unit.get("combined_unit") else 1)
+    return {
+        "name": roster_unit.get("unit_name", ""),
+        "size": size,
+        "cost": roster_unit.get("total_cost", roster_unit.get("base_cost", 0)),
+        "quality": profile.get("quality", "?"),
+        "defense": profile.get("defense", "?"),
+        "rules": rules,
+        "equipment": equipment,
+        "weapons": weapons,
+        "upgrades": roster_unit.get("selected_upgrades", []),
+    }
+
+
+def render_unit(renderer: _Renderer, unit: Dict[str, Any]) -> str:
+    rows = "".join(
+        renderer.raw(
+            "weapon",
+            **{k: renderer.escape(str(weapon.get(k, default)))
+               for k, default in (("name", ""), ("range", "-"), ("attacks", 0), ("armor_piercing", "-"))},
+            rules=renderer.fill("weapon_rules", rules=", ".join(weapon["special_rules"]))
+            if weapon.get("special_rules") else "",
+        )
+        for weapon in unit["weapons"]
+    )
+    items = "".join(
+        renderer.fill("upgrade", group=upgrade.get("group", ""), option=upgrade.get("option_name", ""),
+                      cost=upgrade.get("cost", 0))
+        for upgrade in unit["upgrades"]
+    )
+    return renderer.raw(
+        "unit",
+        **{k: renderer.escape(str(unit[k])) for k in ("name", "size", "cost", "quality", "defense")},
+        rules=renderer.fill("rules", rules=", ".join(unit["rules"])) if unit["rules"] else "",
+        equipment=renderer.fill("equipment", equipment=", ".join(unit["equipment"])) if unit["equipment"] else "",
+        weapons=renderer.raw("weapons", rows=rows) if rows else "",
+        upgrades=renderer.raw("upgrades", items=items) if items else "",
+    )
+
+
+def render_appendix(renderer: _Renderer, faction: Dict[str, Any]) -> str:
+    descriptions = faction.get("special_rules_descriptions", {})
+    if not descriptions:
+        return ""
+    items = "".join(
+        renderer.fill("rule", name=name, description=description)
+        for name, description in sorted(descriptions.items())
+    )
+    return renderer.raw("appendix", items=items)
+
+
+def render(army: Dict[str, Any], faction: Dict[str, Any], fmt: str,
+           appendix: Optional[str] = None) -> Iterator[str]:
+    """The printable sheet in pieces: header, one piece per unit, appendix, footer"""
+    renderer = RENDERERS[fmt]
+    yield renderer.fill(
+        "header", name=army.get("name", ""), game=army.get("game", ""), faction=army.get("faction", ""),
+        total_points=army.get("total_points", 0), points_limit=army.get("points_limit", 0),
+    )
+    profiles = _faction_units(faction)
+    for roster_unit in army.get("units", []):
+        yield render_unit(renderer, join_unit(roster_unit, profiles.get(roster_unit.get("unit_name"))))
+    yield render_appendix(renderer, faction) if appendix is None else appendix
+    yield renderer.fill("footer")
+
+
+# ===== CACHE =====
+
+class RosterPrinter:
+    """Renders rosters, caching whole sheets and per-faction appendices"""
+
+    def __init__(self, cache_size: int = 512, appendix_cache_size: int = 64):
+        self.sheets = LRUCache(maxsize=cache_size)
+        self.appendices = LRUCache(maxsize=appendix_cache_size)
+
+    @staticmethod
+    def key(army: Dict[str, Any], faction_hash: str, fmt: str) -> Tuple[Any, ...]:
+        return (army.get("id"), army.get("revision", 0), faction_hash, fmt)
+
+    def cached(self, army: Dict[str, Any], faction_hash: str, fmt: str) -> Optional[bytes]:
+        return self.sheets.get(self.key(army, faction_hash, fmt))
+
+    def appendix(self, faction: Dict[str, Any], faction_hash: str, fmt: str) -> str:
+        text = self.appendices.get((faction_hash, fmt))
+        if text is None:
+            text = render_appendix(RENDERERS[fmt], faction)
+            self.appendices.put((faction_hash, fmt), text)
+        return text
+
+    async def stream(self, army: Dict[str, Any], faction: Dict[str, Any], faction_hash: str,
+                     fmt: str) -> AsyncIterator[bytes]:
+        """Render and yield the sheet, caching it once it is complete"""
+        parts: List[bytes] = []
+        for piece in render(army, faction, fmt, appendix=self.appendix(faction, faction_hash, fmt)):
+            chunk = piece.encode("utf-8")
+            parts.append(chunk)
+            yield chunk
+        self.sheets.put(self.key(army, faction_hash, fmt), b"".join(parts))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sheets": self.sheets.stats(), "appendices": self.appendices.stats()}
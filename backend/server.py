@@ -1,27 +1,240 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
 import os
+import asyncio
+import gzip
+import hmac
 import json
 import logging
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable, Literal, Tuple
 import uuid
 from datetime import datetime, timezone
+from functools import lru_cache
+
+from storage import ASCENDING, DESCENDING, DeleteOne, DuplicateKeyError, InsertOne, ReplaceOne, UpdateOne, create_storage, prefix_range
+from catalog_snapshot import SnapshotStore
+from compact_catalog import CompactCatalog
+from faction_history import FactionHistory, content_hash, stamp
+from faction_diff import diff_faction
+from repricing import ArmyRepricer
+from jobs import JobError, JobQueue, QueueFull
+from singleflight import SingleFlight
+from validation_cache import LRUCache, in_roster_order, roster_fingerprint
+from army_rules import calculate_army_points, validate_roster
+from live_roster import EditError, LiveRosterSession
+from army_transfer import export_ndjson, import_ndjson
+from usage_stats import ARMY_FIELDS, UsageStats
+from roster_print import FORMATS as PRINT_FORMATS, RosterPrinter
+from share_codes import HASH_PREFIX_BYTES, Codebook, ShareCodeError, hash_prefix
+from faction_watcher import DirectoryWatcher, read_faction_files
+from catalog_bundles import CatalogBundles
+from execution import PROCESS, DeadlineExceeded, RequestContextMiddleware, execution, offload
+from profiling import MEDIA_TYPES as PROFILE_MEDIA_TYPES, ProfileStore, ProfilingMiddleware, route_template
 
 ROOT_DIR = Path(__file__).parent
 DATA_DIR = ROOT_DIR / 'data'
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage backend: "mongo" (default), "memory" or "sqlite"
+# Mongo pool settings are read from MONGO_* variables, see connection.py
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+storage = create_storage(
+    STORAGE_BACKEND,
+    sqlite_path=os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'army_forge.sqlite3')),
+)
+
+# Memory-mapped catalog snapshot shared by all workers on a host
+# (see catalog_snapshot.py); disabled unless CATALOG_SNAPSHOT_PATH is set
+CATALOG_SNAPSHOT_PATH = os.environ.get('CATALOG_SNAPSHOT_PATH')
+catalog_snapshot = SnapshotStore(Path(CATALOG_SNAPSHOT_PATH)) if CATALOG_SNAPSHOT_PATH else None
+
+# Compact, deduplicated in-process copy of every faction (see compact_catalog.py)
+faction_catalog = CompactCatalog()
+# Every faction write bumps a generation counter in storage; a worker whose
+# catalog, hashes and bundles were built from an older generation reloads
+# them. Checked at most every CATALOG_CHECK_INTERVAL_MS per worker
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL_MS', '1000')) / 1000
+catalog_generation: Optional[int] = None
+catalog_checked_at = 0.0
+catalog_reloading = asyncio.Lock()
+# This worker's own faction writes mark the catalog stale and reload it once
+# after CATALOG_RELOAD_DEBOUNCE_MS of quiet, so importing N factions in a row
+# rebuilds the catalog, bundles and snapshot about once rather than N times.
+# A read that finds it stale reloads right away (read-your-writes)
+CATALOG_RELOAD_DEBOUNCE = float(os.environ.get('CATALOG_RELOAD_DEBOUNCE_MS', '200')) / 1000
+catalog_stale = False
+catalog_reload_task: Optional[asyncio.Task] = None
+# Rendered JSON bodies served from faction_catalog; dropped whenever it is rebuilt
+catalog_bodies = LRUCache(maxsize=int(os.environ.get('CATALOG_BODY_CACHE_SIZE', '256')))
+# (game, faction name) -> content_hash, for roster fingerprints
+faction_hashes: Dict[tuple, str] = {}
+# Gzipped per-game bundles of every faction, rebuilt with the catalog (see catalog_bundles.py)
+catalog_bundles = CatalogBundles()
+
+# Validation results by roster fingerprint (see validation_cache.py)
+validation_cache = LRUCache(maxsize=int(os.environ.get('VALIDATION_CACHE_SIZE', '4096')))
+
+# Content-hashed revisions per faction, with cached JSON Patch deltas for
+# clients (see faction_history.py)
+faction_history = FactionHistory(storage, limit=int(os.environ.get('FACTION_HISTORY_LIMIT', '20')))
+
+# Background re-pricing of stored armies when faction costs change (see repricing.py)
+army_repricer = ArmyRepricer(
+    storage,
+    batch_size=int(os.environ.get('REPRICING_BATCH_SIZE', '500')),
+    max_concurrent=int(os.environ.get('REPRICING_CONCURRENCY', '1')),
+    batch_pause=float(os.environ.get('REPRICING_BATCH_PAUSE_MS', '10')) / 1000,
+)
+
+# Faction imports run on a bounded job queue (see jobs.py); when it is full,
+# import requests are turned away with 503 + Retry-After
+import_jobs = JobQueue(
+    storage,
+    workers=int(os.environ.get('IMPORT_WORKERS', '2')),
+    max_queued=int(os.environ.get('IMPORT_QUEUE_SIZE', '16')),
+)
+
+# Concurrent identical faction reads share one storage fetch and one
+# serialization (see singleflight.py)
+faction_reads = SingleFlight(grace=float(os.environ.get('READ_COALESCING_GRACE_MS', '50')) / 1000)
+
+# Live army editing over WebSocket (see live_roster.py): edits are saved
+# after LIVE_SAVE_DEBOUNCE_MS of quiet, and at least every LIVE_SAVE_MAX_DELAY_MS
+LIVE_SAVE_DEBOUNCE = float(os.environ.get('LIVE_SAVE_DEBOUNCE_MS', '1000')) / 1000
+LIVE_SAVE_MAX_DELAY = float(os.environ.get('LIVE_SAVE_MAX_DELAY_MS', '5000')) / 1000
+live_stats = {"sessions": 0, "open_sessions": 0, "edits": 0, "writes": 0}
+
+# Dashboard counters, updated with $inc on every army write (see usage_stats.py)
+usage_stats = UsageStats(storage)
+
+# Rendered print sheets by (army, revision, faction hash, format), and rule
+# appendices by faction hash (see roster_print.py)
+roster_printer = RosterPrinter(cache_size=int(os.environ.get('PRINT_CACHE_SIZE', '512')))
+
+# Share code codebooks (see share_codes.py) by faction content hash prefix
+share_codebooks = LRUCache(maxsize=int(os.environ.get('SHARE_CODEBOOK_CACHE_SIZE', '64')))
+
+# Bulk army transfer: operations per POST /armies/bulk, and documents per
+# storage batch when exporting or importing NDJSON (see army_transfer.py)
+ARMY_BULK_LIMIT = int(os.environ.get('ARMY_BULK_LIMIT', '1000'))
+ARMY_TRANSFER_BATCH_SIZE = int(os.environ.get('ARMY_TRANSFER_BATCH_SIZE', '500'))
+# Updates of one PUT /armies batch in flight at once; defaults to half the
+# Mongo pool (MONGO_MAX_POOL_SIZE) so a large batch leaves connections for other requests
+ARMY_BATCH_CONCURRENCY = int(
+    os.environ.get('ARMY_BATCH_CONCURRENCY') or max(1, int(os.environ.get('MONGO_MAX_POOL_SIZE') or '100') // 2)
+)
+
+# Hot reload of edited faction files in DATA_DIR (see faction_watcher.py):
+# changes are applied after FACTION_WATCH_DEBOUNCE_MS of quiet; without
+# inotify the directory is polled every FACTION_WATCH_POLL_MS
+FACTION_WATCH = os.environ.get('FACTION_WATCH', 'true').lower() in ('1', 'true', 'yes')
+FACTION_WATCH_DEBOUNCE = float(os.environ.get('FACTION_WATCH_DEBOUNCE_MS', '500')) / 1000
+FACTION_WATCH_POLL = float(os.environ.get('FACTION_WATCH_POLL_MS', '2000')) / 1000
+# Every worker watches, but only the holder of the "faction_watcher" lease in
+# storage applies changes; an idle lease passes to another worker after this long
+FACTION_WATCH_LEASE = float(os.environ.get('FACTION_WATCH_LEASE_SECONDS', '60'))
+# Identifies this worker process as a lease owner
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+faction_watcher: Optional[DirectoryWatcher] = None
+
+# Request profiling (see profiling.py): requests carrying PROFILE_TOKEN in an
+# X-Profile header or ?profile= are profiled, and with PROFILE_SAMPLE_EVERY=N
+# so is every Nth request per route. Captures go to PROFILE_DIR (newest
+# PROFILE_KEEP kept). With neither set, no middleware is installed at all
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', '0'))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+# Listing or downloading captures is never profiled itself
+PROFILE_EXCLUDE = ("/api/admin/",)
+profile_store = ProfileStore(
+    Path(os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles'))),
+    keep=int(os.environ.get('PROFILE_KEEP', '200')),
+)
+
+# Process and thread pools for CPU-heavy calls (see execution.py). Calls
+# without their own deadline get EXECUTION_TIMEOUT_MS (0: none)
+EXECUTION_TIMEOUT = float(os.environ.get('EXECUTION_TIMEOUT_MS', '0')) / 1000
+execution.configure(
+    processes=int(os.environ.get('EXECUTION_PROCESSES', '2')),
+    threads=int(os.environ.get('EXECUTION_THREADS', '4')),
+    default_timeout=EXECUTION_TIMEOUT or None,
+)
+# Rosters of more than VALIDATION_OFFLOAD_UNITS units are validated in the
+# process pool; smaller ones cost less than the round trip and stay inline
+VALIDATION_OFFLOAD_UNITS = int(os.environ.get('VALIDATION_OFFLOAD_UNITS', '50'))
+VALIDATION_TIMEOUT = float(os.environ.get('VALIDATION_TIMEOUT_MS', '2000')) / 1000
+validate_off_loop = offload(PROCESS, timeout=VALIDATION_TIMEOUT)(validate_roster)
+# json.loads holds the GIL, so large faction imports are parsed in the process
+# pool; smaller ones parse faster inline than the round trip takes
+IMPORT_PARSE_OFFLOAD_BYTES = int(os.environ.get('IMPORT_PARSE_OFFLOAD_BYTES', str(256 * 1024)))
+
+WARMUP_RETRY_SECONDS = float(os.environ.get('WARMUP_RETRY_SECONDS', '5'))
+
+async def warm_up():
+    """Open the storage pool, create indexes and run warmup tasks"""
+    await storage.open()
+    try:
+        await storage.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating indexes: {e}")
+    for task in warmup_tasks:
+        try:
+            await task()
+        except Exception as e:
+            logger.error(f"Warmup task {task.__name__} failed: {e}")
+    app.state.ready = True
+    logger.info("Worker warmed up and ready")
+
+async def retry_warm_up():
+    while not app.state.ready:
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+        try:
+            await warm_up()
+        except Exception as e:
+            logger.warning(f"Warmup retry failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up before accepting traffic; stay not-ready (and retry) if storage is down"""
+    global faction_watcher
+    app.state.ready = False
+    execution.start()
+    import_jobs.start()
+    retry = None
+    try:
+        await warm_up()
+    except Exception as e:
+        logger.error(f"Warmup failed, retrying in background: {e}")
+        retry = asyncio.create_task(retry_warm_up())
+    if FACTION_WATCH:
+        faction_watcher = DirectoryWatcher(
+            DATA_DIR, reload_faction_files, debounce=FACTION_WATCH_DEBOUNCE, poll_interval=FACTION_WATCH_POLL
+        )
+        faction_watcher.start()
+    yield
+    app.state.ready = False
+    if retry:
+        retry.cancel()
+    if faction_watcher:
+        await faction_watcher.close()
+        faction_watcher = None
+    await import_jobs.close()
+    await army_repricer.close()
+    if catalog_reload_task and catalog_reload_task.get_loop() is asyncio.get_running_loop():
+        catalog_reload_task.cancel()
+        await asyncio.gather(catalog_reload_task, return_exceptions=True)
+    await execution.close()
+    await storage.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -140,6 +353,18 @@ class ArmyUpdate(BaseModel):
     name: Optional[str] = None
     points_limit: Optional[int] = None
     units: Optional[List[Dict[str, Any]]] = None
+    # Revision the client last saw; the update is refused if the army moved on
+    revision: Optional[int] = None
+
+class ArmyBatchItem(ArmyUpdate):
+    id: str
+
+class ArmyBatchUpdate(BaseModel):
+    updates: List[ArmyBatchItem]
+
+class ArmyBulk(BaseModel):
+    create: List[ArmyCreate] = []
+    delete: List[str] = []
 
 # Validation models
 class ValidationError(BaseModel):
@@ -156,433 +381,21 @@ class ValidationResult(BaseModel):
 
 # ===== GAME DATA =====
 
-GAMES = [
-    {
-        "id": "grimdark-future",
-        "name": "Grimdark Future",
-        "short_name": "GF",
-        "description": "Sci-fi wargame in a dark future where there is only war",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/4yhnbky1_gf_cover.jpg"
-    },
-    {
-        "id": "grimdark-future-firefight",
-        "name": "Grimdark Future Firefight",
-        "short_name": "GFF",
-        "description": "Small-scale skirmish battles in the grimdark future",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/x3uaye60_gff_cover.jpg"
-    },
-    {
-        "id": "grimdark-future-squad",
-        "name": "Grimdark Future Squad",
-        "short_name": "GFSQ",
-        "description": "Squad-based tactical combat in the grimdark future",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/n649vrml_gfsq_cover.jpg"
-    },
-    {
-        "id": "age-of-fantasy",
-        "name": "Age of Fantasy",
-        "short_name": "AoF",
-        "description": "Fantasy wargame with magic, monsters and epic battles",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/ef8vm2eh_aof_cover.jpg"
-    },
-    {
-        "id": "age-of-fantasy-regiments",
-        "name": "Age of Fantasy Regiments",
-        "short_name": "AoFR",
-        "description": "Ranked combat fantasy wargame with massive armies",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/egkkuekh_aofr_cover.jpg"
-    },
-    {
-        "id": "age-of-fantasy-skirmish",
-        "name": "Age of Fantasy Skirmish",
-        "short_name": "AoFS",
-        "description": "Small-scale skirmish battles in a fantasy world",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/mnmh2se3_aofs_cover.jpg"
-    },
-    {
-        "id": "age-of-fantasy-quest",
-        "name": "Age of Fantasy Quest",
-        "short_name": "AoFQ",
-        "description": "Cooperative dungeon crawling adventure game",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/00yl2v7x_aofq_cover.jpg"
-    },
-    {
-        "id": "warfleets-ftl",
-        "name": "Warfleets: FTL",
-        "short_name": "FTL",
-        "description": "Space fleet combat and interstellar warfare",
-        "image": "https://customer-assets.emergentagent.com/job_tabletop-roster/artifacts/gk19bhic_ftl_cover.jpg"
-    }
-]
-
-# Sample faction data to seed
-SAMPLE_FACTIONS = [
-    {
-        "faction": "Disciples de la Guerre",
-        "game": "Age of Fantasy",
-        "version": "FR-3.5.2",
-        "status": "complete",
-        "description": "Les Disciples de la Guerre sont une faction brutale et impitoyable, composée de guerriers fanatiques et de monstres déchaînés.",
-        "special_rules_descriptions": {
-            "Warbound [Guerrier-né]": "Les ennemis qui lancent les dés pour bloquer les touches infligées par les armes de cette figurine subissent une blessure supplémentaire pour chaque résultat non modifié de 1 obtenu.",
-            "Bloodthirsty Fighter [Combattant sanguinaire]": "Pour chaque résultat de 1 non modifié obtenu par les ennemis lorsqu'ils bloquent les touches portées par les armes de cette figurine en mêlée, cette figurine peut effectuer un jet d'attaque supplémentaire."
-        },
-        "spells": {
-            "Terrifying Fury [Fureur terrifiante]": {"cost": 1, "description": "Choisissez une unité ennemie à 18\" ou moins, qui doit effectuer un Test de Moral.", "range": "18\"", "target": "1 unité ennemie"},
-            "Flame of Destruction [Flammes de la destruction]": {"cost": 1, "description": "Choisissez une unité ennemie à 18\" ou moins, qui subit une touche avec Explosion (3).", "range": "18\"", "target": "1 unité ennemie"},
-            "Fiery Protection [Protection ardente]": {"cost": 2, "description": "Choisissez jusqu'à deux unités amies à 12\" ou moins, qui obtiennent Esquive en mêlée.", "range": "12\"", "target": "jusqu'à 2 unités amies"},
-            "Brutal Massacre [Massacre brutal]": {"cost": 2, "description": "Choisissez une unité ennemie à 6\" ou moins qui subit six touches avec Dislocation.", "range": "6\"", "target": "1 unité ennemie"},
-            "War Boon [Bénédiction guerrière]": {"cost": 3, "description": "Choisissez jusqu'à trois unités amies à 12\" ou moins, qui bénéficient une fois de Boost de Guerrier-né.", "range": "12\"", "target": "jusqu'à 3 unités amies"},
-            "Headtaker Strike [Décapitation]": {"cost": 3, "description": "Choisissez jusqu'à deux unités ennemies à 12\" ou moins, qui subissent chacune trois blessures avec PA (2).", "range": "12\"", "target": "jusqu'à 2 unités ennemies"}
-        },
-        "units": [
-            {
-                "name": "Maître du Ravage de la Guerre Élu",
-                "type": "hero",
-                "size": 1,
-                "base_cost": 65,
-                "quality": 3,
-                "defense": 3,
-                "special_rules": ["Attaque versatile", "Coriace (3)", "Héros", "Guerrier-né"],
-                "weapons": [{"name": "Arme à une main lourde", "range": "-", "attacks": 3, "armor_piercing": 1}],
-                "upgrade_groups": [
-                    {
-                        "group": "Améliorations de rôle",
-                        "type": "upgrades",
-                        "description": "Choisissez un rôle spécial pour ce héros (un seul choix possible)",
-                        "options": [
-                            {"name": "Conquérant (Aura d'Éclaireur)", "cost": 20, "special_rules": ["Aura d'Éclaireur"]},
-                            {"name": "Marauder (Aura de Combattant imprévisible)", "cost": 30, "special_rules": ["Aura de Combattant imprévisible"]},
-                            {"name": "Porteur de la bannière de l'armée (Effrayant (3))", "cost": 30, "special_rules": ["Effrayant (3)"]},
-                            {"name": "Ensorceleur (Aura de Voile fluctuant)", "cost": 35, "special_rules": ["Aura de Voile fluctuant"]},
-                            {"name": "Sorcier (Lanceur de sorts (2))", "cost": 40, "special_rules": ["Lanceur de sorts (2)"]},
-                            {"name": "Seigneur de Guerre (Aura de Boost de Guerrier-né)", "cost": 50, "special_rules": ["Aura de Boost de Guerrier-né"]},
-                            {"name": "Maître Sorcier (Lanceur de sorts (3))", "cost": 65, "special_rules": ["Lanceur de sorts (3)"]}
-                        ]
-                    },
-                    {
-                        "group": "Remplacement d'arme",
-                        "type": "weapon",
-                        "description": "Remplacez l'arme de base par:",
-                        "options": [
-                            {"name": "Hallebarde lourde", "cost": 5, "weapon": {"name": "Hallebarde lourde", "range": "-", "attacks": 3, "armor_piercing": 1, "special_rules": ["Perforant"]}},
-                            {"name": "Paire d'armes à une main lourdes", "cost": 15, "weapon": {"name": "Paire d'armes à une main lourdes", "range": "-", "attacks": 4, "armor_piercing": 1}},
-                            {"name": "Grande arme lourde", "cost": 15, "weapon": {"name": "Grande arme lourde", "range": "-", "attacks": 3, "armor_piercing": 3}},
-                            {"name": "Lance lourde", "cost": 15, "weapon": {"name": "Lance lourde", "range": "-", "attacks": 3, "armor_piercing": 1, "special_rules": ["Percée"]}}
-                        ]
-                    },
-                    {
-                        "group": "Montures",
-                        "type": "mount",
-                        "description": "Ajoutez une monture",
-                        "options": [
-                            {"name": "Cheval", "cost": 15, "mount": {"name": "Cheval", "special_rules": ["Impact (1)", "Rapide"]}},
-                            {"name": "Grande bête", "cost": 70, "mount": {"name": "Grande bête", "special_rules": ["Griffes lourdes (A1, PA(1))", "Coriace (3)", "Impact (2)", "Rapide"]}},
-                            {"name": "Monture démoniaque", "cost": 80, "mount": {"name": "Monture démoniaque", "special_rules": ["Griffes lourdes (A1, PA(1))", "Coriace (3)", "Effrayant (1)", "Impact (2)", "Rapide"]}},
-                            {"name": "Char", "cost": 125, "mount": {"name": "Char", "special_rules": ["Sabots (A2)", "Coriace (6)", "Impact (4)", "Rapide"]}},
-                            {"name": "Char bestial", "cost": 140, "mount": {"name": "Char bestial", "special_rules": ["Griffes lourdes (A2, PA(1))", "Coriace (6)", "Effrayant (1)", "Impact (4)", "Rapide"]}},
-                            {"name": "Manticore", "cost": 165, "mount": {"name": "Manticore", "special_rules": ["Griffes perforantes (A6, Perforant)", "Coriace (6)", "Effrayant (1)", "Volant"]}},
-                            {"name": "Dragon du Ravage", "cost": 325, "mount": {"name": "Dragon du Ravage", "special_rules": ["Griffes lourdes (A6, PA(1))", "Piétinement (A4, PA(1))", "Attaque de souffle", "Coriace (12)", "Effrayant (2)", "Volant"]}}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Maître du Ravage de la Guerre",
-                "type": "hero",
-                "size": 1,
-                "base_cost": 55,
-                "quality": 3,
-                "defense": 3,
-                "special_rules": ["Coriace (3)", "Héros", "Guerrier-né"],
-                "weapons": [{"name": "Arme à une main lourde", "range": "-", "attacks": 3, "armor_piercing": 1}],
-                "upgrade_groups": [
-                    {
-                        "group": "Améliorations de rôle",
-                        "type": "upgrades",
-                        "description": "Choisissez un rôle spécial pour ce héros (un seul choix possible)",
-                        "options": [
-                            {"name": "Conquérant (Aura d'Éclaireur)", "cost": 20, "special_rules": ["Aura d'Éclaireur"]},
-                            {"name": "Marauder (Aura de Combattant imprévisible)", "cost": 30, "special_rules": ["Aura de Combattant imprévisible"]},
-                            {"name": "Porteur de la bannière de l'armée (Effrayant (3))", "cost": 30, "special_rules": ["Effrayant (3)"]},
-                            {"name": "Ensorceleur (Aura de Voile fluctuant)", "cost": 35, "special_rules": ["Aura de Voile fluctuant"]},
-                            {"name": "Sorcier (Lanceur de sorts (2))", "cost": 40, "special_rules": ["Lanceur de sorts (2)"]},
-                            {"name": "Seigneur de Guerre (Aura de Boost de Guerrier-né)", "cost": 50, "special_rules": ["Aura de Boost de Guerrier-né"]},
-                            {"name": "Maître Sorcier (Lanceur de sorts (3))", "cost": 65, "special_rules": ["Lanceur de sorts (3)"]}
-                        ]
-                    },
-                    {
-                        "group": "Remplacement d'arme",
-                        "type": "weapon",
-                        "description": "Remplacez l'arme de base par:",
-                        "options": [
-                            {"name": "Hallebarde lourde", "cost": 5, "weapon": {"name": "Hallebarde lourde", "range": "-", "attacks": 3, "armor_piercing": 1, "special_rules": ["Perforant"]}},
-                            {"name": "Paire d'armes à une main lourdes", "cost": 10, "weapon": {"name": "Paire d'armes à une main lourdes", "range": "-", "attacks": 4, "armor_piercing": 1}},
-                            {"name": "Grande arme lourde", "cost": 15, "weapon": {"name": "Grande arme lourde", "range": "-", "attacks": 3, "armor_piercing": 3}},
-                            {"name": "Lance lourde", "cost": 15, "weapon": {"name": "Lance lourde", "range": "-", "attacks": 3, "armor_piercing": 1, "special_rules": ["Percée"]}}
-                        ]
-                    },
-                    {
-                        "group": "Montures",
-                        "type": "mount",
-                        "description": "Ajoutez une monture",
-                        "options": [
-                            {"name": "Cheval", "cost": 15, "mount": {"name": "Cheval", "special_rules": ["Impact (1)", "Rapide"]}},
-                            {"name": "Grande bête", "cost": 65, "mount": {"name": "Grande bête", "special_rules": ["Griffes lourdes (A1, PA(1))", "Coriace (3)", "Impact (2)", "Rapide"]}},
-                            {"name": "Monture démoniaque", "cost": 75, "mount": {"name": "Monture démoniaque", "special_rules": ["Griffes lourdes (A1, PA(1))", "Coriace (3)", "Effrayant (1)", "Impact (2)", "Rapide"]}},
-                            {"name": "Char", "cost": 115, "mount": {"name": "Char", "special_rules": ["Sabots (A2)", "Coriace (6)", "Impact (4)", "Rapide"]}},
-                            {"name": "Char bestial", "cost": 130, "mount": {"name": "Char bestial", "special_rules": ["Griffes lourdes (A2, PA(1))", "Coriace (6)", "Effrayant (1)", "Impact (4)", "Rapide"]}},
-                            {"name": "Manticore", "cost": 145, "mount": {"name": "Manticore", "special_rules": ["Griffes perforantes (A6, Perforant)", "Coriace (6)", "Effrayant (1)", "Volant"]}},
-                            {"name": "Dragon du Ravage", "cost": 295, "mount": {"name": "Dragon du Ravage", "special_rules": ["Griffes lourdes (A6, PA(1))", "Piétinement (A4, PA(1))", "Attaque de souffle", "Coriace (12)", "Effrayant (2)", "Volant"]}}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Champion Barbare de la Guerre",
-                "type": "hero",
-                "size": 1,
-                "base_cost": 30,
-                "quality": 5,
-                "defense": 5,
-                "special_rules": ["Coriace (3)", "Éclaireur", "Furieux", "Guerrier-né", "Héros"],
-                "weapons": [{"name": "Arme à une main", "range": "-", "attacks": 3, "armor_piercing": "-"}],
-                "upgrade_groups": [
-                    {
-                        "group": "Améliorations de rôle",
-                        "type": "upgrades",
-                        "description": "Choisissez un rôle spécial pour ce héros (un seul choix possible)",
-                        "options": [
-                            {"name": "Héraut (Aura de Lacération au tir)", "cost": 25, "special_rules": ["Aura de Lacération au tir"]},
-                            {"name": "Marauder (Aura de Combattant imprévisible)", "cost": 30, "special_rules": ["Aura de Combattant imprévisible"]},
-                            {"name": "Ensorceleur (Aura de Voile fluctuant)", "cost": 35, "special_rules": ["Aura de Voile fluctuant"]},
-                            {"name": "Sorcier (Lanceur de sorts (2))", "cost": 40, "special_rules": ["Lanceur de sorts (2)"]},
-                            {"name": "Seigneur de Guerre (Aura de Boost de Guerrier-né)", "cost": 50, "special_rules": ["Aura de Boost de Guerrier-né"]}
-                        ]
-                    },
-                    {
-                        "group": "Remplacement d'arme",
-                        "type": "weapon",
-                        "description": "Remplacez l'arme de base par:",
-                        "options": [
-                            {"name": "Paire d'armes à une main", "cost": 5, "weapon": {"name": "Paire d'armes à une main", "range": "-", "attacks": 4, "armor_piercing": "-"}},
-                            {"name": "Hallebarde", "cost": 10, "weapon": {"name": "Hallebarde", "range": "-", "attacks": 3, "armor_piercing": "-", "special_rules": ["Perforant"]}},
-                            {"name": "Lance", "cost": 10, "weapon": {"name": "Lance", "range": "-", "attacks": 3, "armor_piercing": "-", "special_rules": ["Percée"]}},
-                            {"name": "Grande arme", "cost": 10, "weapon": {"name": "Grande arme", "range": "-", "attacks": 3, "armor_piercing": 2}}
-                        ]
-                    },
-                    {
-                        "group": "Améliorations d'arme",
-                        "type": "weapon",
-                        "description": "Améliorer avec une des options suivantes (un seul choix possible)",
-                        "options": [
-                            {"name": "Arc court", "cost": 10, "weapon": {"name": "Arc court", "range": "18", "attacks": 2, "armor_piercing": "-"}},
-                            {"name": "Javelots barbelés", "cost": 10, "weapon": {"name": "Javelots barbelés", "range": "18", "attacks": 2, "armor_piercing": 1, "special_rules": ["Éclatement"]}}
-                        ]
-                    },
-                    {
-                        "group": "Montures",
-                        "type": "mount",
-                        "description": "Ajoutez une monture à ce héros",
-                        "options": [
-                            {"name": "Cheval", "cost": 15, "mount": {"name": "Cheval", "special_rules": ["Impact (1)", "Rapide"]}}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Pillards Barbares de la Guerre",
-                "type": "unit",
-                "size": 10,
-                "base_cost": 95,
-                "quality": 5,
-                "defense": 5,
-                "special_rules": ["Éclaireur", "Furieux", "Guerrier-né"],
-                "weapons": [{"name": "Armes à une main", "range": "-", "attacks": 1, "armor_piercing": "-"}],
-                "upgrade_groups": [
-                    {
-                        "group": "Remplacement d'armes",
-                        "type": "weapon",
-                        "description": "Remplacez toutes les armes de base par:",
-                        "options": [
-                            {"name": "Lance", "cost": 35, "weapon": {"name": "Lance", "range": "-", "attacks": 1, "armor_piercing": "-", "special_rules": ["Contre-charge"]}},
-                            {"name": "Fléau", "cost": 20, "weapon": {"name": "Fléau", "range": "-", "attacks": 1, "armor_piercing": 1}}
-                        ]
-                    },
-                    {
-                        "group": "Améliorations d'unité",
-                        "type": "upgrades",
-                        "description": "Améliorations disponibles pour l'unité",
-                        "options": [
-                            {"name": "Icône du Ravage", "cost": 20, "special_rules": ["Aura de Défense versatile"]},
-                            {"name": "Sergent", "cost": 5},
-                            {"name": "Bannière", "cost": 5},
-                            {"name": "Musicien", "cost": 10}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Guerriers de la Guerre",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 80,
-                "quality": 3,
-                "defense": 3,
-                "special_rules": ["Guerrier-né"],
-                "weapons": [{"name": "Armes à une main lourdes", "range": "-", "attacks": 1, "armor_piercing": 1}],
-                "upgrade_groups": [
-                    {
-                        "group": "Améliorations d'unité",
-                        "type": "upgrades",
-                        "description": "Améliorations disponibles",
-                        "options": [
-                            {"name": "Sergent", "cost": 5},
-                            {"name": "Bannière", "cost": 5},
-                            {"name": "Musicien", "cost": 10}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Limiers du Ravage de la Guerre",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 70,
-                "quality": 4,
-                "defense": 5,
-                "special_rules": ["Arpenteur", "Guerrier-né", "Rapide"],
-                "weapons": [{"name": "Griffes perforantes", "range": "-", "attacks": 1, "armor_piercing": "-", "special_rules": ["Perforant"]}],
-                "upgrade_groups": []
-            }
-        ]
-    },
-    {
-        "faction": "Disciples de la Guerre",
-        "game": "Age of Fantasy Regiments",
-        "version": "FR-3.5.2",
-        "status": "complete",
-        "description": "Les Disciples de la Guerre - version Regiments.",
-        "units": [
-            {
-                "name": "Maître du Ravage de la Guerre Élu",
-                "type": "hero",
-                "size": 1,
-                "base_cost": 65,
-                "quality": 3,
-                "defense": 3,
-                "special_rules": ["Attaque versatile", "Coriace (3)", "Héros", "Guerrier-né"],
-                "weapons": [{"name": "Arme à une main lourde", "range": "-", "attacks": 3, "armor_piercing": 1}],
-                "upgrade_groups": []
-            },
-            {
-                "name": "Guerriers de la Guerre",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 80,
-                "quality": 3,
-                "defense": 3,
-                "special_rules": ["Guerrier-né"],
-                "weapons": [{"name": "Armes à une main lourdes", "range": "-", "attacks": 1, "armor_piercing": 1}],
-                "upgrade_groups": []
-            }
-        ]
-    },
-    {
-        "faction": "Sœurs Bénies",
-        "game": "Grimdark Future",
-        "version": "FR-0.1",
-        "status": "complete",
-        "description": "Les Sœurs Bénies sont des guerrières fanatiques.",
-        "units": [
-            {
-                "name": "Chanoinesse",
-                "type": "hero",
-                "size": 1,
-                "base_cost": 95,
-                "quality": 3,
-                "defense": 4,
-                "equipment": ["Arme énergétique", "Pistolet"],
-                "special_rules": ["Héroïne", "Foi"],
-                "weapons": [
-                    {"name": "Arme énergétique", "range": "-", "attacks": 4, "armor_piercing": 2},
-                    {"name": "Pistolet", "range": "12\"", "attacks": 1, "armor_piercing": 0}
-                ],
-                "upgrade_groups": []
-            },
-            {
-                "name": "Sœurs de Bataille",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 110,
-                "quality": 4,
-                "defense": 4,
-                "equipment": ["Fusils", "Armure lourde"],
-                "special_rules": ["Foi", "Zèle"],
-                "weapons": [{"name": "Fusils", "range": "24\"", "attacks": 1, "armor_piercing": 0}],
-                "upgrade_groups": [
-                    {
-                        "group": "Armes spéciales",
-                        "type": "upgrades",
-                        "description": "Ajoutez des armes spéciales",
-                        "options": [
-                            {"name": "Lance-flammes", "cost": 10, "weapon": {"name": "Lance-flammes", "range": "12\"", "attacks": 6, "armor_piercing": 0}},
-                            {"name": "Fusil à plasma", "cost": 15, "weapon": {"name": "Fusil à plasma", "range": "24\"", "attacks": 1, "armor_piercing": 3}}
-                        ]
-                    }
-                ]
-            },
-            {
-                "name": "Sœurs d'Élite",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 150,
-                "quality": 4,
-                "defense": 3,
-                "equipment": ["Fusils énergétiques", "Armure lourde"],
-                "special_rules": ["Foi", "Zèle"],
-                "weapons": [{"name": "Fusils énergétiques", "range": "24\"", "attacks": 2, "armor_piercing": 1}],
-                "upgrade_groups": []
-            },
-            {
-                "name": "Repentantes",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 120,
-                "quality": 4,
-                "defense": 5,
-                "equipment": ["Armes lourdes de mêlée"],
-                "special_rules": ["Frénésie", "Sans Peur"],
-                "weapons": [{"name": "Armes lourdes de mêlée", "range": "-", "attacks": 2, "armor_piercing": 1}],
-                "upgrade_groups": []
-            },
-            {
-                "name": "Séraphines",
-                "type": "unit",
-                "size": 5,
-                "base_cost": 160,
-                "quality": 4,
-                "defense": 4,
-                "equipment": ["Pistolets jumelés", "Réacteurs dorsaux"],
-                "special_rules": ["Vol", "Foi"],
-                "weapons": [{"name": "Pistolets jumelés", "range": "12\"", "attacks": 4, "armor_piercing": 0}],
-                "upgrade_groups": []
-            },
-            {
-                "name": "Exorciste",
-                "type": "unit",
-                "size": 1,
-                "base_cost": 220,
-                "quality": 4,
-                "defense": 2,
-                "equipment": ["Missiles sacrés", "Blindage lourd"],
-                "special_rules": ["Tir Indirect"],
-                "weapons": [{"name": "Missiles sacrés", "range": "48\"", "attacks": 6, "armor_piercing": 2, "special_rules": ["Explosion(3)"]}],
-                "upgrade_groups": []
-            }
-        ]
-    }
-]
+# Seed data lives in data/seed/ and is only read on first use, keeping
+# module import (and therefore worker cold start) cheap
+SEED_DIR = DATA_DIR / 'seed'
+
+@lru_cache(maxsize=None)
+def load_games() -> List[Dict[str, Any]]:
+    """Available games, loaded from data/seed/games.json"""
+    with open(SEED_DIR / 'games.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def load_sample_factions() -> List[Dict[str, Any]]:
+    """Sample faction data to seed, loaded from data/seed/sample_factions.json"""
+    with open(SEED_DIR / 'sample_factions.json', 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 # ===== ROUTES =====
 
@@ -594,262 +407,1050 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+@api_router.get("/ready")
+async def readiness_check():
+    """Readiness probe: warmed up and able to reach storage"""
+    ready = getattr(app.state, "ready", False)
+    storage_ok = await storage.ping()
+    body = {
+        "status": "ready" if ready and storage_ok else "not_ready",
+        "warm": ready,
+        "storage": {"backend": STORAGE_BACKEND, "reachable": storage_ok, "pool": storage.pool_stats()},
+        "import_jobs": import_jobs.stats(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+    return JSONResponse(status_code=200 if ready and storage_ok else 503, content=body)
+
+def require_profile_token(request: Request):
+    given = request.headers.get("X-Profile", "")
+    if not PROFILE_TOKEN or not hmac.compare_digest(given.encode(), PROFILE_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Profiling token required")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """Captured request profiles, newest first"""
+    require_profile_token(request)
+    return await asyncio.get_running_loop().run_in_executor(None, profile_store.list)
+
+@api_router.get("/admin/profiles/{name}")
+async def download_profile(name: str, request: Request):
+    """One capture: collapsed stacks (.folded), pstats (.prof) or its metadata (.json)"""
+    require_profile_token(request)
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type=PROFILE_MEDIA_TYPES.get(path.suffix, "application/json"), filename=name)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Internal counters for the read path"""
+    return {
+        "read_coalescing": faction_reads.stats(),
+        "validation_cache": validation_cache.stats(),
+        "usage_stats": usage_stats.stats(),
+        "live_rosters": dict(live_stats),
+        "print_cache": roster_printer.stats(),
+        "execution": execution.stats(),
+        "catalog_bundles": {"bundles": len(catalog_bundles.bundles), "builds": catalog_bundles.builds},
+        "faction_watcher": faction_watcher.stats() if faction_watcher else None,
+    }
+
 # Games routes
 @api_router.get("/games")
 async def get_games():
     """Get all available games"""
-    return GAMES
+    return load_games()
 
 @api_router.get("/games/{game_id}")
 async def get_game(game_id: str):
     """Get a specific game by ID"""
-    for game in GAMES:
+    for game in load_games():
         if game["id"] == game_id:
             return game
     raise HTTPException(status_code=404, detail="Game not found")
 
 # Helper function to load factions from JSON files
+async def sync_faction_files(paths: Optional[List[Path]] = None, replace: bool = True) -> Dict[str, Any]:
+    """Write factions from data files (all of DATA_DIR by default) whose content hash changed
+
+    Files are read and parsed off the event loop, and every new or changed
+    faction goes to storage in one bulk write. With replace=False, factions
+    already in storage are left alone.
+    """
+    def read():
+        files = sorted(DATA_DIR.glob("*.json")) if paths is None and DATA_DIR.exists() else paths or []
+        return read_faction_files(files)
+
+    factions, errors = await asyncio.get_running_loop().run_in_executor(None, read)
+    for path, error in errors.items():
+        logger.error(f"Error loading {path}: {error}")
+    report: Dict[str, Any] = {"inserted": [], "updated": [], "unchanged": 0, "errors": errors}
+    # If two files define the same faction, the last one wins
+    by_key = {(f["game"], f["faction"]): f for f in factions}
+    if not by_key:
+        return report
+    existing = {
+        (f.get("game"), f.get("faction")): f
+        async for f in storage.factions.find({"$or": [{"game": g, "faction": n} for g, n in by_key]})
+    }
+
+    operations, written, recosted = [], [], []
+    for key, faction in by_key.items():
+        current = existing.get(key)
+        game_faction = {"game": faction["game"], "faction": faction["faction"]}
+        if current is None:
+            faction["id"] = str(uuid.uuid4())
+            # Keyed on (game, faction): if another worker inserted it first, this is a no-op
+            operations.append(UpdateOne(game_faction, {"$setOnInsert": faction}, upsert=True))
+            report["inserted"].append(faction["faction"])
+        elif not replace or current.get("content_hash") == faction["content_hash"]:
+            report["unchanged"] += 1
+            continue
+        else:
+            faction["id"] = current["id"]
+            operations.append(ReplaceOne(game_faction, faction, upsert=True))
+            report["updated"].append(faction["faction"])
+            if diff_faction(current, faction).units_recosted:
+                recosted.append(faction)
+        written.append(faction)
+    if not operations:
+        return report
+
+    await storage.factions.bulk_write(operations, ordered=False)
+    for faction in written:
+        try:
+            await faction_history.record(faction)
+        except Exception as e:
+            logger.error(f"Error recording faction revision: {e}")
+        logger.info(f"Loaded faction: {faction.get('faction')} ({faction.get('game')})")
+    await faction_changed()
+    for faction in recosted:
+        await army_repricer.start(faction)
+    return report
+
+async def reload_faction_files(paths: List[Path]) -> None:
+    """Watcher callback: sync changed files, in the one worker holding the watcher lease"""
+    if not await storage.acquire_lease("faction_watcher", WORKER_ID, FACTION_WATCH_LEASE):
+        logger.debug("Skipping faction file reload, another worker holds the lease")
+        return
+    await sync_faction_files(paths)
+
 async def seed_factions_from_files():
     """Load faction data from JSON files in /data directory"""
-    if DATA_DIR.exists():
-        for json_file in DATA_DIR.glob("*.json"):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    faction_data = json.load(f)
-                    # Check if faction already exists
-                    existing = await db.factions.find_one({
-                        "faction": faction_data.get("faction"),
-                        "game": faction_data.get("game")
-                    })
-                    if not existing:
-                        faction_data["id"] = str(uuid.uuid4())
-                        await db.factions.insert_one(faction_data)
-                        logger.info(f"Loaded faction: {faction_data.get('faction')} ({faction_data.get('game')})")
-            except Exception as e:
-                logger.error(f"Error loading {json_file}: {e}")
+    await sync_faction_files(replace=False)
+
+async def seed_factions():
+    """Seed from JSON files first, then from the sample factions for games not in files"""
+    # sync_faction_files refreshes the catalog itself when files wrote anything
+    await seed_factions_from_files()
+    seeded = False
+    for faction_data in load_sample_factions():
+        existing = await storage.factions.find_one({
+            "faction": faction_data.get("faction"),
+            "game": faction_data.get("game")
+        })
+        if not existing:
+            faction_obj = stamp({**faction_data, "id": str(uuid.uuid4())})
+            await storage.factions.insert_one(faction_obj)
+            await faction_history.record(faction_obj)
+            seeded = True
+    if seeded:
+        await faction_changed()
+
+# Startup hooks run by the lifespan before the worker reports ready
+warmup_tasks: List[Callable[[], Awaitable[None]]] = []
+
+def warmup_task(func: Callable[[], Awaitable[None]]):
+    warmup_tasks.append(func)
+    return func
+
+@warmup_task
+async def seed_empty_catalog():
+    """Seed factions at startup so the first request doesn't pay for it"""
+    if not await storage.factions.count_documents({}):
+        await seed_factions()
+
+@warmup_task
+async def load_faction_catalog():
+    """Build the compact in-process catalog"""
+    global faction_catalog, faction_hashes, catalog_generation
+    # Read before the factions, so a write landing during the load triggers another one
+    generation = await read_catalog_generation()
+    factions = await storage.factions.find({}).to_list(None)
+    # Building is pure CPU; keep it off the event loop so requests aren't stalled
+    faction_catalog = await asyncio.get_running_loop().run_in_executor(None, CompactCatalog.build, factions)
+    catalog_bodies.clear()
+    faction_hashes = {
+        (f.get("game"), f.get("faction")): f.get("content_hash") or content_hash(f) for f in factions
+    }
+    logger.info(f"Loaded compact catalog: {faction_catalog.stats()}")
+    rebuilt = await catalog_bundles.update(load_games(), factions)
+    if rebuilt:
+        logger.info(f"Rebuilt catalog bundles: {', '.join(rebuilt)}")
+    catalog_generation = generation
+    if catalog_snapshot:
+        # Until this is done the old snapshot's generation doesn't match, so
+        # reads fall back to the compact catalog; a worker that finds the
+        # file already at this generation just maps it
+        try:
+            await catalog_snapshot.rebuild(storage, generation, factions)
+        except Exception as e:
+            logger.error(f"Error rebuilding catalog snapshot: {e}")
+
+async def read_catalog_generation() -> int:
+    state = await storage.collection("catalog_state").get("catalog")
+    return state.get("generation", 0) if state else 0
+
+async def reload_stale_catalog():
+    """Reload the catalog once for however many writes marked it stale"""
+    global catalog_stale
+    async with catalog_reloading:
+        if not catalog_stale:
+            return  # another caller reloaded it while this one waited
+        catalog_stale = False
+        try:
+            await load_faction_catalog()
+        except Exception as e:
+            logger.error(f"Error reloading faction catalog: {e}")
+
+async def reload_catalog_when_quiet():
+    await asyncio.sleep(CATALOG_RELOAD_DEBOUNCE)
+    await reload_stale_catalog()
+
+async def refresh_catalog():
+    """Reload the in-process catalog after this worker's writes, or if another worker changed factions"""
+    global catalog_checked_at
+    # Also wait for a reload already under way, which has cleared the flag
+    if catalog_stale or catalog_reloading.locked():
+        await reload_stale_catalog()
+    now = time.monotonic()
+    if now - catalog_checked_at < CATALOG_CHECK_INTERVAL:
+        return
+    catalog_checked_at = now
+    try:
+        generation = await read_catalog_generation()
+        if generation == catalog_generation:
+            return
+        async with catalog_reloading:
+            if generation != catalog_generation:
+                faction_reads.forget()
+                await load_faction_catalog()
+    except Exception as e:
+        # Keep serving the catalog we have; the next check retries
+        logger.error(f"Error refreshing faction catalog: {e}")
+
+async def faction_changed(faction: Optional[Dict[str, Any]] = None):
+    """Refresh derived catalog artifacts after any faction write"""
+    global catalog_stale, catalog_reload_task
+    faction_reads.forget()
+    try:
+        # Tells the other workers to reload (see refresh_catalog)
+        await storage.collection("catalog_state").update_one(
+            {"id": "catalog"}, {"$inc": {"generation": 1}}, upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Error bumping catalog generation: {e}")
+    if faction:
+        try:
+            await faction_history.record(faction)
+        except Exception as e:
+            logger.error(f"Error recording faction revision: {e}")
+    catalog_stale = True
+    task = catalog_reload_task
+    if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+        catalog_reload_task = asyncio.create_task(reload_catalog_when_quiet())
+
+@warmup_task
+async def prune_import_jobs():
+    """Forget import jobs that finished more than a day ago"""
+    await import_jobs.prune()
+
+@warmup_task
+async def resume_repricing():
+    """Pick up army re-pricing jobs interrupted by a restart"""
+    await army_repricer.resume()
+
+def snapshot_response(build) -> Optional[Response]:
+    """Serve raw JSON from the mapped snapshot, or None to fall back to storage"""
+    snapshot = catalog_snapshot.current() if catalog_snapshot else None
+    if not snapshot or catalog_generation is None or snapshot.generation != catalog_generation:
+        return None
+    body = build(snapshot)
+    return None if body is None else Response(content=bytes(body), media_type="application/json")
+
+async def save_faction(faction_data: Dict[str, Any]):
+    """Insert or re-import a faction keyed by (faction, game); return (id, created, changes)
+
+    Re-imports only write the units, upgrade groups and fields that changed,
+    and nothing at all when the content hash is unchanged.
+    """
+    stamp(faction_data)
+    existing = await storage.factions.find_one({
+        "faction": faction_data.get("faction"),
+        "game": faction_data.get("game")
+    })
+    if not existing:
+        faction_id, created = await storage.upsert_faction(faction_data)
+        await faction_changed(faction_data)
+        return faction_id, created, None
+
+    faction_data["id"] = existing["id"]
+    changes = diff_faction(existing, faction_data)
+    if not changes.changed:
+        return existing["id"], False, changes.summary()
+
+    written = False
+    if not changes.replace and existing.get("content_hash"):
+        # Only apply the delta if nobody rewrote the faction since we read it
+        result = await storage.factions.update_one(
+            {"id": existing["id"], "content_hash": existing["content_hash"]}, changes.update()
+        )
+        written = result.matched_count == 1
+    if not written:
+        await storage.factions.replace_one({"id": existing["id"]}, faction_data)
+    await faction_changed(faction_data)
+    if changes.units_recosted:
+        await army_repricer.start(faction_data)
+    return existing["id"], False, changes.summary()
+
+# Bundles routes
+@api_router.get("/bundles")
+async def get_bundle_manifest(request: Request):
+    """Version and size of each game's catalog bundle"""
+    await refresh_catalog()
+    manifest = catalog_bundles.manifest()
+    etag = f'"{manifest["version"]}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(content=manifest, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (gzip;q=0 refuses it)"""
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            qualities[coding.strip().lower()] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+def bundle_response(request: Request, game_id: str, version: Optional[str] = None) -> Response:
+    bundle = catalog_bundles.get(game_id)
+    if bundle is None:
+        raise HTTPException(status_code=404, detail="No bundle for this game")
+    if version is not None and version != bundle.version:
+        raise HTTPException(status_code=404, detail="Bundle version not found, read the manifest again")
+    etag = f'"{bundle.version}"'
+    # A versioned URL never changes; the unversioned one is revalidated
+    headers = {"ETag": etag, "Vary": "Accept-Encoding",
+               "Cache-Control": "public, max-age=31536000, immutable" if version else "no-cache"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    if not accepts_gzip(request.headers.get("Accept-Encoding", "")):
+        return Response(content=gzip.decompress(bundle.body), media_type="application/json", headers=headers)
+    return Response(content=bundle.body, media_type="application/json",
+                    headers={**headers, "Content-Encoding": "gzip"})
+
+@api_router.get("/bundles/{game_id}")
+async def get_bundle(game_id: str, request: Request):
+    """Every faction of a game in one gzipped document"""
+    await refresh_catalog()
+    return bundle_response(request, game_id)
+
+@api_router.get("/bundles/{game_id}/{version}")
+async def get_bundle_version(game_id: str, version: str, request: Request):
+    """A specific bundle version, cacheable forever"""
+    await refresh_catalog()
+    return bundle_response(request, game_id, version)
+
+def render_json(content: Any) -> bytes:
+    """Serialize like JSONResponse, once, so coalesced readers can share the bytes"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def catalog_body(key: Tuple[Any, ...], build: Callable[[], Any]) -> bytes:
+    """JSON rendered from the compact catalog, once per catalog build"""
+    body = catalog_bodies.get(key)
+    if body is None:
+        body = render_json(build())
+        catalog_bodies.put(key, body)
+    return body
 
 # Factions routes
 @api_router.get("/factions")
 async def get_factions(game: Optional[str] = None):
     """Get all factions, optionally filtered by game"""
-    query = {}
-    if game:
-        query["game"] = game
-    
-    factions = await db.factions.find(query, {"_id": 0}).to_list(1000)
-    
-    # If no factions exist, seed from JSON files first, then from SAMPLE_FACTIONS
-    if not factions:
-        await seed_factions_from_files()
-        
-        # Also seed from SAMPLE_FACTIONS for games not in files
-        for faction_data in SAMPLE_FACTIONS:
-            existing = await db.factions.find_one({
-                "faction": faction_data.get("faction"),
-                "game": faction_data.get("game")
-            })
-            if not existing:
-                faction_obj = {**faction_data, "id": str(uuid.uuid4())}
-                await db.factions.insert_one(faction_obj)
-        
-        factions = await db.factions.find(query, {"_id": 0}).to_list(1000)
-    
-    return factions
+    await refresh_catalog()
+    cached = snapshot_response(lambda snapshot: snapshot.raw_list(game) if len(snapshot) else None)
+    if cached:
+        return cached
+
+    async def fetch():
+        if len(faction_catalog):
+            return catalog_body(("list", game), lambda: [faction_catalog.get_dict(i) for i in faction_catalog.ids(game)])
+
+        query = {}
+        if game:
+            query["game"] = game
+
+        factions = await storage.factions.find(query).to_list(1000)
+
+        # If no factions exist, seed from JSON files first, then from the sample factions
+        if not factions:
+            await seed_factions()
+            factions = await storage.factions.find(query).to_list(1000)
+
+        return render_json(factions)
+
+    body = await faction_reads.do(("GET /factions", game or None), fetch)
+    return Response(content=body, media_type="application/json")
 
 @api_router.get("/factions/{faction_id}")
 async def get_faction(faction_id: str):
     """Get a specific faction by ID"""
-    faction = await db.factions.find_one({"id": faction_id}, {"_id": 0})
+    await refresh_catalog()
+    cached = snapshot_response(lambda snapshot: snapshot.raw(faction_id))
+    if cached:
+        return cached
+
+    async def fetch():
+        if faction_id in faction_catalog:
+            return catalog_body(("get", faction_id), lambda: faction_catalog.get_dict(faction_id))
+        faction = await storage.factions.get(faction_id)
+        if not faction:
+            raise HTTPException(status_code=404, detail="Faction not found")
+        return render_json(faction)
+
+    body = await faction_reads.do(("GET /factions/{id}", faction_id), fetch)
+    return Response(content=body, media_type="application/json")
+
+@api_router.get("/factions/{faction_id}/changes")
+async def get_faction_changes(faction_id: str, since: str):
+    """JSON Patch (RFC 6902) from the client's content_hash to the current faction"""
+    faction = await storage.factions.get(faction_id)
+    if not faction:
+        raise HTTPException(status_code=404, detail="Faction not found")
+    patch = await faction_history.changes(faction, since)
+    if patch is None:
+        # Too old or never seen: the client has to fetch the whole faction
+        raise HTTPException(status_code=410, detail="Unknown faction revision")
+    return JSONResponse(
+        content=patch,
+        media_type="application/json-patch+json",
+        headers={"ETag": f'"{faction.get("content_hash") or content_hash(faction)}"'},
+    )
+
+@api_router.post("/factions/{faction_id}/reprice", status_code=202)
+async def reprice_faction_armies(faction_id: str):
+    """Start re-pricing every stored army of a faction against its current costs"""
+    faction = await storage.factions.get(faction_id)
     if not faction:
         raise HTTPException(status_code=404, detail="Faction not found")
-    return faction
+    return await army_repricer.start(faction)
+
+@api_router.get("/repricing/{job_id}")
+async def get_repricing_job(job_id: str):
+    """Progress of an army re-pricing job"""
+    job = await army_repricer.status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-pricing job not found")
+    return job
 
 @api_router.post("/factions", response_model=dict)
 async def create_faction(faction_data: FactionCreate):
     """Create a new faction"""
     faction_dict = faction_data.model_dump()
     faction_dict["id"] = str(uuid.uuid4())
-    await db.factions.insert_one(faction_dict)
+    try:
+        await storage.factions.insert_one(stamp(faction_dict))
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="This game already has a faction with that name")
+    await faction_changed(faction_dict)
     return {"id": faction_dict["id"], "message": "Faction created successfully"}
 
 @api_router.delete("/factions/{faction_id}")
 async def delete_faction(faction_id: str):
     """Delete a faction"""
-    result = await db.factions.delete_one({"id": faction_id})
+    result = await storage.factions.delete_one({"id": faction_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Faction not found")
+    await faction_history.forget(faction_id)
+    await faction_changed()
     return {"message": "Faction deleted successfully"}
 
-# Import faction from JSON
-@api_router.post("/factions/import")
-async def import_faction(faction_data: dict):
-    """Import a faction from raw JSON data"""
-    # Check if faction already exists
-    existing = await db.factions.find_one({
-        "faction": faction_data.get("faction"),
-        "game": faction_data.get("game")
-    })
-    if existing:
-        # Update existing faction
-        faction_data["id"] = existing["id"]
-        await db.factions.replace_one({"id": existing["id"]}, faction_data)
-        return {"id": existing["id"], "message": "Faction updated successfully"}
+async def run_faction_import(content: bytes) -> Dict[str, Any]:
+    """Parse, validate and store one faction; runs on the import job queue"""
+    try:
+        if len(content) > IMPORT_PARSE_OFFLOAD_BYTES:
+            faction_data = await execution.run(json.loads, content, kind=PROCESS)
+        else:
+            faction_data = json.loads(content)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise JobError("Invalid JSON format")
+
+    # Validate basic structure
+    if not isinstance(faction_data, dict) or "faction" not in faction_data or "game" not in faction_data:
+        raise JobError("JSON must contain 'faction' and 'game' fields")
+
+    faction_id, created, changes = await save_faction(faction_data)
+    if created:
+        message = f"Faction '{faction_data['faction']}' imported successfully"
+    elif changes["changed"]:
+        message = f"Faction '{faction_data['faction']}' updated successfully"
     else:
-        faction_data["id"] = str(uuid.uuid4())
-        await db.factions.insert_one(faction_data)
-        return {"id": faction_data["id"], "message": "Faction imported successfully"}
+        message = f"Faction '{faction_data['faction']}' unchanged"
+    result = {
+        "id": faction_id,
+        "message": message,
+        "units_count": len(faction_data.get("units", []))
+    }
+    if changes:
+        result["changes"] = changes
+    return result
+
+async def queue_job(kind: str, run: Callable[[], Awaitable[Any]], **meta) -> JSONResponse:
+    """Submit a job; 202 with its status URL, or 503 + Retry-After when the queue is full"""
+    try:
+        job = await import_jobs.submit(kind, run, **meta)
+    except QueueFull as e:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Too many jobs in progress, retry later"},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    status_url = f"/api/jobs/{job['id']}"
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "status": job["status"], "status_url": status_url},
+        headers={"Location": status_url},
+    )
+
+async def queue_faction_import(content: bytes, source: str) -> JSONResponse:
+    return await queue_job("faction_import", lambda: run_faction_import(content), source=source)
+
+# Import faction from JSON
+@api_router.post("/factions/import", status_code=202)
+async def import_faction(request: Request):
+    """Queue the import of a faction from raw JSON data"""
+    # Read the raw body: parsing a large faction happens in the job, not here
+    return await queue_faction_import(await request.body(), source="import")
 
 # Upload faction JSON file
-@api_router.post("/factions/upload")
+@api_router.post("/factions/upload", status_code=202)
 async def upload_faction_file(file: UploadFile = File(...)):
-    """Upload a faction JSON file"""
+    """Queue the import of an uploaded faction JSON file"""
     if not file.filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="File must be a JSON file")
-    
-    try:
-        content = await file.read()
-        faction_data = json.loads(content.decode('utf-8'))
-        
-        # Validate basic structure
-        if "faction" not in faction_data or "game" not in faction_data:
-            raise HTTPException(status_code=400, detail="JSON must contain 'faction' and 'game' fields")
-        
-        # Check if faction already exists
-        existing = await db.factions.find_one({
-            "faction": faction_data.get("faction"),
-            "game": faction_data.get("game")
-        })
-        
-        if existing:
-            faction_data["id"] = existing["id"]
-            await db.factions.replace_one({"id": existing["id"]}, faction_data)
-            return {
-                "id": existing["id"], 
-                "message": f"Faction '{faction_data['faction']}' updated successfully",
-                "units_count": len(faction_data.get("units", []))
-            }
-        else:
-            faction_data["id"] = str(uuid.uuid4())
-            await db.factions.insert_one(faction_data)
-            return {
-                "id": faction_data["id"], 
-                "message": f"Faction '{faction_data['faction']}' imported successfully",
-                "units_count": len(faction_data.get("units", []))
-            }
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Invalid JSON format")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await queue_faction_import(await file.read(), source=f"upload:{file.filename}")
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, timings, result or error of a background job"""
+    job = await import_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Usage stats
+def rebuild_usage_stats():
+    return usage_stats.rebuild(ARMY_TRANSFER_BATCH_SIZE)
+
+@api_router.get("/stats")
+async def get_stats(top: int = Query(10, ge=1, le=100)):
+    """Most used factions, units and upgrades, and average list size, per game"""
+    return await usage_stats.summary(top)
+
+@api_router.post("/stats/rebuild", status_code=202)
+async def rebuild_stats():
+    """Recount the usage stats from every army, as a background job"""
+    return await queue_job("stats_rebuild", rebuild_usage_stats)
 
 # Army routes
+ArmySort = Literal["updated_at", "created_at", "total_points"]
+
+def army_query(
+    game: Optional[str] = None,
+    faction: Optional[str] = None,
+    points_limit_min: Optional[int] = None,
+    points_limit_max: Optional[int] = None,
+    total_points_min: Optional[int] = None,
+    total_points_max: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    sort: Optional[ArmySort] = None,
+    order: Literal["asc", "desc"] = "desc",
+) -> Tuple[Dict[str, Any], List[Tuple[str, int]]]:
+    """Filter and sort for an army list query; every shape has a matching index in storage.INDEXES"""
+    query: Dict[str, Any] = {}
+    if game is not None:
+        query["game"] = game
+    if faction is not None:
+        query["faction"] = faction
+    for field, low, high in (
+        ("points_limit", points_limit_min, points_limit_max),
+        ("total_points", total_points_min, total_points_max),
+    ):
+        bounds = {op: value for op, value in (("$gte", low), ("$lte", high)) if value is not None}
+        if bounds:
+            query[field] = bounds
+    if name_prefix:
+        query["name"] = prefix_range(name_prefix)
+    sort_keys = [(sort, DESCENDING if order == "desc" else ASCENDING)] if sort else []
+    return query, sort_keys
+
 @api_router.get("/armies")
-async def get_armies():
-    """Get all armies"""
-    armies = await db.armies.find({}, {"_id": 0}).to_list(1000)
+async def get_armies(
+    game: Optional[str] = None,
+    faction: Optional[str] = None,
+    points_limit_min: Optional[int] = None,
+    points_limit_max: Optional[int] = None,
+    total_points_min: Optional[int] = None,
+    total_points_max: Optional[int] = None,
+    name_prefix: Optional[str] = None,
+    sort: Optional[ArmySort] = None,
+    order: Literal["asc", "desc"] = "desc",
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=1000),
+):
+    """List armies, filtered and sorted server-side"""
+    query, sort_keys = army_query(
+        game, faction, points_limit_min, points_limit_max, total_points_min, total_points_max,
+        name_prefix, sort, order,
+    )
+    armies = await storage.armies.find(query, sort=sort_keys, skip=skip, limit=limit).to_list(None)
     return armies
 
+# Armies carry a revision, bumped by every write; armies saved before
+# revisions existed count as revision 0
+def army_filter(army_id: str, revision: Optional[int] = None) -> Dict[str, Any]:
+    """Match an army, and only at the given revision if there is one"""
+    if revision is None:
+        return {"id": army_id}
+    if revision == 0:
+        return {"id": army_id, "$or": [{"revision": 0}, {"revision": {"$exists": False}}]}
+    return {"id": army_id, "revision": revision}
+
+def army_changes(army_update: ArmyUpdate) -> Dict[str, Any]:
+    """Update document for an army edit, bumping its revision"""
+    update_data = army_update.model_dump(exclude={"id", "revision"}, exclude_none=True)
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    if "units" in update_data:
+        update_data["total_points"] = calculate_army_points(update_data["units"])
+
+    return {"$set": update_data, "$inc": {"revision": 1}}
+
+def if_match_revision(if_match: Optional[str]) -> Optional[int]:
+    """Revision from an If-Match header ("3", 3 or W/"3"); None when absent or *"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    value = if_match.strip().removeprefix("W/").strip('"')
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be an army revision")
+
+def new_army(army_data: ArmyCreate) -> Dict[str, Any]:
+    """Document for a new army, at revision 1"""
+    army_dict = army_data.model_dump()
+    army_dict["id"] = str(uuid.uuid4())
+    army_dict["revision"] = 1
+    army_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    army_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    army_dict["total_points"] = calculate_army_points(army_dict.get("units", []))
+    return army_dict
+
+def imported_army(data: Dict[str, Any]) -> UpdateOne:
+    """Upsert of one exported army: keeps its id, bumps its revision if it already exists"""
+    army_id = data.get("id") or str(uuid.uuid4())
+    if not isinstance(army_id, str):
+        raise ValueError("id must be a string")
+    army_dict = ArmyCreate.model_validate(data).model_dump()
+    army_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    army_dict["total_points"] = calculate_army_points(army_dict["units"])
+    return UpdateOne(
+        {"id": army_id},
+        {
+            "$set": army_dict,
+            "$setOnInsert": {"created_at": data.get("created_at") or army_dict["updated_at"]},
+            "$inc": {"revision": 1},
+        },
+        upsert=True,
+    )
+
+@api_router.post("/armies/bulk")
+async def bulk_armies(bulk: ArmyBulk):
+    """Create and delete armies in one bulk write"""
+    if len(bulk.create) + len(bulk.delete) > ARMY_BULK_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {ARMY_BULK_LIMIT} operations per request")
+    created = [new_army(army) for army in bulk.create]
+    doomed = await storage.armies.find({"id": {"$in": bulk.delete}}, projection=ARMY_FIELDS).to_list(None) if bulk.delete else []
+    operations = [InsertOne(army) for army in created] + [DeleteOne({"id": army_id}) for army_id in bulk.delete]
+    result = await storage.armies.bulk_write(operations, ordered=False) if operations else None
+    await usage_stats.record_many([(None, army) for army in created] + [(army, None) for army in doomed])
+    return {
+        "created": [army["id"] for army in created],
+        "deleted": result.deleted_count if result else 0,
+    }
+
+@api_router.get("/armies/export")
+async def export_armies(game: Optional[str] = None, faction: Optional[str] = None):
+    """Stream armies as NDJSON, one army per line"""
+    query = {key: value for key, value in (("game", game), ("faction", faction)) if value is not None}
+    cursor = storage.armies.find(query, batch_size=ARMY_TRANSFER_BATCH_SIZE)
+    return StreamingResponse(
+        export_ndjson(cursor),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="armies.ndjson"'},
+    )
+
+@api_router.post("/armies/import")
+async def import_armies(request: Request):
+    """Import an NDJSON army export, line by line; bad lines are reported and skipped"""
+    report = await import_ndjson(storage.armies, request.stream(), imported_army, batch_size=ARMY_TRANSFER_BATCH_SIZE)
+    if report["imported"]:
+        # Imports may overwrite armies wholesale; recount rather than diff each one
+        try:
+            report["stats_job"] = (await import_jobs.submit("stats_rebuild", rebuild_usage_stats))["id"]
+        except QueueFull:
+            logger.warning("Job queue full; usage stats not rebuilt after army import")
+    return report
+
 @api_router.get("/armies/{army_id}")
-async def get_army(army_id: str):
+async def get_army(army_id: str, response: Response):
     """Get a specific army by ID"""
-    army = await db.armies.find_one({"id": army_id}, {"_id": 0})
+    army = await storage.armies.get(army_id)
     if not army:
         raise HTTPException(status_code=404, detail="Army not found")
+    army.setdefault("revision", 0)
+    response.headers["ETag"] = f'"{army["revision"]}"'
     return army
 
 @api_router.post("/armies", response_model=dict)
 async def create_army(army_data: ArmyCreate):
     """Create a new army"""
-    army_dict = army_data.model_dump()
-    army_dict["id"] = str(uuid.uuid4())
-    army_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-    army_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
-    army_dict["total_points"] = calculate_army_points(army_dict.get("units", []))
-    
-    await db.armies.insert_one(army_dict)
-    return {"id": army_dict["id"], "message": "Army created successfully"}
+    army_dict = new_army(army_data)
+    await storage.armies.insert_one(army_dict)
+    await usage_stats.record(None, army_dict)
+    return {"id": army_dict["id"], "revision": 1, "message": "Army created successfully"}
+
+@api_router.put("/armies")
+async def update_armies(batch: ArmyBatchUpdate):
+    """Apply several army updates; each may carry a revision and succeeds or conflicts on its own"""
+    if len(batch.updates) > ARMY_BULK_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {ARMY_BULK_LIMIT} updates per request")
+    ids = [item.id for item in batch.updates]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=422, detail="Each army may appear only once per batch")
+
+    slots = asyncio.Semaphore(max(1, ARMY_BATCH_CONCURRENCY))
+
+    async def apply(item: ArmyBatchItem):
+        changes = army_changes(item)
+        # Conditional on the revision, so the write's own match tells whether it applied
+        async with slots:
+            before = await storage.armies.find_one_and_update(
+                army_filter(item.id, item.revision), changes, return_new=False,
+                projection={**ARMY_FIELDS, "id": 1, "revision": 1},
+            )
+        return changes, before
+
+    applied = await asyncio.gather(*(apply(item) for item in batch.updates))
+    await usage_stats.record_many(
+        (before, {**before, **changes["$set"]}) for changes, before in applied if before is not None
+    )
+    missed = [item.id for item, (_, before) in zip(batch.updates, applied) if before is None]
+    current = {army["id"]: army for army in await storage.armies.find({"id": {"$in": missed}}).to_list(None)} if missed else {}
+
+    results = []
+    for item, (_, before) in zip(batch.updates, applied):
+        if before is not None:
+            results.append({"id": item.id, "status": "updated", "revision": before.get("revision", 0) + 1})
+        elif item.id in current:
+            army = current[item.id]
+            army.setdefault("revision", 0)
+            results.append({"id": item.id, "status": "conflict", "revision": army["revision"], "current": army})
+        else:
+            results.append({"id": item.id, "status": "not_found"})
+    return {"results": results}
 
 @api_router.put("/armies/{army_id}")
-async def update_army(army_id: str, army_update: ArmyUpdate):
-    """Update an existing army"""
-    update_data = {k: v for k, v in army_update.model_dump().items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-    
-    if "units" in update_data:
-        update_data["total_points"] = calculate_army_points(update_data["units"])
-    
-    result = await db.armies.update_one({"id": army_id}, {"$set": update_data})
-    if result.matched_count == 0:
+async def update_army(army_id: str, army_update: ArmyUpdate, request: Request):
+    """Update an existing army; with If-Match or revision, only if nobody saved in between"""
+    revision = if_match_revision(request.headers.get("if-match"))
+    if revision is None:
+        revision = army_update.revision
+
+    changes = army_changes(army_update)
+    # The army as it was, to update the usage counters by the roster diff
+    army = await storage.armies.find_one_and_update(
+        army_filter(army_id, revision), changes, return_new=False, projection={**ARMY_FIELDS, "revision": 1}
+    )
+    if army is None:
+        current = await storage.armies.get(army_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Army not found")
+        current.setdefault("revision", 0)
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Army was modified by another client", "current": current},
+            headers={"ETag": f'"{current["revision"]}"'},
+        )
+
+    await usage_stats.record(army, {**army, **changes["$set"]})
+    new_revision = army.get("revision", 0) + 1
+    return JSONResponse(
+        content={"message": "Army updated successfully", "revision": new_revision},
+        headers={"ETag": f'"{new_revision}"'},
+    )
+
+@api_router.websocket("/armies/{army_id}/live")
+async def live_army(websocket: WebSocket, army_id: str):
+    """Edit an army live: apply edit ops, push validation deltas, save in batches"""
+    await websocket.accept()
+    army = await storage.armies.get(army_id)
+    if not army:
+        await websocket.send_json({"type": "error", "detail": "Army not found"})
+        await websocket.close(code=4404)
+        return
+
+    async def persist(state: Dict[str, Any]):
+        if session.conflicted:
+            return
+        updated_at = datetime.now(timezone.utc).isoformat()
+        changes = {
+            "name": state["name"],
+            "points_limit": state["points_limit"],
+            "units": state["units"],
+            "total_points": state["total_points"],
+            "updated_at": updated_at,
+        }
+        previous = await storage.armies.find_one_and_update(
+            army_filter(army_id, state.get("revision", 0)),
+            {"$set": changes, "$inc": {"revision": 1}},
+            return_new=False,
+            projection={**ARMY_FIELDS, "revision": 1},
+        )
+        if previous is None:
+            # Saved elsewhere meanwhile: hand the client the current army and
+            # end the session so it reconnects from there
+            session.conflicted = True
+            current = await storage.armies.get(army_id)
+            try:
+                await websocket.send_json({"type": "conflict", "current": current})
+                await websocket.close(code=4409)
+            except (WebSocketDisconnect, RuntimeError):
+                pass  # the client already left
+            return
+        # The write went through: later flushes must build on this revision
+        # whatever happens to the notification below
+        session.army["revision"] = previous.get("revision", 0) + 1
+        live_stats["writes"] += 1
+        await usage_stats.record(previous, {**previous, **changes})
+        try:
+            await websocket.send_json({"type": "saved", "revision": session.army["revision"], "updated_at": updated_at})
+        except (WebSocketDisconnect, RuntimeError):
+            pass  # the client already left; the final save still counts
+
+    session = LiveRosterSession(army, persist, debounce=LIVE_SAVE_DEBOUNCE, max_delay=LIVE_SAVE_MAX_DELAY)
+    live_stats["sessions"] += 1
+    live_stats["open_sessions"] += 1
+    save_on_close = True
+    try:
+        await websocket.send_json({"type": "state", "army": session.state(), "validation": session.validation})
+        while True:
+            text = await websocket.receive_text()
+            try:
+                op = json.loads(text)
+            except json.JSONDecodeError:
+                await websocket.send_json({"type": "error", "detail": "Invalid JSON"})
+                continue
+            seq = op.get("seq") if isinstance(op, dict) else None
+            if isinstance(op, dict) and op.get("op") == "flush":
+                try:
+                    await session.flush()
+                except (WebSocketDisconnect, RuntimeError):
+                    raise
+                except Exception as e:
+                    # Edits stay pending and are saved with the next flush
+                    logger.error(f"Saving live roster {army_id} failed: {e}")
+                    await websocket.send_json({"type": "error", "seq": seq, "detail": "Save failed"})
+                continue
+            try:
+                delta = session.apply(op if isinstance(op, dict) else {})
+            except EditError as e:
+                await websocket.send_json({"type": "error", "seq": seq, "detail": str(e)})
+                continue
+            live_stats["edits"] += 1
+            await websocket.send_json({"type": "validation", "seq": seq, "delta": delta})
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        # The in-memory roster may be inconsistent; don't write it back
+        save_on_close = False
+        logger.exception(f"Live roster session {army_id} failed; unsaved edits were dropped")
+        try:
+            await websocket.close(code=1011)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+    finally:
+        live_stats["open_sessions"] -= 1
+        try:
+            await session.close(save=save_on_close)
+        except Exception as e:
+            logger.error(f"Final save of live roster {army_id} failed: {e}")
+
+@api_router.get("/armies/{army_id}/print")
+async def print_army(army_id: str, format: Literal["html", "text"] = "html"):
+    """Printable roster sheet with unit profiles and the faction's rule reference"""
+    await refresh_catalog()
+    army = await storage.armies.get(army_id)
+    if not army:
         raise HTTPException(status_code=404, detail="Army not found")
-    
-    return {"message": "Army updated successfully"}
+    army.setdefault("revision", 0)
+    media_type = PRINT_FORMATS[format]
+
+    faction_hash = faction_hashes.get((army.get("game"), army.get("faction")))
+    sheet = roster_printer.cached(army, faction_hash, format) if faction_hash else None
+    if sheet is not None:
+        return Response(content=sheet, media_type=media_type, headers={"X-Render-Cache": "hit"})
+
+    faction = await storage.factions.find_one({"game": army.get("game"), "faction": army.get("faction")})
+    if not faction:
+        raise HTTPException(status_code=404, detail="Faction not found")
+    faction_hash = faction.get("content_hash") or content_hash(faction)
+    return StreamingResponse(
+        roster_printer.stream(army, faction, faction_hash, format),
+        media_type=media_type,
+        headers={"X-Render-Cache": "miss"},
+    )
+
+# Share codes
+def codebook_for(faction: Dict[str, Any]) -> Codebook:
+    codebook = Codebook(faction)
+    share_codebooks.put(codebook.prefix, codebook)
+    return codebook
+
+async def encode_share_code(army_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Share code for a roster, against its faction's current revision"""
+    await refresh_catalog()
+    faction_hash = faction_hashes.get((army_data.get("game"), army_data.get("faction")))
+    codebook = share_codebooks.get(faction_hash[:2 * HASH_PREFIX_BYTES]) if faction_hash else None
+    if codebook is None or codebook.hash != faction_hash:
+        faction = await storage.factions.find_one({"game": army_data.get("game"), "faction": army_data.get("faction")})
+        if not faction:
+            raise HTTPException(status_code=404, detail="Faction not found")
+        codebook = codebook_for(faction)
+    try:
+        code = codebook.encode(army_data)
+    except ShareCodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"code": code, "faction_hash": codebook.hash}
+
+@api_router.post("/share")
+async def share_roster(army_data: ArmyCreate):
+    """Encode a roster as a share code"""
+    return await encode_share_code(army_data.model_dump())
+
+@api_router.get("/armies/{army_id}/share")
+async def share_army(army_id: str):
+    """Encode a stored army as a share code"""
+    army = await storage.armies.get(army_id)
+    if not army:
+        raise HTTPException(status_code=404, detail="Army not found")
+    return await encode_share_code(army)
+
+@api_router.get("/share/{code}")
+async def decode_share_code(code: str):
+    """The roster a share code describes, priced as when it was shared"""
+    await refresh_catalog()
+    try:
+        prefix = hash_prefix(code)
+    except ShareCodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    codebook = share_codebooks.get(prefix)
+    if codebook is None:
+        # Hashes are lowercase hex, so a prefix is the range [prefix, prefix + "g")
+        faction = await storage.factions.find_one({"content_hash": {"$gte": prefix, "$lt": prefix + "g"}})
+        if not faction:
+            revision = await faction_history.find(prefix)
+            faction = revision["document"] if revision else None
+        if not faction:
+            raise HTTPException(status_code=404, detail="Faction revision not found")
+        codebook = codebook_for(faction)
+    try:
+        roster = codebook.decode(code)
+    except ShareCodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    roster["faction_hash"] = codebook.hash
+    # False once the faction has changed since the code was made
+    roster["current"] = faction_hashes.get((roster["game"], roster["faction"])) == codebook.hash
+    return roster
 
 @api_router.delete("/armies/{army_id}")
 async def delete_army(army_id: str):
     """Delete an army"""
-    result = await db.armies.delete_one({"id": army_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Army not found")
+    while True:
+        army = await storage.armies.get(army_id, projection={**ARMY_FIELDS, "revision": 1})
+        if not army:
+            raise HTTPException(status_code=404, detail="Army not found")
+        # Delete the revision just read, so the counters lose exactly that roster
+        result = await storage.armies.delete_one(army_filter(army_id, army.get("revision", 0)))
+        if result.deleted_count:
+            break
+    await usage_stats.record(army, None)
     return {"message": "Army deleted successfully"}
 
 # Validation route
 @api_router.post("/validate")
 async def validate_army(army_data: dict):
     """Validate an army against OPR rules"""
-    errors = []
-    points_limit = army_data.get("points_limit", 1000)
-    units = army_data.get("units", [])
-    
-    total_points = calculate_army_points(units)
-    
-    # Count heroes
-    hero_count = sum(1 for u in units if u.get("unit_type") == "hero")
-    max_heroes = points_limit // 375
-    
-    # Check hero limit
-    if hero_count > max_heroes:
-        errors.append({
-            "type": "error",
-            "message": f"Trop de héros! Maximum {max_heroes} héros pour {points_limit} pts (1 héros / 375 pts)",
-            "unit_id": None
-        })
-    
-    # Check 35% rule for each unit
-    max_unit_cost = int(points_limit * 0.35)
-    for unit in units:
-        unit_cost = unit.get("total_cost", 0)
-        if unit_cost > max_unit_cost:
-            errors.append({
-                "type": "error",
-                "message": f"L'unité '{unit.get('unit_name', 'Unknown')}' coûte {unit_cost} pts, maximum autorisé: {max_unit_cost} pts (35% de {points_limit})",
-                "unit_id": unit.get("id")
-            })
-    
-    # Check total points
-    if total_points > points_limit:
-        errors.append({
-            "type": "error",
-            "message": f"L'armée dépasse la limite de points! {total_points}/{points_limit} pts",
-            "unit_id": None
-        })
-    
-    return {
-        "valid": len([e for e in errors if e["type"] == "error"]) == 0,
-        "errors": errors,
-        "total_points": total_points,
-        "max_hero_count": max_heroes,
-        "current_hero_count": hero_count
-    }
-
-def calculate_army_points(units: List[dict]) -> int:
-    """Calculate total points for an army"""
-    total = 0
-    for unit in units:
-        total += unit.get("total_cost", unit.get("base_cost", 0))
-    return total
+    await refresh_catalog()
+    fingerprint = roster_fingerprint(
+        army_data, faction_hashes.get((army_data.get("game"), army_data.get("faction")))
+    )
+    # The ETag only tells clients which roster the result is for: 304 is
+    # not a valid answer to a POST, so a repeat gets the cached result
+    etag = f'"{fingerprint}"'
+    result = validation_cache.get(fingerprint)
+    if result is None:
+        if len(army_data.get("units", [])) > VALIDATION_OFFLOAD_UNITS:
+            result = await validate_off_loop(army_data)
+        else:
+            result = validate_roster(army_data)
+        validation_cache.put(fingerprint, result)
+    else:
+        result = in_roster_order(result, army_data.get("units", []))
+    return JSONResponse(content={**result, "fingerprint": fingerprint}, headers={"ETag": etag})
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    logger.warning(f"{request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Request took too long, retry later"},
+                        headers={"Retry-After": "1"})
+
+app.add_middleware(RequestContextMiddleware)
+
+if PROFILE_TOKEN or PROFILE_SAMPLE_EVERY:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        token=PROFILE_TOKEN,
+        sample_every=PROFILE_SAMPLE_EVERY,
+        mode=PROFILE_MODE,
+        interval=PROFILE_INTERVAL,
+        route_key=route_template(app.router.routes),
+        exclude=PROFILE_EXCLUDE,
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -857,7 +1458,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,193 @@
+"""Compact share codes for army rosters.
+
+A roster is encoded against the faction revision it was built from: units
+and upgrade options become indexes into that faction's ``units``,
+``upgrade_groups`` and ``options`` lists, everything is packed as unsigned
+LEB128 varints and the bytes are rendered as unpadded base64url. The code
+starts with a prefix of the faction's ``content_hash``, so it keeps decoding
+to the same roster after the faction changes, for as long as that revision
+is kept in the faction history.
+
+Layout (v2)::
+
+    version, hash prefix (8 bytes), points_limit, name length, name (UTF-8),
+    unit count, then per unit: unit index << 1 | combined, total_cost,
+    upgrade count, and a (group index, option index) pair per upgrade
+
+Each unit's ``total_cost`` is carried as the builder computed it, so the
+decoded roster matches the encoded one. v1 codes had no ``total_cost``;
+they decode with the sum of the base and upgrade costs.
+"""
+
+import base64
+import binascii
+import uuid
+from typing import Any, Dict, List, Tuple
+
+from faction_history import content_hash
+
+VERSION = 2
+# Versions decode still reads
+SUPPORTED_VERSIONS = (1, 2)
+HASH_PREFIX_BYTES = 8
+
+
+class ShareCodeError(ValueError):
+    """The roster can't be encoded, or the code can't be decoded"""
+
+
+def write_varint(out: bytearray, value: int) -> None:
+    if value < 0:
+        raise ShareCodeError(f"Can't encode negative value {value}")
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """(value, position after it)"""
+    value = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ShareCodeError("Share code is truncated")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift > 63:
+            raise ShareCodeError("Share code is malformed")
+
+
+def _to_code(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _from_code(code: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(code + "=" * (-len(code) % 4))
+    except (binascii.Error, ValueError):
+        raise ShareCodeError("Share code is not valid base64url")
+
+
+def hash_prefix(code: str) -> str:
+    """Hex prefix of the content_hash of the faction revision the code refers to"""
+    data = _from_code(code)
+    if not data or data[0] not in SUPPORTED_VERSIONS:
+        raise ShareCodeError("Unsupported share code version")
+    if len(data) < 1 + HASH_PREFIX_BYTES:
+        raise ShareCodeError("Share code is truncated")
+    return data[1:1 + HASH_PREFIX_BYTES].hex()
+
+
+class Codebook:
+    """Index lookups for one faction revision, in both directions"""
+
+    def __init__(self, faction: Dict[str, Any]):
+        self.faction = faction
+        self.hash = faction.get("content_hash") or content_hash(faction)
+        self.prefix = self.hash[:2 * HASH_PREFIX_BYTES]
+        self.units: List[Dict[str, Any]] = faction.get("units", [])
+        # Roster units reference faction units by name, and upgrades by
+        # (group, option name); the first match wins, as when pricing
+        self._unit_index: Dict[str, int] = {}
+        self._option_index: List[Dict[Tuple[str, str], Tuple[int, int]]] = []
+        for i, unit in enumerate(self.units):
+            self._unit_index.setdefault(unit.get("name"), i)
+            options: Dict[Tuple[str, str], Tuple[int, int]] = {}
+            for g, group in enumerate(unit.get("upgrade_groups", [])):
+                for o, option in enumerate(group.get("options", [])):
+                    options.setdefault((group.get("group"), option.get("name")), (g, o))
+            self._option_index.append(options)
+
+    def encode(self, army: Dict[str, Any]) -> str:
+        out = bytearray([VERSION])
+        out += bytes.fromhex(self.prefix)
+        write_varint(out, army.get("points_limit", 0))
+        name = (army.get("name") or "").encode("utf-8")
+        write_varint(out, len(name))
+        out += name
+        units = army.get("units", [])
+        write_varint(out, len(units))
+        for roster_unit in units:
+            index = self._unit_index.get(roster_unit.get("unit_name"))
+            if index is None:
+                raise ShareCodeError(f"Unit '{roster_unit.get('unit_name')}' is not in the faction")
+            write_varint(out, index << 1 | bool(roster_unit.get("combined_unit")))
+            total_cost = roster_unit.get("total_cost", 0)
+            if not isinstance(total_cost, int) or isinstance(total_cost, bool):
+                raise ShareCodeError(f"total_cost of '{roster_unit.get('unit_name')}' must be an integer")
+            write_varint(out, total_cost)
+            upgrades = roster_unit.get("selected_upgrades", [])
+            write_varint(out, len(upgrades))
+            for upgrade in upgrades:
+                position = self._option_index[index].get((upgrade.get("group"), upgrade.get("option_name")))
+                if position is None:
+                    raise ShareCodeError(
+                        f"Upgrade '{upgrade.get('option_name')}' is not offered to '{roster_unit.get('unit_name')}'"
+                    )
+                write_varint(out, position[0])
+                write_varint(out, position[1])
+        return _to_code(bytes(out))
+
+    def decode(self, code: str) -> Dict[str, Any]:
+        """The roster the code describes, priced at this revision's costs"""
+        if hash_prefix(code) != self.prefix:
+            raise ShareCodeError("Share code refers to another faction revision")
+        data = _from_code(code)
+        version = data[0]
+        pos = 1 + HASH_PREFIX_BYTES
+        points_limit, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        if pos + length > len(data):
+            raise ShareCodeError("Share code is truncated")
+        try:
+            name = data[pos:pos + length].decode("utf-8")
+        except UnicodeDecodeError:
+            raise ShareCodeError("Share code is malformed")
+        pos += length
+        count, pos = read_varint(data, pos)
+        units = []
+        for _ in range(count):
+            packed, pos = read_varint(data, pos)
+            index, combined = packed >> 1, bool(packed & 1)
+            if index >= len(self.units):
+                raise ShareCodeError("Share code refers to an unknown unit")
+            unit = self.units[index]
+            total = None
+            if version >= 2:
+                total, pos = read_varint(data, pos)
+            groups = unit.get("upgrade_groups", [])
+            upgrades = []
+            upgrade_count, pos = read_varint(data, pos)
+            for _ in range(upgrade_count):
+                g, pos = read_varint(data, pos)
+                o, pos = read_varint(data, pos)
+                if g >= len(groups) or o >= len(groups[g].get("options", [])):
+                    raise ShareCodeError("Share code refers to an unknown upgrade")
+                option = groups[g]["options"][o]
+                upgrades.append({"group": groups[g].get("group"), "option_name": option.get("name"),
+                                 "cost": option.get("cost", 0)})
+            if total is None:
+                total = unit.get("base_cost", 0) + sum(upgrade["cost"] for upgrade in upgrades)
+            units.append({
+                "id": str(uuid.uuid4()),
+                "unit_name": unit.get("name"),
+                "unit_type": unit.get("type", "unit"),
+                "base_cost": unit.get("base_cost", 0),
+                "selected_upgrades": upgrades,
+                "combined_unit": combined,
+                "total_cost": total,
+            })
+        if pos != len(data):
+            raise ShareCodeError("Share code has trailing data")
+        return {
+            "name": name,
+            "game": self.faction.get("game"),
+            "faction": self.faction.get("faction"),
+            "points_limit": points_limit,
+            "units": units,
+            "total_points": sum(unit["total_cost"] for unit in units),
+        }
@@ -0,0 +1,75 @@
+"""Coalescing of concurrent identical reads ("single-flight").
+
+``SingleFlight.do(key, fetch)`` runs ``fetch`` once for all callers that ask
+for the same key while it is in flight, and for callers arriving within a
+short grace window after it finished. Every caller gets the same result, or
+the same exception. The fetch runs in its own task, so a caller that goes
+away (client disconnect) doesn't cancel the work the others are waiting on.
+"""
+
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    def __init__(self, grace: float = 0.0):
+        self.grace = grace
+        # key -> (task, finished_at); finished_at is None while in flight
+        self._flights: Dict[Hashable, Tuple[asyncio.Task, Any]] = {}
+        self._counters: Counter = Counter()
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        self._counters["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is not None:
+            task, finished_at = flight
+            if finished_at is None:
+                self._counters["coalesced"] += 1
+            elif loop.time() - finished_at <= self.grace:
+                self._counters["grace_hits"] += 1
+            else:
+                flight = None
+        if flight is None:
+            self._counters["fetches"] += 1
+            task = loop.create_task(fetch())
+            self._flights[key] = (task, None)
+            task.add_done_callback(lambda done: self._landed(key, done))
+        return await asyncio.shield(task)
+
+    def _landed(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key, (None,))[0] is not task:
+            return
+        failed = task.cancelled() or task.exception() is not None
+        if failed:
+            self._counters["errors"] += 1
+        if failed or self.grace <= 0:
+            # Errors are never replayed to later callers
+            del self._flights[key]
+            return
+        loop = task.get_loop()
+        self._flights[key] = (task, loop.time())
+        loop.call_later(self.grace, self._expire, key, task)
+
+    def _expire(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key, (None,))[0] is task:
+            del self._flights[key]
+
+    def forget(self) -> None:
+        """Drop finished results kept for the grace window (e.g. after a write)"""
+        for key, (_, finished_at) in list(self._flights.items()):
+            if finished_at is not None:
+                del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        calls, fetches = self._counters["calls"], self._counters["fetches"]
+        return {
+            "calls": calls,
+            "fetches": fetches,
+            "coalesced": self._counters["coalesced"],
+            "grace_hits": self._counters["grace_hits"],
+            "errors": self._counters["errors"],
+            "in_flight": sum(1 for _, finished_at in self._flights.values() if finished_at is None),
+            "absorbed_ratio": round(1 - fetches / calls, 4) if calls else 0.0,
+        }
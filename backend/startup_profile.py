@@ -0,0 +1,188 @@
+"""Cold start profiler for the API worker.
+
+Reports an import-time breakdown of ``server`` (via ``python -X importtime``)
+and measures, in a fresh interpreter, the time to import the app, run the
+lifespan startup and serve a first request.
+
+Usage:
+    python startup_profile.py [--top 15] [--path /api/health] [--json] [--check]
+
+``--check`` exits non-zero when import + startup + first request exceeds
+COLD_START_BUDGET_MS (default 2000).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List
+
+BACKEND_DIR = Path(__file__).parent
+DEFAULT_BUDGET_MS = 2000.0
+
+
+def cold_start_budget_ms() -> float:
+    return float(os.environ.get("COLD_START_BUDGET_MS", DEFAULT_BUDGET_MS))
+
+
+def import_breakdown(module: str = "server") -> Dict[str, Any]:
+    """Import `module` in a fresh interpreter with -X importtime and aggregate the report"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    rows: List[Dict[str, Any]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+        })
+
+    # importtime prints children before their parent; the target's subtree is
+    # every row between the previous top-level row and the target itself
+    end = max(i for i, row in enumerate(rows) if row["module"] == module and row["depth"] == 0)
+    start = max((i for i in range(end) if rows[i]["depth"] == 0), default=-1) + 1
+    subtree = rows[start:end + 1]
+
+    by_package: Dict[str, int] = defaultdict(int)
+    for row in subtree:
+        if row["depth"] == 1:
+            by_package[row["module"].split(".")[0]] += row["cumulative_us"]
+    by_package[f"{module} (self)"] = rows[end]["self_us"]
+
+    return {
+        "total_us": rows[end]["cumulative_us"],
+        "by_package": dict(sorted(by_package.items(), key=lambda item: -item[1])),
+        "slowest_self": sorted(
+            ({k: v for k, v in row.items() if k != "depth"} for row in subtree),
+            key=lambda row: -row["self_us"],
+        ),
+    }
+
+
+async def _lifespan(app, shutdown: asyncio.Event, started: asyncio.Event, state: Dict[str, Any]):
+    messages = [{"type": "lifespan.startup"}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await shutdown.wait()
+        return {"type": "lifespan.shutdown"}
+
+    async def send(message):
+        if message["type"].startswith("lifespan.startup"):
+            started.set()
+
+    await app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": state}, receive, send)
+
+
+async def _get(app, path: str, state: Dict[str, Any]) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0), "server": ("localhost", 80), "state": dict(state),
+    }
+    status = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+
+    await app(scope, receive, send)
+    return status.get("code", 0)
+
+
+async def _measure(path: str) -> Dict[str, Any]:
+    started_at = time.perf_counter()
+    import server
+    imported_at = time.perf_counter()
+
+    shutdown, started, state = asyncio.Event(), asyncio.Event(), {}
+    lifespan = asyncio.create_task(_lifespan(server.app, shutdown, started, state))
+    await started.wait()
+    ready_at = time.perf_counter()
+
+    status = await _get(server.app, path, state)
+    served_at = time.perf_counter()
+
+    shutdown.set()
+    await lifespan
+    return {
+        "path": path,
+        "status": status,
+        "import_ms": (imported_at - started_at) * 1000,
+        "startup_ms": (ready_at - imported_at) * 1000,
+        "first_request_ms": (served_at - ready_at) * 1000,
+        "total_ms": (served_at - started_at) * 1000,
+    }
+
+
+def measure_cold_start(path: str = "/api/health") -> Dict[str, Any]:
+    """Import, start and serve one request in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, __file__, "--measure-only", "--path", path],
+        cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start measurement failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="number of rows per table")
+    parser.add_argument("--path", default="/api/health", help="route for the first request")
+    parser.add_argument("--json", action="store_true", help="emit a JSON report")
+    parser.add_argument("--check", action="store_true", help="fail when over COLD_START_BUDGET_MS")
+    parser.add_argument("--measure-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure_only:
+        sys.path.insert(0, str(BACKEND_DIR))
+        print(json.dumps(asyncio.run(_measure(args.path))))
+        return 0
+
+    budget = cold_start_budget_ms()
+    report = {"imports": import_breakdown(), "cold_start": measure_cold_start(args.path), "budget_ms": budget}
+    over_budget = report["cold_start"]["total_ms"] > budget
+
+    if args.json:
+        report["imports"]["slowest_self"] = report["imports"]["slowest_self"][:args.top]
+        print(json.dumps(report, indent=2))
+    else:
+        imports = report["imports"]
+        print(f"Import of server: {imports['total_us'] / 1000:.1f} ms\n")
+        print("Cumulative import time by top-level package:")
+        for package, us in list(imports["by_package"].items())[:args.top]:
+            print(f"  {package:<32} {us / 1000:8.1f} ms")
+        print("\nSlowest modules (self time):")
+        for row in imports["slowest_self"][:args.top]:
+            print(f"  {row['module']:<48} {row['self_us'] / 1000:8.1f} ms")
+        cold = report["cold_start"]
+        print(f"\nCold start ({cold['path']} -> {cold['status']}):")
+        for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms"):
+            print(f"  {key:<20} {cold[key]:8.1f} ms")
+        print(f"  {'budget_ms':<20} {budget:8.1f} ms {'OVER BUDGET' if over_budget else 'ok'}")
+
+    return 1 if args.check and over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
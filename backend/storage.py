@@ -0,0 +1,1317 @@
+"""Storage backends for the OPR Army Forge API.
+
+Routes talk to a small, Mongo-flavoured collection interface instead of the
+Motor globals, so the same code runs against:
+
+- ``MotorStorage``: the production MongoDB backend
+- ``MemoryStorage``: a pure in-process store (tests, benchmarks)
+- ``SQLiteStorage``: an embedded SQLite/JSON1 database (local dev, single node)
+
+The embedded engines implement the subset of the Mongo query and update
+language the app uses: equality and ``$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/
+$exists/$regex/$and/$or`` filters on scalar fields (dotted paths allowed),
+``$set/$unset/$inc/$setOnInsert`` updates and top-level projections.
+"""
+
+import asyncio
+import copy
+import functools
+import itertools
+import json
+import re
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ASCENDING = 1
+DESCENDING = -1
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class StorageError(Exception):
+    """Base error raised by storage backends"""
+
+
+class DuplicateKeyError(StorageError):
+    """A write violated a unique index"""
+
+
+# ===== RESULTS & BULK OPERATIONS =====
+
+@dataclass
+class UpdateResult:
+    matched_count: int = 0
+    modified_count: int = 0
+    # The "id" field of the document an upsert inserted, on every backend
+    upserted_id: Optional[str] = None
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int = 0
+
+
+@dataclass
+class BulkWriteResult:
+    inserted_count: int = 0
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+    upserted_count: int = 0
+
+
+@dataclass
+class InsertOne:
+    document: Dict[str, Any]
+
+
+@dataclass
+class UpdateOne:
+    filter: Dict[str, Any]
+    update: Dict[str, Any]
+    upsert: bool = False
+
+
+@dataclass
+class ReplaceOne:
+    filter: Dict[str, Any]
+    replacement: Dict[str, Any]
+    upsert: bool = False
+
+
+@dataclass
+class DeleteOne:
+    filter: Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    keys: Tuple[Tuple[str, int], ...]
+    unique: bool = False
+
+    @property
+    def name(self) -> str:
+        return "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return tuple(field for field, _ in self.keys)
+
+
+# Indexes every backend creates at startup
+INDEXES: Dict[str, List[IndexSpec]] = {
+    "factions": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+        # One document per faction: concurrent seeding or reloads upsert on this key
+        IndexSpec((("game", ASCENDING), ("faction", ASCENDING)), unique=True),
+        IndexSpec((("content_hash", ASCENDING),)),
+    ],
+    "armies": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+        IndexSpec((("game", ASCENDING), ("faction", ASCENDING), ("id", ASCENDING))),
+        # Army list queries (server.army_query): equality on game/faction,
+        # then the sort field, so results come back in index order
+        IndexSpec((("updated_at", DESCENDING),)),
+        IndexSpec((("created_at", DESCENDING),)),
+        IndexSpec((("total_points", DESCENDING),)),
+        IndexSpec((("game", ASCENDING), ("updated_at", DESCENDING))),
+        IndexSpec((("game", ASCENDING), ("created_at", DESCENDING))),
+        IndexSpec((("game", ASCENDING), ("total_points", DESCENDING))),
+        IndexSpec((("game", ASCENDING), ("faction", ASCENDING), ("updated_at", DESCENDING))),
+        IndexSpec((("game", ASCENDING), ("faction", ASCENDING), ("created_at", DESCENDING))),
+        IndexSpec((("game", ASCENDING), ("faction", ASCENDING), ("total_points", DESCENDING))),
+        # Faction without game (the same faction name across games)
+        IndexSpec((("faction", ASCENDING), ("updated_at", DESCENDING))),
+        IndexSpec((("faction", ASCENDING), ("created_at", DESCENDING))),
+        IndexSpec((("faction", ASCENDING), ("total_points", DESCENDING))),
+        IndexSpec((("points_limit", ASCENDING),)),
+        IndexSpec((("name", ASCENDING),)),
+    ],
+    "faction_revisions": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+        IndexSpec((("faction_id", ASCENDING), ("seq", DESCENDING))),
+        IndexSpec((("hash", ASCENDING),)),
+    ],
+    "jobs": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+        IndexSpec((("finished_at", ASCENDING),)),
+    ],
+    "usage_stats": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+    ],
+    "catalog_state": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+    ],
+    "leases": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+    ],
+    "repricing_jobs": [
+        IndexSpec((("id", ASCENDING),), unique=True),
+        IndexSpec((("status", ASCENDING),)),
+    ],
+}
+
+
+# ===== DOCUMENT HELPERS =====
+
+def prefix_range(prefix: str) -> Dict[str, str]:
+    """Condition matching strings that start with prefix, as an index-friendly range"""
+    return {"$gte": prefix, "$lt": _prefix_upper_bound(prefix)} if prefix else {"$exists": True}
+
+
+_MISSING = object()
+
+
+def get_path(doc: Any, path: str) -> Any:
+    """Resolve a dotted path, returning _MISSING when absent"""
+    current = doc
+    for part in path.split("."):
+        if isinstance(current, dict):
+            if part not in current:
+                return _MISSING
+            current = current[part]
+        elif isinstance(current, list) and part.isdigit():
+            index = int(part)
+            if index >= len(current):
+                return _MISSING
+            current = current[index]
+        else:
+            return _MISSING
+    return current
+
+
+def _parent_for_write(doc: dict, path: str) -> Tuple[Any, str]:
+    parts = path.split(".")
+    current: Any = doc
+    for part, following in zip(parts, parts[1:]):
+        if isinstance(current, list):
+            index = int(part)
+            while len(current) <= index:
+                current.append(None)
+            if current[index] is None:
+                current[index] = [] if following.isdigit() else {}
+            current = current[index]
+        else:
+            if current.get(part) is None:
+                current[part] = [] if following.isdigit() else {}
+            current = current[part]
+    return current, parts[-1]
+
+
+def set_path(doc: dict, path: str, value: Any) -> None:
+    parent, key = _parent_for_write(doc, path)
+    if isinstance(parent, list):
+        index = int(key)
+        while len(parent) <= index:
+            parent.append(None)
+        parent[index] = value
+    else:
+        parent[key] = value
+
+
+def unset_path(doc: dict, path: str) -> None:
+    parts = path.rsplit(".", 1)
+    parent = doc if len(parts) == 1 else get_path(doc, parts[0])
+    key = parts[-1]
+    if isinstance(parent, dict):
+        parent.pop(key, None)
+    elif isinstance(parent, list) and key.isdigit() and int(key) < len(parent):
+        # Mongo keeps array positions stable and nulls the element out
+        parent[int(key)] = None
+
+
+def apply_update(doc: dict, update: Dict[str, Any], inserting: bool = False) -> bool:
+    """Apply a Mongo update document in place; return True if doc changed"""
+    if not update or not all(key.startswith("$") for key in update):
+        raise StorageError("Update documents must only contain operators; use replace_one instead")
+    before = copy.deepcopy(doc)
+    for operator, fields in update.items():
+        if operator == "$set":
+            for path, value in fields.items():
+                set_path(doc, path, copy.deepcopy(value))
+        elif operator == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    set_path(doc, path, copy.deepcopy(value))
+        elif operator == "$unset":
+            for path in fields:
+                unset_path(doc, path)
+        elif operator == "$inc":
+            for path, amount in fields.items():
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is _MISSING or current is None else current) + amount)
+        else:
+            raise StorageError(f"Unsupported update operator: {operator}")
+    return doc != before
+
+
+def _compare(value: Any, operand: Any, op: Callable[[Any, Any], bool]) -> bool:
+    if value is _MISSING or value is None or operand is None:
+        return False
+    try:
+        return op(value, operand)
+    except TypeError:
+        return False
+
+
+def _match_condition(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                matched = _match_condition(value, operand)
+            elif operator == "$ne":
+                matched = not _match_condition(value, operand)
+            elif operator == "$gt":
+                matched = _compare(value, operand, lambda a, b: a > b)
+            elif operator == "$gte":
+                matched = _compare(value, operand, lambda a, b: a >= b)
+            elif operator == "$lt":
+                matched = _compare(value, operand, lambda a, b: a < b)
+            elif operator == "$lte":
+                matched = _compare(value, operand, lambda a, b: a <= b)
+            elif operator == "$in":
+                matched = any(_match_condition(value, item) for item in operand)
+            elif operator == "$nin":
+                matched = not any(_match_condition(value, item) for item in operand)
+            elif operator == "$exists":
+                matched = (value is not _MISSING) == bool(operand)
+            elif operator == "$regex":
+                matched = isinstance(value, str) and re.search(operand, value) is not None
+            else:
+                raise StorageError(f"Unsupported query operator: {operator}")
+            if not matched:
+                return False
+        return True
+    if condition is None:
+        return value is _MISSING or value is None
+    return value is not _MISSING and value == condition
+
+
+def match_filter(doc: dict, filter: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Mongo filter document against doc"""
+    for key, condition in (filter or {}).items():
+        if key == "$and":
+            if not all(match_filter(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(match_filter(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc: dict, projection: Optional[Dict[str, Any]]) -> dict:
+    """Apply a top-level inclusion or exclusion projection"""
+    if not projection:
+        return doc
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if not fields:
+        return doc
+    if any(fields.values()):
+        return {k: doc[k] for k in fields if fields[k] and k in doc}
+    return {k: v for k, v in doc.items() if k not in fields}
+
+
+def _sort_value(value: Any) -> Tuple[int, Any]:
+    # Mirrors SQLite/BSON ordering: null < numbers < strings < everything else
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, json.dumps(value, sort_keys=True, default=str))
+
+
+def sort_documents(docs: List[Tuple[Any, dict]], sort: Sequence[Tuple[str, int]]) -> List[Tuple[Any, dict]]:
+    # Stable sorts applied from the least significant key up
+    for field, direction in reversed(list(sort)):
+        docs.sort(key=lambda item: _sort_value(get_path(item[1], field)), reverse=direction < 0)
+    return docs
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _upsert_seed(filter: Dict[str, Any]) -> dict:
+    """Build the base document for an upsert from the filter's equality fields"""
+    doc: dict = {}
+    for key, value in filter.items():
+        if key.startswith("$"):
+            continue
+        if isinstance(value, dict) and any(k.startswith("$") for k in value):
+            if "$eq" in value:
+                set_path(doc, key, copy.deepcopy(value["$eq"]))
+            continue
+        set_path(doc, key, copy.deepcopy(value))
+    return doc
+
+
+# ===== INTERFACE =====
+
+class Cursor(ABC):
+    """Async iterator over query results, fetched in batches"""
+
+    def __aiter__(self):
+        return self._iterate()
+
+    @abstractmethod
+    def _iterate(self):
+        ...
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = []
+        async for doc in self:
+            results.append(doc)
+            if length and len(results) >= length:
+                break
+        return results
+
+
+class Collection(ABC):
+    """A named collection of JSON documents keyed by their "id" field"""
+
+    name: str
+
+    async def get(self, doc_id: str, projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+        """Get a document by its id"""
+        return await self.find_one({"id": doc_id}, projection)
+
+    @abstractmethod
+    async def find_one(self, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def find(
+        self,
+        filter: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None,
+        sort: Optional[Sequence[Tuple[str, int]]] = None,
+        skip: int = 0,
+        limit: int = 0,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> Cursor:
+        ...
+
+    @abstractmethod
+    async def count_documents(self, filter: Optional[Dict[str, Any]] = None) -> int:
+        ...
+
+    @abstractmethod
+    async def insert_one(self, document: Dict[str, Any]) -> Optional[str]:
+        ...
+
+    async def insert_many(self, documents: Sequence[Dict[str, Any]]) -> int:
+        result = await self.bulk_write([InsertOne(doc) for doc in documents])
+        return result.inserted_count
+
+    @abstractmethod
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        ...
+
+    @abstractmethod
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        ...
+
+    @abstractmethod
+    async def find_one_and_update(
+        self,
+        filter: Dict[str, Any],
+        update: Dict[str, Any],
+        upsert: bool = False,
+        return_new: bool = True,
+        projection: Optional[Dict[str, Any]] = None,
+    ) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_one(self, filter: Dict[str, Any]) -> DeleteResult:
+        ...
+
+    @abstractmethod
+    async def delete_many(self, filter: Dict[str, Any]) -> DeleteResult:
+        ...
+
+    @abstractmethod
+    async def bulk_write(self, operations: Sequence[Any], ordered: bool = True) -> BulkWriteResult:
+        ...
+
+    @abstractmethod
+    async def create_index(self, spec: IndexSpec) -> None:
+        ...
+
+    @abstractmethod
+    async def explain(
+        self, filter: Optional[Dict[str, Any]] = None, sort: Optional[Sequence[Tuple[str, int]]] = None,
+    ) -> Dict[str, Any]:
+        """How the engine would run find(filter, sort=sort).
+
+        ``stage`` is ``IXSCAN`` when an index narrows or orders the scan and
+        ``COLLSCAN`` otherwise, ``index`` names the index used, ``sorted``
+        says whether sort order comes from the index (no in-memory sort) and
+        ``detail`` holds the engine's own plan.
+        """
+
+
+class Storage(ABC):
+    """A set of collections plus connection lifecycle"""
+
+    def __init__(self):
+        self._collections: Dict[str, Collection] = {}
+
+    def collection(self, name: str) -> Collection:
+        if name not in self._collections:
+            self._collections[name] = self._open_collection(name)
+        return self._collections[name]
+
+    @property
+    def factions(self) -> Collection:
+        return self.collection("factions")
+
+    @property
+    def armies(self) -> Collection:
+        return self.collection("armies")
+
+    @abstractmethod
+    def _open_collection(self, name: str) -> Collection:
+        ...
+
+    async def ensure_indexes(self) -> None:
+        for name, specs in INDEXES.items():
+            for spec in specs:
+                await self.collection(name).create_index(spec)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew the named lease for `ttl` seconds; False while another owner holds it"""
+        now = time.time()
+        try:
+            await self.collection("leases").find_one_and_update(
+                {"id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + ttl}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else: the upsert collided with it
+            return False
+        return True
+
+    async def upsert_faction(self, faction_data: Dict[str, Any]) -> Tuple[str, bool]:
+        """Insert or replace a faction keyed by (faction, game); return (id, created)"""
+        existing = await self.factions.find_one(
+            {"faction": faction_data.get("faction"), "game": faction_data.get("game")},
+            {"id": 1},
+        )
+        if existing:
+            faction_data["id"] = existing["id"]
+            await self.factions.replace_one({"id": existing["id"]}, faction_data)
+            return existing["id"], False
+        faction_data["id"] = str(uuid.uuid4())
+        await self.factions.insert_one(faction_data)
+        return faction_data["id"], True
+
+    async def open(self) -> None:
+        """Establish connections before the app starts serving traffic"""
+
+    @abstractmethod
+    async def ping(self) -> bool:
+        ...
+
+    def pool_stats(self) -> Dict[str, Any]:
+        return {}
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+
+# ===== EMBEDDED ENGINES =====
+
+class EmbeddedCursor(Cursor):
+    def __init__(self, collection: "EmbeddedCollection", filter, projection, sort, skip, limit, batch_size):
+        self._collection = collection
+        self._args = (filter or {}, sort or [], skip, limit)
+        self._projection = projection
+        self._batch_size = max(1, batch_size)
+
+    async def _iterate(self):
+        rows: Optional[Iterator] = None
+        while True:
+            if rows is None:
+                rows = await self._collection._run(self._collection._scan, *self._args)
+            batch = await self._collection._run(lambda: list(itertools.islice(rows, self._batch_size)))
+            if not batch:
+                return
+            for _, doc in batch:
+                yield self._collection._export(doc, self._projection)
+
+
+class EmbeddedCollection(Collection):
+    """Shared query/update logic for engines that store documents locally"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    # Engine primitives, all synchronous
+    @abstractmethod
+    def _scan(self, filter: dict, sort: Sequence[Tuple[str, int]], skip: int, limit: int) -> Iterator[Tuple[Any, dict]]:
+        ...
+
+    @abstractmethod
+    def _insert(self, doc: dict) -> Any:
+        ...
+
+    @abstractmethod
+    def _write(self, key: Any, doc: dict) -> None:
+        ...
+
+    @abstractmethod
+    def _remove(self, key: Any) -> None:
+        ...
+
+    @abstractmethod
+    def _export(self, doc: dict, projection: Optional[Dict[str, Any]]) -> dict:
+        ...
+
+    @abstractmethod
+    def _create_index(self, spec: IndexSpec) -> None:
+        ...
+
+    def _transaction(self):
+        return _NullTransaction()
+
+    @abstractmethod
+    async def _run(self, fn: Callable, *args) -> Any:
+        ...
+
+    # Synchronous implementations of the write paths
+    def _first(self, filter: dict) -> Optional[Tuple[Any, dict]]:
+        rows = list(self._scan(filter, [], 0, 1))
+        return rows[0] if rows else None
+
+    def _replace_sync(self, filter: dict, replacement: dict, upsert: bool) -> UpdateResult:
+        found = self._first(filter)
+        if found is None:
+            if not upsert:
+                return UpdateResult()
+            doc = {**_upsert_seed(filter), **copy.deepcopy(replacement)}
+            self._insert(doc)
+            return UpdateResult(upserted_id=doc.get("id"))
+        key, current = found
+        doc = copy.deepcopy(replacement)
+        modified = doc != current
+        if modified:
+            self._write(key, doc)
+        return UpdateResult(matched_count=1, modified_count=int(modified))
+
+    def _update_sync(self, filter: dict, update: dict, upsert: bool) -> Tuple[UpdateResult, Optional[dict], Optional[dict]]:
+        found = self._first(filter)
+        if found is None:
+            if not upsert:
+                return UpdateResult(), None, None
+            doc = _upsert_seed(filter)
+            apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            return UpdateResult(upserted_id=doc.get("id")), None, doc
+        key, current = found
+        before = copy.deepcopy(current)
+        doc = copy.deepcopy(current)
+        modified = apply_update(doc, update)
+        if modified:
+            self._write(key, doc)
+        return UpdateResult(matched_count=1, modified_count=int(modified)), before, doc
+
+    def _delete_sync(self, filter: dict, many: bool) -> DeleteResult:
+        keys = [key for key, _ in self._scan(filter, [], 0, 0 if many else 1)]
+        for key in keys:
+            self._remove(key)
+        return DeleteResult(deleted_count=len(keys))
+
+    def _bulk_sync(self, operations: Sequence[Any], ordered: bool) -> BulkWriteResult:
+        result = BulkWriteResult()
+        errors = []
+        with self._transaction():
+            for op in operations:
+                try:
+                    if isinstance(op, InsertOne):
+                        self._insert(copy.deepcopy(op.document))
+                        result.inserted_count += 1
+                    elif isinstance(op, (UpdateOne, ReplaceOne)):
+                        if isinstance(op, UpdateOne):
+                            outcome = self._update_sync(op.filter, op.update, op.upsert)[0]
+                        else:
+                            outcome = self._replace_sync(op.filter, op.replacement, op.upsert)
+                        result.matched_count += outcome.matched_count
+                        result.modified_count += outcome.modified_count
+                        # An upsert that matched nothing inserted (duplicates raise above)
+                        result.upserted_count += int(op.upsert and not outcome.matched_count)
+                    elif isinstance(op, DeleteOne):
+                        result.deleted_count += self._delete_sync(op.filter, many=False).deleted_count
+                    else:
+                        raise StorageError(f"Unsupported bulk operation: {op!r}")
+                except DuplicateKeyError as e:
+                    errors.append(e)
+                    if ordered:
+                        break
+        if errors:
+            raise errors[0]
+        return result
+
+    # Async interface
+    async def find_one(self, filter, projection=None):
+        found = await self._run(self._first, filter or {})
+        return None if found is None else self._export(found[1], projection)
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, batch_size=DEFAULT_BATCH_SIZE):
+        return EmbeddedCursor(self, filter, projection, sort, skip, limit, batch_size)
+
+    async def count_documents(self, filter=None):
+        return await self._run(lambda: sum(1 for _ in self._scan(filter or {}, [], 0, 0)))
+
+    async def insert_one(self, document):
+        await self._run(self._insert, copy.deepcopy(document))
+        return document.get("id")
+
+    async def replace_one(self, filter, replacement, upsert=False):
+        return await self._run(self._replace_sync, filter, replacement, upsert)
+
+    async def update_one(self, filter, update, upsert=False):
+        return (await self._run(self._update_sync, filter, update, upsert))[0]
+
+    async def find_one_and_update(self, filter, update, upsert=False, return_new=True, projection=None):
+        _, before, after = await self._run(self._update_sync, filter, update, upsert)
+        doc = after if return_new else before
+        return None if doc is None else self._export(doc, projection)
+
+    async def delete_one(self, filter):
+        return await self._run(self._delete_sync, filter, False)
+
+    async def delete_many(self, filter):
+        return await self._run(self._delete_sync, filter, True)
+
+    async def bulk_write(self, operations, ordered=True):
+        return await self._run(self._bulk_sync, list(operations), ordered)
+
+    async def create_index(self, spec):
+        await self._run(self._create_index, spec)
+
+
+class _NullTransaction:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _index_value(value: Any) -> Any:
+    if value is _MISSING:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+class MemoryCollection(EmbeddedCollection):
+    """Documents held in a dict, with hash indexes for equality lookups"""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._docs: Dict[int, dict] = {}
+        self._ids = itertools.count(1)
+        self._indexes: Dict[IndexSpec, Dict[tuple, set]] = {}
+
+    async def _run(self, fn, *args):
+        return fn(*args)
+
+    def _index_key(self, spec: IndexSpec, doc: dict) -> tuple:
+        return tuple(_index_value(get_path(doc, field)) for field in spec.fields)
+
+    def _check_unique(self, doc: dict, ignore: Optional[int] = None) -> None:
+        for spec, entries in self._indexes.items():
+            if not spec.unique:
+                continue
+            holders = entries.get(self._index_key(spec, doc), set()) - {ignore}
+            if holders:
+                raise DuplicateKeyError(f"Duplicate key for index {spec.name} in {self.name}")
+
+    def _index_add(self, key: int, doc: dict) -> None:
+        for spec, entries in self._indexes.items():
+            entries.setdefault(self._index_key(spec, doc), set()).add(key)
+
+    def _index_remove(self, key: int, doc: dict) -> None:
+        for spec, entries in self._indexes.items():
+            holders = entries.get(self._index_key(spec, doc))
+            if holders:
+                holders.discard(key)
+                if not holders:
+                    del entries[self._index_key(spec, doc)]
+
+    @staticmethod
+    def _equalities(filter: dict) -> Dict[str, Any]:
+        return {
+            k: v for k, v in filter.items()
+            if not k.startswith("$") and v is not None and not isinstance(v, (dict, list))
+        }
+
+    def _pick_index(self, equalities: Dict[str, Any]) -> Optional[IndexSpec]:
+        # Use the index with the most fields fully covered by plain equality
+        best = None
+        for spec in self._indexes:
+            if all(field in equalities for field in spec.fields):
+                if best is None or len(spec.fields) > len(best.fields):
+                    best = spec
+        return best
+
+    def _candidates(self, filter: dict) -> Iterator[int]:
+        equalities = self._equalities(filter)
+        best = self._pick_index(equalities)
+        if best is None:
+            return iter(list(self._docs))
+        lookup = tuple(equalities[field] for field in best.fields)
+        return iter(sorted(self._indexes[best].get(lookup, ())))
+
+    def _scan(self, filter, sort, skip, limit):
+        docs = self._docs
+        # Keys are snapshotted up front; skip documents deleted while a cursor is open
+        matches = (
+            (key, docs[key]) for key in self._candidates(filter)
+            if key in docs and match_filter(docs[key], filter)
+        )
+        if sort:
+            matches = iter(sort_documents(list(matches), sort))
+        stop = skip + limit if limit else None
+        return itertools.islice(matches, skip, stop)
+
+    def _insert(self, doc):
+        self._check_unique(doc)
+        key = next(self._ids)
+        self._docs[key] = doc
+        self._index_add(key, doc)
+        return key
+
+    def _write(self, key, doc):
+        self._check_unique(doc, ignore=key)
+        self._index_remove(key, self._docs[key])
+        self._docs[key] = doc
+        self._index_add(key, doc)
+
+    def _remove(self, key):
+        self._index_remove(key, self._docs.pop(key))
+
+    def _export(self, doc, projection):
+        return copy.deepcopy(project(doc, projection))
+
+    async def explain(self, filter=None, sort=None):
+        # Hash indexes only serve full equality matches; sorting is always in memory
+        best = self._pick_index(self._equalities(filter or {}))
+        return {
+            "stage": "IXSCAN" if best else "COLLSCAN",
+            "index": best.name if best else None,
+            "sorted": not sort,
+            "detail": {"documents": len(self._docs)},
+        }
+
+    def _create_index(self, spec):
+        if spec in self._indexes:
+            return
+        entries: Dict[tuple, set] = {}
+        for key, doc in self._docs.items():
+            index_key = self._index_key(spec, doc)
+            if spec.unique and entries.get(index_key):
+                raise DuplicateKeyError(f"Cannot build unique index {spec.name} on {self.name}")
+            entries.setdefault(index_key, set()).add(key)
+        self._indexes[spec] = entries
+
+
+class MemoryStorage(Storage):
+    def _open_collection(self, name):
+        return MemoryCollection(name)
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        pass
+
+
+_PLAIN_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def json_path_expr(path: str) -> str:
+    """SQL expression extracting a dotted path from the doc column"""
+    parts = ["$"]
+    for part in path.split("."):
+        if part.isdigit():
+            parts.append(f"[{part}]")
+        elif _PLAIN_KEY.match(part):
+            parts.append(f".{part}")
+        elif '"' not in part:
+            parts.append(f'."{part}"')
+        else:
+            raise StorageError(f"Unsupported field name in path: {path!r}")
+    literal = "".join(parts).replace("'", "''")
+    return f"json_extract(doc, '{literal}')"
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+
+def _sql_condition(path: str, condition: Any, params: list) -> str:
+    expr = json_path_expr(path)
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        condition = {"$eq": condition}
+    clauses = []
+    for operator, operand in condition.items():
+        if isinstance(operand, (dict, list)) and operator not in ("$in", "$nin"):
+            raise StorageError(f"Embedded SQL engine only matches scalar values ({path})")
+        if operator == "$eq":
+            if operand is None:
+                clauses.append(f"{expr} IS NULL")
+            else:
+                clauses.append(f"{expr} = ?")
+                params.append(operand)
+        elif operator == "$ne":
+            if operand is None:
+                clauses.append(f"{expr} IS NOT NULL")
+            else:
+                clauses.append(f"({expr} IS NULL OR {expr} != ?)")
+                params.append(operand)
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            sql_op = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[operator]
+            clauses.append(f"{expr} {sql_op} ?")
+            params.append(operand)
+        elif operator in ("$in", "$nin"):
+            values = [v for v in operand if v is not None]
+            has_null = len(values) != len(operand)
+            placeholders = ", ".join("?" for _ in values)
+            params.extend(values)
+            if operator == "$in":
+                parts = ([f"{expr} IN ({placeholders})"] if values else []) + ([f"{expr} IS NULL"] if has_null else [])
+                clauses.append("(" + " OR ".join(parts) + ")" if parts else "0")
+            else:
+                not_in = f"{expr} NOT IN ({placeholders})" if values else "1"
+                clauses.append(f"({expr} IS NOT NULL AND {not_in})" if has_null else f"({expr} IS NULL OR {not_in})")
+        elif operator == "$exists":
+            type_expr = expr.replace("json_extract(", "json_type(", 1)
+            clauses.append(f"{type_expr} IS {'NOT ' if operand else ''}NULL")
+        elif operator == "$regex":
+            literal = operand[1:] if operand.startswith("^") else None
+            if literal and not (set(literal) & _REGEX_META):
+                # Anchored literal prefix: a range scan the expression index can serve
+                clauses.append(f"({expr} >= ? AND {expr} < ?)")
+                params.extend([literal, _prefix_upper_bound(literal)])
+            else:
+                clauses.append(f"{expr} REGEXP ?")
+                params.append(operand)
+        else:
+            raise StorageError(f"Unsupported query operator: {operator}")
+    return " AND ".join(clauses) if clauses else "1"
+
+
+def compile_filter(filter: Optional[Dict[str, Any]], params: list) -> str:
+    """Compile a Mongo filter to a SQL WHERE clause over json_extract()"""
+    clauses = []
+    for key, condition in (filter or {}).items():
+        if key in ("$and", "$or"):
+            joined = f" {key[1:].upper()} ".join(f"({compile_filter(sub, params)})" for sub in condition)
+            clauses.append(f"({joined})" if joined else ("1" if key == "$and" else "0"))
+        else:
+            clauses.append(_sql_condition(key, condition, params))
+    return " AND ".join(clauses) if clauses else "1"
+
+
+def _regexp(pattern: str, value: Any) -> bool:
+    return isinstance(value, str) and re.search(pattern, value) is not None
+
+
+class SQLiteCollection(EmbeddedCollection):
+    """Documents stored as JSON text in one table per collection"""
+
+    def __init__(self, name: str, storage: "SQLiteStorage"):
+        super().__init__(name)
+        if not _PLAIN_KEY.match(name):
+            raise StorageError(f"Invalid collection name: {name!r}")
+        self._storage = storage
+        self._table = f'"{name}"'
+        self._ready = False
+        self._index_keys: List[Tuple[Tuple[str, int], ...]] = []
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = self._storage._connection()
+        if not self._ready:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self._table} (pk INTEGER PRIMARY KEY, doc TEXT NOT NULL)")
+            conn.commit()
+            self._ready = True
+        return conn
+
+    async def _run(self, fn, *args):
+        return await self._storage._run(fn, *args)
+
+    def _transaction(self):
+        return _SQLiteTransaction(self._conn)
+
+    def _select(self, filter, sort, skip, limit) -> Tuple[str, list]:
+        params: list = []
+        sql = f"SELECT pk, doc FROM {self._table} WHERE {compile_filter(filter, params)}"
+        if sort:
+            order = ", ".join(f"{json_path_expr(f)} {'DESC' if d < 0 else 'ASC'}" for f, d in sort)
+            sql += f" ORDER BY {order}, pk {self._tiebreak(sort)}"
+        if limit or skip:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit or -1, skip])
+        return sql, params
+
+    def _tiebreak(self, sort: Sequence[Tuple[str, int]]) -> str:
+        # Index entries with equal keys are in pk order; an index walked
+        # backwards to serve a sort yields them in reverse, so break ties the
+        # same way and let the index deliver the whole ORDER BY
+        sort = tuple(sort)
+        for keys in self._index_keys:
+            tail = keys[-len(sort):]
+            if len(keys) >= len(sort) and [f for f, _ in tail] == [f for f, _ in sort]:
+                if all(d == -sd for (_, d), (_, sd) in zip(tail, sort)):
+                    return "DESC"
+                if all(d == sd for (_, d), (_, sd) in zip(tail, sort)):
+                    return "ASC"
+        return "ASC"
+
+    def _scan(self, filter, sort, skip, limit):
+        cursor = self._conn.execute(*self._select(filter, sort, skip, limit))
+        return ((pk, json.loads(doc)) for pk, doc in cursor)
+
+    def _explain(self, filter, sort) -> Dict[str, Any]:
+        sql, params = self._select(filter, sort, 0, 0)
+        detail = [row[3] for row in self._conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        index = None
+        for line in detail:
+            match = re.search(r"USING (?:COVERING )?INDEX (\S+)", line)
+            if match:
+                index = match.group(1).strip('"').removeprefix(f"{self.name}_")
+                break
+        return {
+            "stage": "IXSCAN" if index else "COLLSCAN",
+            "index": index,
+            "sorted": not any("TEMP B-TREE" in line for line in detail),
+            "detail": detail,
+        }
+
+    async def explain(self, filter=None, sort=None):
+        return await self._run(self._explain, filter or {}, sort or [])
+
+    def _dump(self, doc: dict) -> str:
+        return json.dumps(doc, ensure_ascii=False, default=_json_default)
+
+    def _execute_write(self, sql: str, params: tuple) -> sqlite3.Cursor:
+        try:
+            return self._conn.execute(sql, params)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"{self.name}: {e}") from e
+
+    def _insert(self, doc):
+        return self._execute_write(f"INSERT INTO {self._table} (doc) VALUES (?)", (self._dump(doc),)).lastrowid
+
+    def _write(self, key, doc):
+        self._execute_write(f"UPDATE {self._table} SET doc = ? WHERE pk = ?", (self._dump(doc), key))
+
+    def _remove(self, key):
+        self._execute_write(f"DELETE FROM {self._table} WHERE pk = ?", (key,))
+
+    def _export(self, doc, projection):
+        # Rows are decoded fresh for every read, so no defensive copy is needed
+        return project(doc, projection)
+
+    def _create_index(self, spec):
+        columns = ", ".join(
+            f"{json_path_expr(field)}{' DESC' if direction < 0 else ''}" for field, direction in spec.keys
+        )
+        unique = "UNIQUE " if spec.unique else ""
+        try:
+            self._conn.execute(
+                f'CREATE {unique}INDEX IF NOT EXISTS "{self.name}_{spec.name}" ON {self._table} ({columns})'
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"Cannot build unique index {spec.name} on {self.name}: {e}") from e
+        self._conn.commit()
+        if spec.keys not in self._index_keys:
+            self._index_keys.append(spec.keys)
+
+
+class _SQLiteTransaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN")
+        return self
+
+    def __exit__(self, *exc):
+        # Like Mongo bulk writes, operations applied before a failure are kept
+        self._conn.commit()
+        return False
+
+
+class SQLiteStorage(Storage):
+    """SQLite/JSON1 storage; every statement runs on one dedicated thread"""
+
+    def __init__(self, path: str = ":memory:"):
+        super().__init__()
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # Autocommit mode: statements outside an explicit transaction are durable immediately
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args))
+
+    def _open_collection(self, name):
+        return SQLiteCollection(name, self)
+
+    async def ping(self):
+        try:
+            await self._run(lambda: self._connection().execute("SELECT 1").fetchone())
+            return True
+        except sqlite3.Error:
+            return False
+
+    async def close(self):
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(_close)
+        self._executor.shutdown(wait=True)
+
+
+# ===== MONGODB =====
+
+class MotorCursor(Cursor):
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    async def _iterate(self):
+        async for doc in self._cursor:
+            yield doc
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return await self._cursor.to_list(length)
+
+
+def _mongo_projection(projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # Never leak ObjectIds: documents are addressed by their "id" field
+    return {**(projection or {}), "_id": 0}
+
+
+# MongoDB's error code for a unique index violation
+MONGO_DUPLICATE_KEY = 11000
+
+
+@contextmanager
+def _mongo_duplicates():
+    """Raise pymongo's duplicate key errors as this module's DuplicateKeyError"""
+    from pymongo.errors import DuplicateKeyError as MongoDuplicateKeyError
+    try:
+        yield
+    except MongoDuplicateKeyError as e:
+        raise DuplicateKeyError(str(e)) from e
+
+
+class MotorCollection(Collection):
+    def __init__(self, collection):
+        self._coll = collection
+        self.name = collection.name
+
+    async def find_one(self, filter, projection=None):
+        return await self._coll.find_one(filter, _mongo_projection(projection))
+
+    def find(self, filter=None, projection=None, sort=None, skip=0, limit=0, batch_size=DEFAULT_BATCH_SIZE):
+        cursor = self._coll.find(filter or {}, _mongo_projection(projection), batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(list(sort))
+        if skip:
+            cursor = cursor.skip(skip)
+        if limit:
+            cursor = cursor.limit(limit)
+        return MotorCursor(cursor)
+
+    async def count_documents(self, filter=None):
+        return await self._coll.count_documents(filter or {})
+
+    async def insert_one(self, document):
+        with _mongo_duplicates():
+            await self._coll.insert_one(dict(document))
+        return document.get("id")
+
+    async def _upserted_id(self, result) -> Optional[str]:
+        # pymongo reports the ObjectId; callers address documents by "id"
+        if result.upserted_id is None:
+            return None
+        doc = await self._coll.find_one({"_id": result.upserted_id}, {"_id": 0, "id": 1})
+        return doc.get("id") if doc else None
+
+    async def replace_one(self, filter, replacement, upsert=False):
+        with _mongo_duplicates():
+            result = await self._coll.replace_one(filter, replacement, upsert=upsert)
+        return UpdateResult(result.matched_count, result.modified_count, await self._upserted_id(result))
+
+    async def update_one(self, filter, update, upsert=False):
+        with _mongo_duplicates():
+            result = await self._coll.update_one(filter, update, upsert=upsert)
+        return UpdateResult(result.matched_count, result.modified_count, await self._upserted_id(result))
+
+    async def find_one_and_update(self, filter, update, upsert=False, return_new=True, projection=None):
+        from pymongo import ReturnDocument
+        with _mongo_duplicates():
+            return await self._coll.find_one_and_update(
+                filter,
+                update,
+                projection=_mongo_projection(projection),
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER if return_new else ReturnDocument.BEFORE,
+            )
+
+    async def delete_one(self, filter):
+        result = await self._coll.delete_one(filter)
+        return DeleteResult(result.deleted_count)
+
+    async def delete_many(self, filter):
+        result = await self._coll.delete_many(filter)
+        return DeleteResult(result.deleted_count)
+
+    async def bulk_write(self, operations, ordered=True):
+        import pymongo
+        from pymongo.errors import BulkWriteError
+        requests = []
+        for op in operations:
+            if isinstance(op, InsertOne):
+                requests.append(pymongo.InsertOne(dict(op.document)))
+            elif isinstance(op, UpdateOne):
+                requests.append(pymongo.UpdateOne(op.filter, op.update, upsert=op.upsert))
+            elif isinstance(op, ReplaceOne):
+                requests.append(pymongo.ReplaceOne(op.filter, op.replacement, upsert=op.upsert))
+            elif isinstance(op, DeleteOne):
+                requests.append(pymongo.DeleteOne(op.filter))
+            else:
+                raise StorageError(f"Unsupported bulk operation: {op!r}")
+        if not requests:
+            return BulkWriteResult()
+        try:
+            result = await self._coll.bulk_write(requests, ordered=ordered)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors") or []
+            # Only a pure unique-index violation is a DuplicateKeyError; anything
+            # else (validation, write concern, ...) surfaces as pymongo raised it
+            if write_errors and not e.details.get("writeConcernErrors") and all(
+                error.get("code") == MONGO_DUPLICATE_KEY for error in write_errors
+            ):
+                raise DuplicateKeyError(str(write_errors)) from e
+            raise
+        return BulkWriteResult(
+            inserted_count=result.inserted_count,
+            matched_count=result.matched_count,
+            modified_count=result.modified_count,
+            deleted_count=result.deleted_count,
+            upserted_count=result.upserted_count,
+        )
+
+    async def create_index(self, spec):
+        await self._coll.create_index(list(spec.keys), unique=spec.unique, name=spec.name)
+
+    async def explain(self, filter=None, sort=None):
+        cursor = self._coll.find(filter or {})
+        if sort:
+            cursor = cursor.sort(list(sort))
+        detail = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        stages, plan = [], detail
+        while plan:
+            stages.append(plan)
+            plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+        # The leaf stage reads the data: IXSCAN (EXPRESS_IXSCAN, IDHACK) or COLLSCAN
+        leaf = stages[-1] if stages else {}
+        return {
+            "stage": "COLLSCAN" if leaf.get("stage", "COLLSCAN") == "COLLSCAN" else "IXSCAN",
+            "index": leaf.get("indexName"),
+            "sorted": not any(stage.get("stage") == "SORT" for stage in stages),
+            "detail": detail,
+        }
+
+
+class MotorStorage(Storage):
+    """MongoDB via Motor; the driver is only imported and connected on first use"""
+
+    def __init__(self, connect: Callable[[], Any]):
+        super().__init__()
+        self._connect = connect
+
+    @functools.cached_property
+    def connection(self):
+        return self._connect()
+
+    @property
+    def client(self):
+        return self.connection.client
+
+    @property
+    def db(self):
+        return self.connection.database
+
+    def _open_collection(self, name):
+        return MotorCollection(self.db[name])
+
+    async def open(self):
+        await self.connection.open()
+
+    async def ping(self):
+        return await self.connection.ping()
+
+    def pool_stats(self):
+        return self.connection.stats()
+
+    async def close(self):
+        if "connection" in self.__dict__:
+            self.connection.close()
+
+
+def create_storage(backend: str, **options) -> Storage:
+    """Build a storage backend by name: "mongo", "memory" or "sqlite"""
+    backend = (backend or "mongo").lower()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(options.get("sqlite_path") or ":memory:")
+    if backend == "mongo":
+        def connect():
+            from connection import MongoConnectionManager, MongoSettings
+            if options.get("mongo_url"):
+                settings = MongoSettings(options["mongo_url"], options["db_name"])
+            else:
+                settings = MongoSettings.from_env()
+            return MongoConnectionManager(settings)
+        return MotorStorage(connect)
+    raise ValueError(f"Unknown storage backend: {backend!r}")
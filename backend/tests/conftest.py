@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Never require a running MongoDB for the test suite
+os.environ["STORAGE_BACKEND"] = "memory"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def client():
+    """The app with its lifespan (warm-up and shutdown) running"""
+    import server
+
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+class Created:
+    """Ids of armies and factions a test created, deleted when the test ends"""
+
+    def __init__(self):
+        self.armies = []
+        self.factions = []
+
+    def army(self, army_id):
+        self.armies.append(army_id)
+        return army_id
+
+    def faction(self, faction_id):
+        self.factions.append(faction_id)
+        return faction_id
+
+
+@pytest.fixture
+def created(client):
+    """Register what a test creates in the shared app storage; it is removed even if the test fails"""
+    ids = Created()
+    yield ids
+    for army_id in ids.armies:
+        client.delete(f"/api/armies/{army_id}")
+    for faction_id in ids.factions:
+        client.delete(f"/api/factions/{faction_id}")
+
+
+@pytest.fixture
+def wait_for_job():
+    """Poll a 202 response's job until it finishes and return the job record"""
+    def wait(client, response, timeout=5.0):
+        assert response.status_code == 202, response.text
+        deadline = time.monotonic() + timeout
+        while True:
+            job = client.get(response.json()["status_url"]).json()
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            assert time.monotonic() < deadline, f"job still {job['status']}"
+            time.sleep(0.01)
+    return wait
@@ -0,0 +1,98 @@
+import asyncio
+
+import server
+
+ARMY = {"name": "Rev", "game": "Age of Fantasy", "faction": "Test", "points_limit": 1000, "units": []}
+
+
+def unit(unit_id, cost):
+    return {"id": unit_id, "unit_name": f"Unit {unit_id}", "unit_type": "unit",
+            "base_cost": cost, "total_cost": cost, "selected_upgrades": [], "combined_unit": False}
+
+
+def test_conditional_update_conflicts_with_current_state(client, created):
+    army = client.post("/api/armies", json=ARMY).json()
+    army_id = created.army(army["id"])
+    assert army["revision"] == 1
+    assert client.get(f"/api/armies/{army_id}").headers["etag"] == '"1"'
+
+    first = client.put(f"/api/armies/{army_id}", json={"name": "First"}, headers={"If-Match": '"1"'})
+    assert first.status_code == 200 and first.json()["revision"] == 2 and first.headers["etag"] == '"2"'
+
+    stale = client.put(f"/api/armies/{army_id}", json={"name": "Stale"}, headers={"If-Match": '"1"'})
+    assert stale.status_code == 409
+    assert stale.json()["current"]["name"] == "First" and stale.json()["current"]["revision"] == 2
+
+    by_body = client.put(f"/api/armies/{army_id}", json={"units": [unit("u", 90)], "revision": 2})
+    assert by_body.json()["revision"] == 3
+    assert client.put(f"/api/armies/{army_id}", json={"name": "Blind"}).json()["revision"] == 4
+    assert client.get(f"/api/armies/{army_id}").json()["total_points"] == 90
+
+    assert client.put("/api/armies/missing", json={"name": "X"}, headers={"If-Match": '"1"'}).status_code == 404
+    assert client.put(f"/api/armies/{army_id}", json={}, headers={"If-Match": "nope"}).status_code == 400
+
+
+def test_batch_update_reports_each_army(client, created):
+    a = created.army(client.post("/api/armies", json=ARMY).json()["id"])
+    b = created.army(client.post("/api/armies", json=ARMY).json()["id"])
+
+    response = client.put("/api/armies", json={"updates": [
+        {"id": a, "revision": 1, "name": "A"},
+        {"id": b, "revision": 5, "name": "B"},
+        {"id": "missing", "name": "C"},
+    ]})
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["updated", "conflict", "not_found"]
+    assert results[0]["revision"] == 2
+    assert results[1]["current"]["name"] == "Rev" and results[1]["revision"] == 1
+    stored = client.get(f"/api/armies/{a}").json()
+    assert stored["name"] == "A" and set(stored) <= set(ARMY) | {"id", "revision", "total_points", "created_at", "updated_at"}
+
+    duplicate = client.put("/api/armies", json={"updates": [
+        {"id": a, "revision": 2, "name": "A2"},
+        {"id": a, "revision": 3, "name": "A3"},
+    ]})
+    assert duplicate.status_code == 422
+    assert client.get(f"/api/armies/{a}").json()["revision"] == 2
+
+
+def test_batch_updates_are_bounded_by_the_pool(client, created, monkeypatch):
+    response = client.post("/api/armies/bulk", json={"create": [ARMY] * 6})
+    ids = [created.army(army_id) for army_id in response.json()["created"]]
+    update = server.storage.armies.find_one_and_update
+    in_flight, peak = [0], [0]
+
+    async def tracked_update(*args, **kwargs):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        try:
+            await asyncio.sleep(0.01)
+            return await update(*args, **kwargs)
+        finally:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(server, "ARMY_BATCH_CONCURRENCY", 2)
+    monkeypatch.setattr(server.storage.armies, "find_one_and_update", tracked_update)
+    results = client.put("/api/armies", json={"updates": [{"id": i, "name": "Bounded"} for i in ids]}).json()["results"]
+    assert [r["status"] for r in results] == ["updated"] * 6 and peak[0] == 2
+
+
+def test_live_session_stops_on_conflicting_save(client, created):
+    army_id = created.army(client.post("/api/armies", json=ARMY).json()["id"])
+
+    with client.websocket_connect(f"/api/armies/{army_id}/live") as ws:
+        assert ws.receive_json()["army"]["revision"] == 1
+        ws.send_json({"seq": 1, "op": "add_unit", "unit": unit("u1", 100)})
+        ws.receive_json()
+        ws.send_json({"op": "flush"})
+        assert ws.receive_json()["revision"] == 2
+
+        client.put(f"/api/armies/{army_id}", json={"name": "Elsewhere"})
+        ws.send_json({"seq": 2, "op": "add_unit", "unit": unit("u2", 100)})
+        ws.receive_json()
+        ws.send_json({"op": "flush"})
+        conflict = ws.receive_json()
+        assert conflict["type"] == "conflict" and conflict["current"]["name"] == "Elsewhere"
+
+    army = client.get(f"/api/armies/{army_id}").json()
+    assert army["revision"] == 3 and [u["id"] for u in army["units"]] == ["u1"]
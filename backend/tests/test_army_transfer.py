@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import server
+from army_transfer import ndjson_lines
+
+ARMY = {"name": "Bulk", "game": "Age of Fantasy", "faction": "Transfer", "points_limit": 1000,
+        "units": [{"id": "u", "unit_name": "U", "unit_type": "unit", "base_cost": 40, "total_cost": 40}]}
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.anyio
+async def test_lines_span_chunks_and_long_lines_are_dropped():
+    lines = [line async for line in ndjson_lines(chunks(b'{"a"', b':1}\n\n{"b":2}\nxxxxxxxx', b"xxxx\n{}"), max_line=8)]
+    assert lines == [(1, b'{"a":1}'), (3, b'{"b":2}'), (4, None), (5, b"{}")]
+
+
+def test_bulk_export_and_import_round_trip(client, created):
+    response = client.post("/api/armies/bulk", json={"create": [ARMY] * 3})
+    ids = [created.army(army_id) for army_id in response.json()["created"]]
+    assert len(ids) == 3
+
+    export = client.get("/api/armies/export", params={"faction": "Transfer"})
+    assert export.headers["content-type"] == "application/x-ndjson"
+    armies = [json.loads(line) for line in export.text.splitlines()]
+    assert sorted(army["id"] for army in armies) == sorted(ids)
+
+    assert client.post("/api/armies/bulk", json={"delete": ids[:2]}).json()["deleted"] == 2
+    armies[2]["name"] = "Restored"
+    body = "\n".join([json.dumps(army) for army in armies] + ["not json", '{"name": "no game"}', "[]"])
+    report = client.post("/api/armies/import", content=body).json()
+    assert report["lines"] == 6 and report["imported"] == 3 and report["failed"] == 3
+    assert [error["line"] for error in report["errors"]] == [4, 5, 6]
+
+    restored = client.get(f"/api/armies/{ids[2]}").json()
+    assert restored["name"] == "Restored" and restored["revision"] == 2
+    assert client.get(f"/api/armies/{ids[0]}").json()["total_points"] == 40
+
+    assert client.post("/api/armies/bulk", json={"delete": ids}).json()["deleted"] == 3
+    too_many = {"delete": ["x"] * (server.ARMY_BULK_LIMIT + 1)}
+    assert client.post("/api/armies/bulk", json=too_many).status_code == 413
@@ -0,0 +1,123 @@
+import copy
+import gzip
+import json
+
+import server
+
+
+def bundle_for(client, game_id):
+    manifest = client.get("/api/bundles").json()
+    return next(entry for entry in manifest["bundles"] if entry["game"] == game_id)
+
+
+def test_bundle_follows_faction_imports_and_deletes(client, created, wait_for_job):
+    client.get("/api/factions")  # seeds the catalog if empty
+    before = bundle_for(client, "age-of-fantasy")
+
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    assert faction["game"] == "Age of Fantasy"
+    faction["faction"] = "Bundle Test"
+    job = wait_for_job(client, client.post("/api/factions/import", json=faction))
+    faction_id = created.faction(job["result"]["id"])
+
+    after = bundle_for(client, "age-of-fantasy")
+    assert after["version"] != before["version"] and after["factions"] == before["factions"] + 1
+    versioned = client.get(after["url"])
+    assert versioned.status_code == 200 and "immutable" in versioned.headers["cache-control"]
+    assert versioned.headers["content-encoding"] == "gzip"
+    assert len(versioned.content) == after["size"]  # the client decompressed it
+    body = versioned.json()
+    assert body["version"] == after["version"] and "Bundle Test" in [f["faction"] for f in body["factions"]]
+
+    etag = versioned.headers["etag"]
+    assert client.get("/api/bundles/age-of-fantasy", headers={"If-None-Match": etag}).status_code == 304
+    raw = client.get("/api/bundles/age-of-fantasy", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in raw.headers and json.loads(raw.content)["version"] == after["version"]
+
+    client.delete(f"/api/factions/{faction_id}")
+    assert bundle_for(client, "age-of-fantasy")["version"] == before["version"]
+    assert client.get(after["url"]).status_code == 404
+    assert client.get("/api/bundles/no-such-game").status_code == 404
+
+
+def test_unchanged_games_are_not_rebuilt(client):
+    client.get("/api/factions")
+    bundle = server.catalog_bundles.get("age-of-fantasy")
+    assert gzip.decompress(bundle.body)[:1] == b"{"
+    builds = server.catalog_bundles.builds
+    client.portal.call(server.load_faction_catalog)
+    assert server.catalog_bundles.builds == builds and server.catalog_bundles.get("age-of-fantasy") is bundle
+
+
+def test_gzip_negotiation_honours_q_values():
+    assert server.accepts_gzip("gzip, deflate, br")
+    assert server.accepts_gzip("br;q=1.0, gzip;q=0.5")
+    assert server.accepts_gzip("*")
+    assert not server.accepts_gzip("gzip;q=0")
+    assert not server.accepts_gzip("identity")
+    assert not server.accepts_gzip("*;q=0.5, gzip;q=0")
+
+
+def test_other_workers_pick_up_faction_changes(client, created, monkeypatch):
+    client.get("/api/factions")
+    before = bundle_for(client, "age-of-fantasy")
+
+    # Another worker stores a faction and bumps the generation; this one never saw the write
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction.update(id="other-worker-faction", faction="From Another Worker")
+    client.portal.call(server.storage.factions.insert_one, server.stamp(faction))
+    created.faction(faction["id"])
+    client.portal.call(
+        server.storage.collection("catalog_state").update_one,
+        {"id": "catalog"}, {"$inc": {"generation": 1}}, True,
+    )
+    monkeypatch.setattr(server, "CATALOG_CHECK_INTERVAL", 0)
+
+    after = bundle_for(client, "age-of-fantasy")
+    assert after["version"] != before["version"] and client.get(after["url"]).status_code == 200
+    assert ("Age of Fantasy", "From Another Worker") in server.faction_hashes
+
+
+def test_seeding_refreshes_the_catalog_once(client, created, monkeypatch, tmp_path):
+    faction = dict(server.load_sample_factions()[0], faction="Seeded Once")
+    monkeypatch.setattr(server, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(server, "load_sample_factions", lambda: [faction])
+    changes = []
+    refresh = server.faction_changed
+
+    async def counting_faction_changed(*args):
+        changes.append(args)
+        await refresh(*args)
+
+    monkeypatch.setattr(server, "faction_changed", counting_faction_changed)
+    client.portal.call(server.seed_factions)
+    assert len(changes) == 1
+    seeded = [f for f in client.get("/api/factions").json() if f["faction"] == "Seeded Once"]
+    assert len(seeded) == 1
+    created.faction(seeded[0]["id"])
+    client.portal.call(server.seed_factions)
+    assert len(changes) == 1
+
+
+def test_back_to_back_writes_reload_the_catalog_once(client, monkeypatch):
+    client.get("/api/factions")
+    loads = []
+    load = server.load_faction_catalog
+
+    async def counting_load():
+        loads.append(1)
+        await load()
+
+    monkeypatch.setattr(server, "load_faction_catalog", counting_load)
+
+    async def import_many():
+        for _ in range(5):
+            await server.faction_changed()
+        await server.catalog_reload_task
+
+    client.portal.call(import_many)
+    assert len(loads) == 1
+    # A read right after a write sees it without waiting for the debounce
+    client.portal.call(server.faction_changed)
+    client.get("/api/factions")
+    assert len(loads) == 2
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import server
+from catalog_snapshot import CatalogSnapshot, SnapshotStore, write_snapshot
+
+FACTIONS = [
+    {"id": "a", "faction": "Disciples de la Guerre", "game": "Age of Fantasy", "units": [{"name": "Guerriers"}]},
+    {"id": "b", "faction": "Sœurs Bénies", "game": "Grimdark Future", "units": []},
+]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    info = write_snapshot(FACTIONS, path)
+    snapshot = CatalogSnapshot(path)
+
+    assert len(snapshot) == 2 and snapshot.version == info["version"]
+    assert snapshot.get("b") == FACTIONS[1]
+    assert bytes(snapshot.raw("a")) == json.dumps(FACTIONS[0], ensure_ascii=False, separators=(",", ":")).encode()
+    assert json.loads(snapshot.raw_list("Grimdark Future")) == [FACTIONS[1]]
+    assert json.loads(snapshot.raw_list()) == FACTIONS
+    assert snapshot.get("missing") is None
+
+
+def test_store_follows_atomic_swap(tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    write_snapshot(FACTIONS[:1], path)
+    store = SnapshotStore(path)
+    first = store.current()
+    assert "b" not in first
+
+    write_snapshot(FACTIONS, path)
+    second = store.current()
+    assert second is not first and "b" in second
+    # Readers still holding the old mapping keep working
+    assert first.get("a") == FACTIONS[0]
+
+
+@pytest.fixture
+def snapshot_client(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "catalog_snapshot", SnapshotStore(tmp_path / "catalog.snapshot"))
+    # Started only after the patch so the warm-up writes the temporary snapshot
+    return request.getfixturevalue("client")
+
+
+def test_server_serves_and_refreshes_snapshot(snapshot_client, created, wait_for_job):
+    factions = snapshot_client.get("/api/factions").json()
+    assert factions and server.catalog_snapshot.current() is not None
+
+    response = snapshot_client.post("/api/factions/import", json={"faction": "Nouvelle", "game": "Age of Fantasy"})
+    imported = wait_for_job(snapshot_client, response)["result"]
+    created.faction(imported["id"])
+    # The first read after the write rebuilds the catalog and snapshot
+    assert snapshot_client.get(f"/api/factions/{imported['id']}").json()["faction"] == "Nouvelle"
+    assert imported["id"] in server.catalog_snapshot.current()
+
+    snapshot_client.delete(f"/api/factions/{imported['id']}")
+    assert snapshot_client.get(f"/api/factions/{imported['id']}").status_code == 404
+
+
+def test_other_workers_writes_retire_the_snapshot(snapshot_client, monkeypatch):
+    snapshot_client.get("/api/factions")
+    stale = server.catalog_snapshot.current()
+    assert stale.generation == server.catalog_generation
+    assert all(entry["id"] in server.faction_catalog for entry in stale.entries)
+
+    # Another worker (on another host) changes a faction and bumps the generation
+    faction = dict(snapshot_client.get("/api/factions").json()[0])
+    renamed = {**faction, "faction": "Renamed Elsewhere"}
+    snapshot_client.portal.call(server.storage.factions.replace_one, {"id": faction["id"]}, renamed)
+    try:
+        snapshot_client.portal.call(
+            server.storage.collection("catalog_state").update_one,
+            {"id": "catalog"}, {"$inc": {"generation": 1}}, True,
+        )
+        monkeypatch.setattr(server, "CATALOG_CHECK_INTERVAL", 0)
+
+        assert snapshot_client.get(f"/api/factions/{faction['id']}").json()["faction"] == "Renamed Elsewhere"
+        assert server.catalog_snapshot.current().generation == server.catalog_generation != stale.generation
+    finally:
+        snapshot_client.portal.call(server.storage.factions.replace_one, {"id": faction["id"]}, faction)
+        snapshot_client.portal.call(server.faction_changed)
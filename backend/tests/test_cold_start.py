@@ -0,0 +1,21 @@
+"""Cold start budget: app import + startup + first request in a fresh interpreter"""
+
+import startup_profile
+
+
+def test_cold_start_within_budget():
+    budget = startup_profile.cold_start_budget_ms()
+    report = startup_profile.measure_cold_start("/api/games")
+    assert report["status"] == 200
+    assert report["total_ms"] <= budget, (
+        f"Cold start took {report['total_ms']:.0f} ms (budget {budget:.0f} ms): "
+        f"import {report['import_ms']:.0f} ms, startup {report['startup_ms']:.0f} ms, "
+        f"first request {report['first_request_ms']:.0f} ms; run startup_profile.py for a breakdown"
+    )
+
+
+def test_import_does_not_load_mongo_driver(monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "mongo")
+    imports = startup_profile.import_breakdown()
+    loaded = {row["module"].split(".")[0] for row in imports["slowest_self"]}
+    assert not loaded & {"motor", "pymongo"}
@@ -0,0 +1,77 @@
+import json
+
+import server
+from compact_catalog import CompactCatalog, measure_memory
+from faction_watcher import read_faction_files
+
+
+def full_catalog():
+    factions, _ = read_faction_files(sorted(server.DATA_DIR.glob("*.json")))
+    factions = [{**f, "id": f"file-{i}"} for i, f in enumerate(factions)]
+    return factions + [{**f, "id": f"sample-{i}"} for i, f in enumerate(server.load_sample_factions())]
+
+
+def test_lossless_round_trip():
+    factions = full_catalog()
+    catalog = CompactCatalog.build(json.loads(json.dumps(f)) for f in factions)
+    for faction in factions:
+        restored = catalog.get_dict(faction["id"])
+        assert restored == faction
+        assert json.dumps(restored) == json.dumps(faction)  # key order too
+
+
+def test_irregular_documents_round_trip():
+    odd = {
+        "units": "not-a-list",
+        "id": "odd",
+        "faction": "Odd",
+        "custom": {"nested": [1, 1.0, True, None]},
+        "spells": {},
+    }
+    weird_unit = {"name": "U", "weapons": [{"name": "W", "attacks": 1}, "bad"], "special_rules": [1, "x"], "flag": True}
+    other = {"id": "other", "units": [weird_unit, {"base_cost": 1.0}, {"base_cost": 1}]}
+    catalog = CompactCatalog.build([odd, other])
+    assert catalog.get_dict("odd") == odd
+    assert catalog.get_dict("other") == other
+    restored_costs = [u.get("base_cost") for u in catalog.get_dict("other")["units"][1:]]
+    assert [type(c) for c in restored_costs] == [float, int]
+
+
+def test_repeated_structures_are_shared():
+    catalog = CompactCatalog.build(full_catalog())
+    aof = next(f for f in catalog.factions.values() if f.game == "Age of Fantasy")
+    regiments = next(f for f in catalog.factions.values() if f.game == "Age of Fantasy Regiments")
+    # Regiments units reuse the AoF weapon profiles and rule lists by index
+    units = catalog.tables.units.items
+    aof_unit = next(units[i] for i in catalog.factions["sample-0"].units if units[i].name == "Guerriers de la Guerre")
+    regiments_unit = next(units[i] for i in regiments.units if units[i].name == "Guerriers de la Guerre")
+    assert aof_unit is not regiments_unit
+    assert list(aof_unit.weapons) == list(regiments_unit.weapons)
+    assert aof_unit.special_rules == regiments_unit.special_rules
+    assert catalog.tables.counts()["mounts"] < sum(
+        len(g.options) for g in catalog.tables.groups.items if g.type == "mount"
+    )
+    assert aof.units
+
+
+def test_compact_form_uses_less_memory():
+    raw = [json.dumps(f).encode() for f in full_catalog()]
+    report = measure_memory(raw)
+    assert report["compact_bytes"] < report["dict_bytes"]
+
+
+def test_faction_reads_are_served_from_the_catalog(client, monkeypatch):
+    listed = client.get("/api/factions").json()
+    assert len(server.faction_catalog) == len(listed)
+    faction = listed[0]
+
+    async def unavailable(*args, **kwargs):
+        raise AssertionError("read went to storage")
+
+    monkeypatch.setattr(server.storage.factions, "get", unavailable)
+    monkeypatch.setattr(server.storage.factions, "find", unavailable)
+    server.faction_reads.forget()
+    assert client.get(f"/api/factions/{faction['id']}").json() == faction
+    assert client.get("/api/factions", params={"game": faction["game"]}).json() == [
+        f for f in listed if f["game"] == faction["game"]
+    ]
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import server
+from execution import PROCESS, THREAD, DeadlineExceeded, ExecutionLayer, offload, request_id
+
+
+def current_request_id(pause=0.0):
+    time.sleep(pause)
+    return request_id.get()
+
+
+@pytest.fixture
+async def layer():
+    layer = ExecutionLayer(processes=1, threads=2)
+    yield layer
+    await layer.close()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("kind", [THREAD, PROCESS])
+async def test_calls_carry_the_request_id(layer, kind):
+    request_id.set("req-1")
+    assert await layer.run(current_request_id, kind=kind) == "req-1"
+    stats = layer.stats()[kind]
+    assert stats["completed"] == 1 and stats["in_flight"] == 0 and stats["latency"]["avg_ms"] is not None
+
+
+@pytest.mark.anyio
+async def test_deadline_cancels_queued_calls(layer):
+    slow = offload(THREAD, timeout=0.05, layer=layer)(current_request_id)
+    with pytest.raises(DeadlineExceeded):
+        await slow(0.5)
+    # Both threads are busy or the call is queued behind them; either way it misses the deadline
+    with pytest.raises(DeadlineExceeded):
+        await layer.run(current_request_id, 0.5, kind=PROCESS, timeout=0.01)
+    assert layer.stats()[THREAD]["timed_out"] == 1 and layer.stats()[PROCESS]["timed_out"] == 1
+
+
+def test_large_rosters_are_validated_off_loop(client):
+    faction = server.load_sample_factions()[0]
+    unit = faction["units"][0]
+    roster = {
+        "game": faction["game"], "faction": faction["faction"], "points_limit": 100000,
+        "units": [{"id": str(i), "unit_name": unit["name"], "unit_type": "unit", "base_cost": unit["base_cost"],
+                   "total_cost": unit["base_cost"], "selected_upgrades": []}
+                  for i in range(server.VALIDATION_OFFLOAD_UNITS + 1)],
+    }
+    response = client.post("/api/validate", json=roster, headers={"X-Request-ID": "trace-42"})
+    assert response.status_code == 200 and response.headers["x-request-id"] == "trace-42"
+    assert response.json()["total_points"] == unit["base_cost"] * len(roster["units"])
+    assert client.get("/api/metrics").json()["execution"][PROCESS]["completed"] >= 1
+
+
+def test_large_faction_imports_are_parsed_off_loop(client, created, monkeypatch, wait_for_job):
+    faction = dict(server.load_sample_factions()[0], faction="Parsed Off Loop")
+    monkeypatch.setattr(server, "IMPORT_PARSE_OFFLOAD_BYTES", 100)
+    before = client.get("/api/metrics").json()["execution"][PROCESS]["completed"]
+    job = wait_for_job(client, client.post("/api/factions/import", json=faction))
+    assert job["status"] == "succeeded"
+    created.faction(job["result"]["id"])
+    assert client.get("/api/metrics").json()["execution"][PROCESS]["completed"] > before
+
+    broken = wait_for_job(client, client.post("/api/factions/import", content=b"{" * 200))
+    assert broken["status"] == "failed" and broken["error"] == "Invalid JSON format"
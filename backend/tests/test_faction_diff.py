@@ -0,0 +1,79 @@
+import copy
+
+import server
+from faction_diff import diff_faction
+from storage import apply_update
+
+
+def sample_faction():
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction["id"] = "stored"
+    return faction
+
+
+def test_recost_is_a_targeted_update():
+    stored = sample_faction()
+    incoming = copy.deepcopy(stored)
+    del incoming["id"]
+    incoming["units"][1]["base_cost"] += 10
+    incoming["units"][0]["upgrade_groups"][0]["options"][0]["cost"] += 5
+
+    changes = diff_faction(stored, incoming)
+    assert changes.set == {
+        "units.1.base_cost": incoming["units"][1]["base_cost"],
+        "units.0.upgrade_groups.0": incoming["units"][0]["upgrade_groups"][0],
+    }
+    assert not changes.unset
+    summary = changes.summary()
+    assert summary["units_recosted"] == [stored["units"][0]["name"], stored["units"][1]["name"]]
+    assert summary["units_added"] == summary["units_removed"] == summary["units_modified"] == []
+
+    updated = copy.deepcopy(stored)
+    apply_update(updated, changes.update())
+    assert updated == {**incoming, "id": "stored"}
+
+
+def test_added_and_removed_units_rewrite_the_list():
+    stored = sample_faction()
+    incoming = copy.deepcopy(stored)
+    removed = incoming["units"].pop(0)
+    incoming["units"].append({**incoming["units"][0], "name": "Brand New"})
+    incoming["units"][0]["special_rules"] = incoming["units"][0]["special_rules"] + ["Fearless"]
+    del incoming["description"]
+
+    changes = diff_faction(stored, incoming)
+    assert changes.set == {"units": incoming["units"]}
+    assert changes.unset == ["description"]
+    summary = changes.summary()
+    assert summary["units_added"] == ["Brand New"]
+    assert summary["units_removed"] == [removed["name"]]
+    assert summary["units_modified"] == [incoming["units"][0]["name"]]
+    assert summary["fields_changed"] == ["description"]
+
+
+def test_identical_faction_has_no_changes():
+    stored = sample_faction()
+    incoming = {k: v for k, v in copy.deepcopy(stored).items() if k != "id"}
+    assert not diff_faction(stored, incoming).changed
+
+
+def test_reimport_reports_changes_and_skips_no_op_writes(client, created, wait_for_job):
+    def import_faction(data):
+        return wait_for_job(client, client.post("/api/factions/import", json=copy.deepcopy(data)))["result"]
+
+    faction = copy.deepcopy(server.load_sample_factions()[1])
+    faction["faction"] = "Differential Import Test"
+    faction_id = created.faction(import_faction(faction)["id"])
+
+    unchanged = import_faction(faction)
+    assert unchanged["message"] == "Faction 'Differential Import Test' unchanged"
+    assert unchanged["changes"]["changed"] is False
+
+    faction["units"][0]["base_cost"] += 15
+    updated = import_faction(faction)
+    assert updated["id"] == faction_id
+    assert updated["changes"]["units_recosted"] == [faction["units"][0]["name"]]
+
+    stored = client.get(f"/api/factions/{faction_id}").json()
+    assert stored["units"][0]["base_cost"] == faction["units"][0]["base_cost"]
+    assert {k: v for k, v in stored.items() if k not in ("id", "content_hash")} == faction
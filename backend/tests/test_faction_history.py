@@ -0,0 +1,87 @@
+import copy
+
+import pytest
+
+import server
+from json_patch import JsonPatchError, apply_patch, make_patch
+
+
+def test_patch_round_trip_and_escaping():
+    src = {"a/b": 1, "t~": [1, 2, 3, 4], "keep": {"x": 1}, "gone": True}
+    dst = {"a/b": 2, "t~": [1, 9, 2, 3, 4], "keep": {"x": 1.0}, "new": None}
+    patch = make_patch(src, dst)
+    assert apply_patch(src, patch) == dst
+    assert {"op": "add", "path": "/t~0/1", "value": 9} in patch
+    assert {"op": "replace", "path": "/a~1b", "value": 2} in patch
+
+
+def test_list_edits_in_the_middle_stay_small():
+    units = [{"name": f"Unit {i}", "base_cost": 10 * i} for i in range(30)]
+    inserted = units[:10] + [{"name": "New", "base_cost": 5}] + units[10:]
+    assert make_patch(units, inserted) == [{"op": "add", "path": "/10", "value": {"name": "New", "base_cost": 5}}]
+    removed = units[:3] + units[5:]
+    assert apply_patch(units, make_patch(units, removed)) == removed
+    assert len(make_patch(units, removed)) == 2
+
+
+def test_apply_rejects_bad_paths():
+    with pytest.raises(JsonPatchError):
+        apply_patch({"a": []}, [{"op": "replace", "path": "/missing", "value": 1}])
+    with pytest.raises(JsonPatchError):
+        apply_patch({"a": []}, [{"op": "add", "path": "/a/5", "value": 1}])
+
+
+def test_changes_since_previous_import(client, created, wait_for_job):
+    def import_faction(data):
+        return wait_for_job(client, client.post("/api/factions/import", json=copy.deepcopy(data)))["result"]
+
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction["faction"] = "Delta Sync Test"
+    faction_id = created.faction(import_faction(faction)["id"])
+    first = client.get(f"/api/factions/{faction_id}").json()
+
+    faction["units"][0]["base_cost"] += 5
+    import_faction(faction)
+    current = client.get(f"/api/factions/{faction_id}").json()
+    assert current["content_hash"] != first["content_hash"]
+
+    response = client.get(f"/api/factions/{faction_id}/changes", params={"since": first["content_hash"]})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/json-patch+json")
+    assert response.headers["etag"] == f'"{current["content_hash"]}"'
+    patch = response.json()
+    assert apply_patch(first, patch) == current
+    assert {op["path"] for op in patch} == {"/units/0/base_cost", "/content_hash"}
+
+    # Up to date clients get an empty patch; unknown revisions must refetch
+    up_to_date = client.get(f"/api/factions/{faction_id}/changes", params={"since": current["content_hash"]})
+    assert up_to_date.json() == []
+    assert client.get(f"/api/factions/{faction_id}/changes", params={"since": "0" * 64}).status_code == 410
+
+    client.delete(f"/api/factions/{faction_id}")
+    assert client.get(f"/api/factions/{faction_id}/changes", params={"since": first["content_hash"]}).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_history_is_bounded():
+    from faction_history import FactionHistory, stamp
+    from storage import create_storage
+
+    storage = create_storage("memory")
+    await storage.ensure_indexes()
+    history = FactionHistory(storage, limit=3)
+    doc = {"id": "f1", "faction": "F", "game": "G", "units": []}
+    hashes = []
+    for cost in range(5):
+        doc = stamp({**doc, "units": [{"name": "U", "base_cost": cost}]})
+        await history.record(doc)
+        hashes.append(doc["content_hash"])
+    assert not await history.record(doc)
+
+    assert await storage.collection("faction_revisions").count_documents({"faction_id": "f1"}) == 3
+    assert await history.changes(doc, hashes[0]) is None
+    patch = await history.changes(doc, hashes[2])
+    assert patch == [
+        {"op": "replace", "path": "/units/0/base_cost", "value": 4},
+        {"op": "replace", "path": "/content_hash", "value": hashes[4]},
+    ]
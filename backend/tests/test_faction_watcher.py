@@ -0,0 +1,101 @@
+import asyncio
+import copy
+import json
+
+import pytest
+
+import server
+from faction_watcher import DirectoryWatcher, read_faction_files
+
+
+def write_faction(path, faction):
+    path.write_text(json.dumps(faction, ensure_ascii=False), encoding="utf-8")
+
+
+def test_read_faction_files_reports_bad_files(tmp_path):
+    write_faction(tmp_path / "ok.json", {"game": "G", "faction": "F", "units": []})
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    write_faction(tmp_path / "list.json", [1, 2])
+    factions, errors = read_faction_files(sorted(tmp_path.glob("*.json")) + [tmp_path / "gone.json"])
+    assert [f["faction"] for f in factions] == ["F"] and factions[0]["content_hash"]
+    assert set(errors) == {str(tmp_path / "broken.json"), str(tmp_path / "list.json")}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("use_inotify", [True, False])
+async def test_watcher_debounces_changes_into_one_callback(tmp_path, use_inotify):
+    batches = []
+
+    async def on_change(paths):
+        batches.append([path.name for path in paths])
+
+    watcher = DirectoryWatcher(tmp_path, on_change, debounce=0.1, poll_interval=0.05, use_inotify=use_inotify)
+    watcher.start()
+    try:
+        await asyncio.sleep(0.1)  # let the poller take its first snapshot
+        for name in ("a.json", "b.json", "a.json", ".a.json.swp", "notes.txt"):
+            (tmp_path / name).write_text("{}", encoding="utf-8")
+            await asyncio.sleep(0.02)
+        for _ in range(100):
+            if batches:
+                break
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.2)
+    finally:
+        await watcher.close()
+    assert batches == [["a.json", "b.json"]]
+    assert watcher.stats()["reloads"] == 1
+
+
+def test_sync_writes_only_changed_factions(client, tmp_path):
+    first = copy.deepcopy(server.load_sample_factions()[0])
+    first["faction"] = "Watched One"
+    second = copy.deepcopy(first)
+    second["faction"] = "Watched Two"
+    paths = [tmp_path / "one.json", tmp_path / "two.json"]
+    write_faction(paths[0], first)
+    write_faction(paths[1], second)
+
+    report = client.portal.call(server.sync_faction_files, paths)
+    assert sorted(report["inserted"]) == ["Watched One", "Watched Two"] and not report["updated"]
+
+    second["units"][0]["base_cost"] += 5
+    write_faction(paths[1], second)
+    report = client.portal.call(server.sync_faction_files, paths)
+    assert report["updated"] == ["Watched Two"] and report["unchanged"] == 1
+
+    factions = {f["faction"]: f for f in client.get("/api/factions", params={"game": first["game"]}).json()}
+    assert factions["Watched Two"]["units"][0]["base_cost"] == second["units"][0]["base_cost"]
+
+    # Startup seeding never overwrites factions already in storage
+    second["units"][0]["base_cost"] += 5
+    write_faction(paths[1], second)
+    report = client.portal.call(lambda: server.sync_faction_files(paths, replace=False))
+    assert report["unchanged"] == 2 and not report["updated"]
+
+
+def test_concurrent_reloads_write_each_faction_once(client, tmp_path, monkeypatch):
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction["faction"] = "Watched Twice"
+    path = tmp_path / "twice.json"
+    write_faction(path, faction)
+
+    async def two_workers():
+        # Both read storage before either writes, as two workers would
+        return await asyncio.gather(server.sync_faction_files([path]), server.sync_faction_files([path]))
+
+    client.portal.call(two_workers)
+    stored = [f for f in client.get("/api/factions").json() if f["faction"] == "Watched Twice"]
+    assert len(stored) == 1
+
+    # Only the worker holding the watcher lease applies file changes
+    synced = []
+
+    async def sync(paths, replace=True):
+        synced.append(paths)
+
+    monkeypatch.setattr(server, "sync_faction_files", sync)
+    client.portal.call(server.storage.acquire_lease, "faction_watcher", "other-worker", 60)
+    client.portal.call(server.reload_faction_files, [path])
+    assert synced == []
+    client.portal.call(server.storage.acquire_lease, "faction_watcher", "other-worker", -1)
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import server
+from jobs import FAILED, SUCCEEDED, JobError, JobQueue, QueueFull
+from storage import create_storage
+
+
+def test_upload_runs_as_a_job(client, created, wait_for_job):
+    content = b'{"faction": "Job Upload", "game": "Age of Fantasy", "units": [{"name": "U", "base_cost": 10}]}'
+    response = client.post("/api/factions/upload", files={"file": ("job.json", content, "application/json")})
+    assert response.headers["location"] == response.json()["status_url"]
+    job = wait_for_job(client, response)
+    assert job["status"] == SUCCEEDED and job["source"] == "upload:job.json"
+    created.faction(job["result"]["id"])
+    assert job["result"]["units_count"] == 1
+    assert job["queue_ms"] is not None and job["run_ms"] is not None
+
+
+def test_bad_imports_fail_with_an_error(client, wait_for_job):
+    job = wait_for_job(client, client.post("/api/factions/import", content=b"{not json"))
+    assert (job["status"], job["error"]) == (FAILED, "Invalid JSON format")
+    job = wait_for_job(client, client.post("/api/factions/import", json={"faction": "No game"}))
+    assert job["error"] == "JSON must contain 'faction' and 'game' fields"
+    assert client.get("/api/jobs/missing").status_code == 404
+
+
+def test_full_queue_answers_503_with_retry_after(client, monkeypatch):
+    async def refuse(*args, **kwargs):
+        raise QueueFull(7)
+
+    monkeypatch.setattr(server.import_jobs, "submit", refuse)
+    response = client.post("/api/factions/import", json={"faction": "F", "game": "G"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+
+
+@pytest.mark.anyio
+async def test_queue_caps_concurrency_and_capacity():
+    queue = JobQueue(create_storage("memory"), workers=1, max_queued=1)
+    queue.start()
+    release, running = asyncio.Event(), []
+
+    async def slow():
+        running.append(1)
+        await release.wait()
+        return {"ok": True}
+
+    async def broken():
+        raise JobError("bad input")
+
+    first = await queue.submit("test", slow)
+    await asyncio.sleep(0.01)
+    second = await queue.submit("test", broken)
+    with pytest.raises(QueueFull) as full:
+        await queue.submit("test", slow)
+    assert full.value.retry_after >= 1
+    assert running == [1] and queue.stats()["queued"] == 1
+
+    release.set()
+    await queue._queue.join()
+    assert (await queue.get(first["id"]))["result"] == {"ok": True}
+    assert (await queue.get(second["id"]))["error"] == "bad input"
+    await queue.close()
@@ -0,0 +1,141 @@
+import asyncio
+import random
+
+import pytest
+
+import server
+from army_rules import IncrementalValidator, validate_roster
+from live_roster import EditError, LiveRosterSession
+
+
+def unit(unit_id, cost, hero=False):
+    return {"id": unit_id, "unit_name": f"Unit {unit_id}", "unit_type": "hero" if hero else "unit",
+            "base_cost": cost, "total_cost": cost, "selected_upgrades": [], "combined_unit": False}
+
+
+def test_incremental_validation_matches_full_validation():
+    rng = random.Random(7)
+    validator = IncrementalValidator(750)
+    for step in range(300):
+        action = rng.random()
+        if action < 0.45 or not validator.units:
+            validator.put(unit(f"u{step}", rng.randrange(20, 400), hero=rng.random() < 0.3),
+                          rng.randrange(len(validator.units) + 1))
+        elif action < 0.7:
+            unit_id = rng.choice(list(validator.units))
+            validator.put({**validator.units[unit_id], "total_cost": rng.randrange(20, 400)})
+        elif action < 0.85:
+            validator.remove(rng.choice(list(validator.units)))
+        elif action < 0.95:
+            validator.move(rng.choice(list(validator.units)), rng.randrange(len(validator.units)))
+        else:
+            validator.set_points_limit(rng.choice([375, 750, 1000, 2000]))
+        roster = {"points_limit": validator.points_limit, "units": list(validator.units.values())}
+        assert validator.result() == validate_roster(roster)
+
+
+@pytest.mark.anyio
+async def test_session_returns_deltas_and_debounces_saves():
+    saved = []
+
+    async def persist(state):
+        saved.append(state)
+
+    session = LiveRosterSession({"id": "a", "name": "A", "points_limit": 1000, "units": [unit("h", 100, hero=True)]},
+                                persist, debounce=0.02, max_delay=0.2)
+    assert session.apply({"op": "add_unit", "unit": unit("x", 400)}) == {
+        "valid": False,
+        "errors": [{"type": "error", "message": session.validation["errors"][0]["message"], "unit_id": "x"}],
+        "total_points": 500,
+    }
+    for cost in (300, 310, 320):
+        session.apply({"op": "update_unit", "unit_id": "x", "changes": {"total_cost": cost}})
+    with pytest.raises(EditError):
+        session.apply({"op": "remove_unit", "unit_id": "missing"})
+    assert not saved
+
+    await asyncio.sleep(0.1)
+    assert len(saved) == 1 and saved[0]["total_points"] == 420
+    session.apply({"op": "set", "field": "name", "value": "Renamed"})
+    await session.close()
+    assert len(saved) == 2 and saved[1]["name"] == "Renamed"
+
+
+def test_websocket_session_edits_and_saves(client, created):
+    army_id = created.army(client.post("/api/armies", json={
+        "name": "Live", "game": "Age of Fantasy", "faction": "Test", "points_limit": 1000, "units": [],
+    }).json()["id"])
+
+    with client.websocket_connect(f"/api/armies/{army_id}/live") as ws:
+        state = ws.receive_json()
+        assert state["type"] == "state" and state["validation"]["total_points"] == 0
+
+        ws.send_json({"seq": 1, "op": "add_unit", "unit": unit("u1", 150, hero=True)})
+        assert ws.receive_json() == {"type": "validation", "seq": 1,
+                                     "delta": {"total_points": 150, "current_hero_count": 1}}
+        ws.send_json({"seq": 2, "op": "update_unit", "unit_id": "nope", "changes": {}})
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"op": "flush"})
+        assert ws.receive_json()["type"] == "saved"
+
+    army = client.get(f"/api/armies/{army_id}").json()
+    assert army["total_points"] == 150 and army["units"][0]["id"] == "u1"
+
+    with client.websocket_connect("/api/armies/missing/live") as ws:
+        assert ws.receive_json()["detail"] == "Army not found"
+
+
+def test_revision_advances_even_if_the_saved_notice_fails(client, created, monkeypatch):
+    army_id = created.army(client.post("/api/armies", json={
+        "name": "Live", "game": "Age of Fantasy", "faction": "Test", "points_limit": 1000, "units": [],
+    }).json()["id"])
+
+    async def failing_record(before, after):
+        raise ConnectionError("stats down")
+
+    with client.websocket_connect(f"/api/armies/{army_id}/live") as ws:
+        ws.receive_json()
+        monkeypatch.setattr(server.usage_stats, "record", failing_record)
+        ws.send_json({"seq": 1, "op": "add_unit", "unit": unit("u1", 150)})
+        ws.receive_json()
+        ws.send_json({"op": "flush"})
+        assert ws.receive_json()["type"] == "error"
+        monkeypatch.undo()
+
+        # The first write landed, so the next one builds on its revision instead of conflicting
+        ws.send_json({"seq": 2, "op": "add_unit", "unit": unit("u2", 50)})
+        ws.receive_json()
+        ws.send_json({"op": "flush"})
+        assert ws.receive_json()["type"] == "saved"
+
+    army = client.get(f"/api/armies/{army_id}").json()
+    assert army["revision"] >= 2 and army["total_points"] == 200
+
+
+def test_malformed_edits_are_rejected_without_touching_the_totals(client, created):
+    validator = IncrementalValidator(1000, [unit("a", 100), unit("b", 50)])
+    with pytest.raises(TypeError):
+        validator.put({**unit("a", 100), "total_cost": "120"})
+    assert validator.total_points == 150 and validator.result() == validate_roster(
+        {"points_limit": 1000, "units": [unit("a", 100), unit("b", 50)]}
+    )
+
+    army_id = created.army(client.post("/api/armies", json={
+        "name": "Live", "game": "Age of Fantasy", "faction": "Test", "points_limit": 1000,
+        "units": [unit("a", 100), unit("b", 50)],
+    }).json()["id"])
+
+    with client.websocket_connect(f"/api/armies/{army_id}/live") as ws:
+        ws.receive_json()
+        for seq, op in enumerate([
+            {"op": "update_unit", "unit_id": "a", "changes": {"total_cost": "120"}},
+            {"op": "add_unit", "unit": {**unit("c", 10), "base_cost": None}},
+            {"op": "add_unit", "unit": {**unit("d", 10), "unit_type": "titan"}},
+        ]):
+            ws.send_json({"seq": seq, **op})
+            assert ws.receive_json()["type"] == "error"
+        ws.send_json({"seq": 9, "op": "update_unit", "unit_id": "b", "changes": {"total_cost": 60}})
+        assert ws.receive_json()["delta"] == {"total_points": 160}
+
+    army = client.get(f"/api/armies/{army_id}").json()
+    assert army["total_points"] == 160 == client.post("/api/validate", json=army).json()["total_points"]
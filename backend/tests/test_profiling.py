@@ -0,0 +1,85 @@
+import pstats
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+from profiling import ProfileStore, ProfilingMiddleware, route_template
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+def profiled_app(store, **options):
+    app = FastAPI()
+
+    @app.get("/busy/{item}")
+    async def busy(item: str):
+        busy_loop(0.1)
+        return {"item": item}
+
+    @app.get("/quick")
+    async def quick():
+        return {}
+
+    app.add_middleware(ProfilingMiddleware, store=store, interval=0.002,
+                       route_key=route_template(app.router.routes), **options)
+    return app
+
+
+def test_token_profiles_one_request(tmp_path):
+    store = ProfileStore(tmp_path)
+    with TestClient(profiled_app(store, token="secret")) as client:
+        client.get("/busy/a")
+        client.get("/busy/b", headers={"X-Profile": "wrong"})
+        assert store.list() == []
+
+        client.get("/busy/c", headers={"X-Profile": "secret"})
+        client.get("/quick", params={"profile": "secret", "profile_mode": "cprofile"})
+
+    quick, busy = store.list()
+    assert busy["route"] == "/busy/{item}" and busy["status"] == 200 and busy["trigger"] == "token"
+    assert busy["samples"] > 10
+    stacks = store.path(busy["name"]).read_text(encoding="utf-8")
+    assert "busy_loop (test_profiling.py" in stacks
+    assert quick["mode"] == "cprofile" and quick["name"].endswith(".prof")
+    pstats.Stats(str(store.path(quick["name"])))
+
+
+def test_sampling_profiles_every_nth_request_per_route(tmp_path):
+    store = ProfileStore(tmp_path, keep=2)
+    with TestClient(profiled_app(store, sample_every=2)) as client:
+        for item in "abcde":
+            client.get(f"/busy/{item}")
+        client.get("/quick")
+    captures = store.list()
+    assert [c["path"] for c in captures] == ["/busy/d", "/busy/b"]
+    assert all(c["trigger"] == "sampled" for c in captures)
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_admin_endpoints_need_the_token(tmp_path, monkeypatch):
+    store = ProfileStore(tmp_path)
+    store.save({"method": "GET", "route": "/x", "path": "/x", "started": time.time()}, ".folded",
+               lambda path: path.write_text("main (x.py:1) 3\n"))
+    monkeypatch.setattr(server, "profile_store", store)
+    monkeypatch.setattr(server, "PROFILE_TOKEN", "secret")
+    # The app as server.py wires it when PROFILE_TOKEN is set
+    app = ProfilingMiddleware(server.app, store=store, token="secret", interval=0.002,
+                              route_key=route_template(server.app.router.routes), exclude=server.PROFILE_EXCLUDE)
+    with TestClient(app) as client:
+        assert client.get("/api/admin/profiles").status_code == 403
+        headers = {"X-Profile": "secret"}
+        [capture] = client.get("/api/admin/profiles", headers=headers).json()
+        download = client.get(f"/api/admin/profiles/{capture['name']}", headers=headers)
+        assert download.status_code == 200 and download.text == "main (x.py:1) 3\n"
+        assert client.get("/api/admin/profiles/..%2Fserver.py", headers=headers).status_code == 404
+        # Reading the captures doesn't capture itself
+        assert len(client.get("/api/admin/profiles", headers=headers).json()) == 1
+        client.get("/api/games", headers=headers)
+        assert [c["route"] for c in store.list()] == ["/api/games", "/x"]
@@ -0,0 +1,112 @@
+import pytest
+
+from repricing import COMPLETED, SUPERSEDED, ArmyRepricer, PriceList
+from storage import ASCENDING, create_storage
+
+pytestmark = pytest.mark.anyio
+
+FACTION = {
+    "id": "f1",
+    "faction": "Orcs",
+    "game": "Age of Fantasy",
+    "units": [
+        {
+            "name": "Boss",
+            "base_cost": 60,
+            "upgrade_groups": [{"group": "A", "options": [{"name": "Axe", "cost": 10}]}],
+        },
+        {"name": "Grunts", "base_cost": 100},
+    ],
+}
+
+
+def roster_unit(name, base_cost, upgrades=(), combined=False, total=None):
+    selected = [{"group": group, "option_name": option, "cost": cost} for group, option, cost in upgrades]
+    if total is None:
+        total = base_cost + sum(cost for _, _, cost in upgrades)
+    return {"id": f"u-{name}", "unit_name": name, "unit_type": "unit", "base_cost": base_cost,
+            "selected_upgrades": selected, "combined_unit": combined, "total_cost": total}
+
+
+def army(index, units):
+    return {"id": f"army-{index:03d}", "name": f"Army {index}", "game": "Age of Fantasy", "faction": "Orcs",
+            "points_limit": 1000, "units": units, "total_points": sum(u["total_cost"] for u in units),
+            "updated_at": "2024-01-01T00:00:00+00:00"}
+
+
+def test_price_list_reprices_units_and_upgrades():
+    prices = PriceList(FACTION)
+    update, unmatched = prices.price_army(army(0, [
+        roster_unit("Boss", 50, [("A", "Axe", 5)]),
+        # Whatever the client's rule for combined units, only the cost change is applied
+        roster_unit("Grunts", 90, combined=True, total=175),
+        roster_unit("Ghost", 30),
+    ]))
+    assert unmatched == 1
+    boss, grunts, ghost = update["units"]
+    assert (boss["base_cost"], boss["selected_upgrades"][0]["cost"], boss["total_cost"]) == (60, 10, 70)
+    assert grunts["total_cost"] == 185
+    assert ghost["total_cost"] == 30
+    assert update["total_points"] == 285
+
+    current = army(1, [roster_unit("Boss", 60, [("A", "Axe", 10)])])
+    assert prices.price_army(current) == ({}, 0)
+
+
+async def test_job_reprices_in_batches_and_resumes_from_checkpoint():
+    storage = create_storage("memory")
+    await storage.ensure_indexes()
+    await storage.factions.insert_one(FACTION)
+    for i in range(25):
+        await storage.armies.insert_one(army(i, [roster_unit("Grunts", 90)]))
+    await storage.armies.insert_one({**army(99, [roster_unit("Grunts", 90)]), "faction": "Elves"})
+
+    # A job interrupted after army-009 resumes from there
+    repricer = ArmyRepricer(storage, batch_size=10)
+    await storage.collection("repricing_jobs").insert_one({
+        "id": "job-1", "game": "Age of Fantasy", "faction": "Orcs", "faction_id": "f1", "status": "running",
+        "total": 25, "processed": 10, "updated": 10, "conflicts": 0, "unmatched_units": 0,
+        "checkpoint": "army-009", "finished_at": None, "error": None,
+    })
+    assert await repricer.resume() == 1
+    await repricer.wait("job-1")
+
+    job = await repricer.status("job-1")
+    assert job["status"] == COMPLETED
+    assert (job["processed"], job["updated"], job["progress"]) == (25, 25, 1.0)
+    assert job["checkpoint"] == "army-024"
+    # Armies before the checkpoint were not touched again; later ones were re-priced
+    assert (await storage.armies.get("army-005"))["total_points"] == 90
+    assert (await storage.armies.get("army-015"))["total_points"] == 100
+    assert (await storage.armies.get("army-099"))["total_points"] == 90
+
+
+async def test_edits_made_meanwhile_win_even_with_the_same_timestamp():
+    storage = create_storage("memory")
+    await storage.ensure_indexes()
+    await storage.armies.insert_one(army(0, [roster_unit("Grunts", 90)]))
+    await storage.armies.insert_one({**army(1, [roster_unit("Grunts", 90)]), "revision": 3})
+    snapshot = await storage.armies.find({}, sort=[("id", ASCENDING)]).to_list(None)
+    # The user saves army-001 after it was read, within the same timestamp
+    await storage.armies.update_one({"id": "army-001"}, {"$set": {"name": "Edited"}, "$inc": {"revision": 1}})
+
+    job = {"id": "job-1", "faction": "Orcs", "total": 2, "processed": 0, "updated": 0, "conflicts": 0,
+           "unmatched_units": 0, "checkpoint": None}
+    await ArmyRepricer(storage)._write_batch(job, PriceList(FACTION), snapshot)
+    assert (job["updated"], job["conflicts"]) == (1, 1)
+    assert (await storage.armies.get("army-000"))["revision"] == 1
+    edited = await storage.armies.get("army-001")
+    assert edited["name"] == "Edited" and edited["total_points"] == 90 and edited["revision"] == 4
+
+
+async def test_new_job_supersedes_active_one():
+    storage = create_storage("memory")
+    await storage.ensure_indexes()
+    await storage.factions.insert_one(FACTION)
+    repricer = ArmyRepricer(storage)
+    first = await repricer.start(FACTION)
+    second = await repricer.start(FACTION)
+    await repricer.wait(second["id"])
+    assert (await repricer.status(first["id"]))["status"] == SUPERSEDED
+    assert (await repricer.status(second["id"]))["status"] == COMPLETED
+    await repricer.close()
@@ -0,0 +1,53 @@
+import copy
+
+import server
+from roster_print import render
+
+
+def sample_army(faction):
+    hero = faction["units"][0]
+    group = hero["upgrade_groups"][1]
+    option = group["options"][0]
+    return {
+        "name": "Liste <tournoi>", "game": faction["game"], "faction": faction["faction"], "points_limit": 1000,
+        "units": [{"id": "h", "unit_name": hero["name"], "unit_type": "hero", "base_cost": hero["base_cost"],
+                   "selected_upgrades": [{"group": group["group"], "option_name": option["name"], "cost": option["cost"]}],
+                   "combined_unit": False, "total_cost": hero["base_cost"] + option["cost"]}],
+    }
+
+
+def test_render_joins_profiles_and_escapes():
+    faction = server.load_sample_factions()[0]
+    army = sample_army(faction)
+    sheet = "".join(render(army, faction, "html"))
+    assert "Liste &lt;tournoi&gt;" in sheet and "<tournoi>" not in sheet
+    option = army["units"][0]["selected_upgrades"][0]["option_name"]
+    assert option in sheet and "Référence des règles" in sheet
+    # The replacement weapon from the selected option is listed with the base profile
+    assert sheet.count("<tr><td>") == len(faction["units"][0]["weapons"]) + 1
+
+    text = "".join(render(army, faction, "text"))
+    assert text.startswith("Liste <tournoi>\n") and "Qualité 3+ Défense 3+" in text
+
+
+def test_reprints_come_from_cache_until_the_army_changes(client, created, wait_for_job):
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction["faction"] = "Print Test"
+    created.faction(wait_for_job(client, client.post("/api/factions/import", json=faction))["result"]["id"])
+    army_id = created.army(client.post("/api/armies", json=sample_army(faction)).json()["id"])
+
+    first = client.get(f"/api/armies/{army_id}/print")
+    assert first.status_code == 200 and first.headers["content-type"].startswith("text/html")
+    assert first.headers["x-render-cache"] == "miss"
+    again = client.get(f"/api/armies/{army_id}/print")
+    assert again.headers["x-render-cache"] == "hit" and again.content == first.content
+
+    text = client.get(f"/api/armies/{army_id}/print", params={"format": "text"})
+    assert text.headers["x-render-cache"] == "miss" and "Référence des règles" in text.text
+
+    client.put(f"/api/armies/{army_id}", json={"name": "Renamed"})
+    renamed = client.get(f"/api/armies/{army_id}/print")
+    assert renamed.headers["x-render-cache"] == "miss" and "Renamed" in renamed.text
+    # Both rosters of the faction shared one rendered appendix per format
+    assert len(server.roster_printer.appendices) >= 2
+    assert client.get("/api/armies/missing/print").status_code == 404
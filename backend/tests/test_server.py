@@ -0,0 +1,24 @@
+"""API tests against the in-memory storage backend"""
+
+import server
+
+
+def test_health_and_readiness(client):
+    assert client.get("/api/health").json()["status"] == "healthy"
+    ready = client.get("/api/ready")
+    assert ready.status_code == 200
+    body = ready.json()
+    assert body["status"] == "ready" and body["storage"]["reachable"]
+
+
+def test_readiness_reports_not_ready_before_warmup(client):
+    server.app.state.ready = False
+    try:
+        assert client.get("/api/ready").status_code == 503
+    finally:
+        server.app.state.ready = True
+
+
+def test_catalog_is_seeded_during_warmup(client):
+    factions = client.get("/api/factions").json()
+    assert {f["game"] for f in factions} >= {"Age of Fantasy", "Grimdark Future"}
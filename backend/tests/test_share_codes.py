@@ -0,0 +1,82 @@
+import base64
+import copy
+import json
+
+import pytest
+
+import server
+from share_codes import Codebook, ShareCodeError, read_varint, write_varint
+
+
+def roster_for(faction, name="Liste de tournoi"):
+    units = []
+    for unit in faction["units"][:3]:
+        upgrades = [{"group": group["group"], "option_name": group["options"][-1]["name"], "cost": group["options"][-1]["cost"]}
+                    for group in unit.get("upgrade_groups", [])[:2] if group.get("options")]
+        units.append({"id": unit["name"], "unit_name": unit["name"], "unit_type": unit.get("type", "unit"),
+                      "base_cost": unit["base_cost"], "selected_upgrades": upgrades, "combined_unit": len(units) == 1,
+                      "total_cost": 40 * len(units) + 25})
+    return {"name": name, "game": faction["game"], "faction": faction["faction"], "points_limit": 2000, "units": units}
+
+
+def test_varints_round_trip():
+    out = bytearray()
+    for value in (0, 1, 127, 128, 300, 2 ** 40):
+        write_varint(out, value)
+    pos, values = 0, []
+    while pos < len(out):
+        value, pos = read_varint(bytes(out), pos)
+        values.append(value)
+    assert values == [0, 1, 127, 128, 300, 2 ** 40]
+    assert out[:4] == bytearray([0, 1, 0x7F, 0x80])
+
+
+def test_codebook_round_trip_is_compact():
+    faction = server.load_sample_factions()[0]
+    codebook = Codebook(faction)
+    roster = roster_for(faction)
+    code = codebook.encode(roster)
+    assert len(code) < len(json.dumps(roster)) // 10
+
+    decoded = codebook.decode(code)
+    assert decoded["name"] == roster["name"] and decoded["points_limit"] == 2000
+    fields = ("unit_name", "combined_unit", "selected_upgrades", "total_cost")
+    assert [[u[f] for f in fields] for u in decoded["units"]] == [[u[f] for f in fields] for u in roster["units"]]
+    assert decoded["total_points"] == sum(u["total_cost"] for u in roster["units"])
+
+    # v1 codes carried no totals: units decode at their base plus upgrade costs
+    v1 = bytearray([1]) + bytes.fromhex(codebook.prefix)
+    for value in (1000, 0, 1, 0 << 1 | 1, 0):
+        write_varint(v1, value)
+    [unit] = codebook.decode(base64.urlsafe_b64encode(bytes(v1)).rstrip(b"=").decode())["units"]
+    assert unit["combined_unit"] and unit["total_cost"] == faction["units"][0]["base_cost"]
+
+    with pytest.raises(ShareCodeError):
+        codebook.decode(code[:-2])
+    with pytest.raises(ShareCodeError):
+        codebook.encode({**roster, "units": [{"unit_name": "Inconnu"}]})
+
+
+def test_old_codes_decode_after_faction_changes(client, created, wait_for_job):
+    faction = copy.deepcopy(server.load_sample_factions()[0])
+    faction["faction"] = "Share Code Test"
+    created.faction(wait_for_job(client, client.post("/api/factions/import", json=faction))["result"]["id"])
+
+    roster = roster_for(faction)
+    army_id = created.army(client.post("/api/armies", json=roster).json()["id"])
+    shared = client.get(f"/api/armies/{army_id}/share").json()
+    assert shared == client.post("/api/share", json=roster).json()
+
+    decoded = client.get(f"/api/share/{shared['code']}").json()
+    assert decoded["current"] and decoded["faction"] == "Share Code Test"
+    base_cost = decoded["units"][0]["base_cost"]
+
+    faction["units"][0]["base_cost"] += 10
+    wait_for_job(client, client.post("/api/factions/import", json=faction))
+    server.share_codebooks.clear()
+    old = client.get(f"/api/share/{shared['code']}").json()
+    assert not old["current"] and old["units"][0]["base_cost"] == base_cost
+    assert client.get(f"/api/armies/{army_id}/share").json()["code"] != shared["code"]
+
+    assert client.get("/api/share/AQ").status_code == 400
+    assert client.get("/api/share/AQAAAAAAAAAAAA").status_code == 404
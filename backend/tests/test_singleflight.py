@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import server
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_calls_share_one_fetch():
+    flights, fetches = SingleFlight(), []
+    release = asyncio.Event()
+
+    async def fetch():
+        fetches.append(1)
+        await release.wait()
+        return b"payload"
+
+    callers = [asyncio.create_task(flights.do("k", fetch)) for _ in range(50)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*callers) == [b"payload"] * 50
+    assert len(fetches) == 1
+    stats = flights.stats()
+    assert (stats["calls"], stats["fetches"], stats["coalesced"], stats["in_flight"]) == (50, 1, 49, 0)
+
+    # Without a grace window the next call fetches again
+    release.set()
+    await flights.do("k", fetch)
+    assert len(fetches) == 2
+
+
+async def test_errors_reach_every_waiter_and_are_not_replayed():
+    flights, attempts = SingleFlight(grace=10), []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0)
+        raise LookupError("missing")
+
+    results = await asyncio.gather(*(flights.do("k", failing) for _ in range(5)), return_exceptions=True)
+    assert all(isinstance(r, LookupError) for r in results)
+    with pytest.raises(LookupError):
+        await flights.do("k", failing)
+    assert len(attempts) == 2 and flights.stats()["errors"] == 2
+
+
+async def test_grace_window_and_cancelled_leader():
+    flights, fetches = SingleFlight(grace=10), []
+
+    async def fetch():
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        return len(fetches)
+
+    leader = asyncio.create_task(flights.do("k", fetch))
+    follower = asyncio.create_task(flights.do("k", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == 1
+    assert await flights.do("k", fetch) == 1
+    assert flights.stats()["grace_hits"] == 1
+    flights.forget()
+    assert await flights.do("k", fetch) == 2
+
+
+def test_faction_reads_are_coalesced_and_reported(client):
+    faction = client.get("/api/factions").json()[0]
+    before = client.get("/api/metrics").json()["read_coalescing"]["calls"]
+    assert client.get(f"/api/factions/{faction['id']}").json() == faction
+    assert client.get("/api/factions/missing").status_code == 404
+    assert client.get("/api/metrics").json()["read_coalescing"]["calls"] == before + 2
@@ -0,0 +1,255 @@
+"""Conformance suite every storage backend must pass.
+
+Set TEST_MONGO_URL to also run it against a live MongoDB.
+"""
+
+import os
+import uuid
+
+import pytest
+
+from storage import (
+    ASCENDING,
+    DESCENDING,
+    DeleteOne,
+    DuplicateKeyError,
+    IndexSpec,
+    InsertOne,
+    MotorStorage,
+    ReplaceOne,
+    UpdateOne,
+    create_storage,
+)
+
+pytestmark = pytest.mark.anyio
+
+BACKENDS = ["memory", "sqlite"] + (["mongo"] if os.environ.get("TEST_MONGO_URL") else [])
+
+
+@pytest.fixture(params=BACKENDS)
+async def storage(request):
+    if request.param == "mongo":
+        backend = create_storage(
+            "mongo",
+            mongo_url=os.environ["TEST_MONGO_URL"],
+            db_name=f"conformance_{uuid.uuid4().hex[:8]}",
+        )
+    else:
+        backend = create_storage(request.param, sqlite_path=":memory:")
+    await backend.ensure_indexes()
+    yield backend
+    if request.param == "mongo":
+        await backend.client.drop_database(backend.db.name)
+    await backend.close()
+
+
+def faction(name, game="Age of Fantasy", **extra):
+    return {
+        "id": str(uuid.uuid4()),
+        "faction": name,
+        "game": game,
+        "units": [{"name": "Guerriers", "base_cost": 80, "special_rules": ["Guerrier-né"]}],
+        **extra,
+    }
+
+
+async def test_get_by_id(storage):
+    doc = faction("Disciples de la Guerre")
+    await storage.factions.insert_one(doc)
+    assert await storage.factions.get(doc["id"]) == doc
+    assert await storage.factions.get("missing") is None
+
+
+async def test_returned_documents_are_copies(storage):
+    doc = faction("Disciples de la Guerre")
+    await storage.factions.insert_one(doc)
+    doc["units"].clear()
+    fetched = await storage.factions.get(doc["id"])
+    fetched["units"][0]["base_cost"] = 0
+    assert (await storage.factions.get(doc["id"]))["units"][0]["base_cost"] == 80
+
+
+async def test_find_filter_projection_sort(storage):
+    await storage.factions.insert_many([
+        faction("B", points=20),
+        faction("A", points=10),
+        faction("C", game="Grimdark Future", points=30),
+    ])
+
+    aof = await storage.factions.find({"game": "Age of Fantasy"}, {"faction": 1}, sort=[("faction", ASCENDING)]).to_list(10)
+    assert aof == [{"faction": "A"}, {"faction": "B"}]
+
+    desc = await storage.factions.find({}, {"points": 1}, sort=[("points", DESCENDING)]).to_list(10)
+    assert [d["points"] for d in desc] == [30, 20, 10]
+
+    excluded = await storage.factions.find({"faction": "A"}, {"units": 0}).to_list(10)
+    assert "units" not in excluded[0] and excluded[0]["faction"] == "A"
+
+    ranged = await storage.factions.find({"points": {"$gte": 15, "$lt": 30}}).to_list(10)
+    assert [d["faction"] for d in ranged] == ["B"]
+
+    chosen = await storage.factions.find({"faction": {"$in": ["A", "C"]}}, sort=[("faction", ASCENDING)]).to_list(10)
+    assert [d["faction"] for d in chosen] == ["A", "C"]
+
+    either = await storage.factions.find({"$or": [{"faction": "A"}, {"points": 30}]}).to_list(10)
+    assert sorted(d["faction"] for d in either) == ["A", "C"]
+
+    prefixed = await storage.factions.find({"faction": {"$regex": "^B"}}).to_list(10)
+    assert [d["faction"] for d in prefixed] == ["B"]
+
+    nested = await storage.factions.find({"units.0.base_cost": 80}).to_list(10)
+    assert len(nested) == 3
+
+    assert await storage.factions.count_documents({"game": "Age of Fantasy"}) == 2
+    assert await storage.factions.count_documents({"missing": {"$exists": True}}) == 0
+
+
+async def test_cursor_iteration_skip_limit(storage):
+    await storage.armies.insert_many([{"id": f"army-{i:03d}", "n": i} for i in range(25)])
+    cursor = storage.armies.find({}, sort=[("n", ASCENDING)], skip=5, limit=12, batch_size=4)
+    seen = [doc["n"] async for doc in cursor]
+    assert seen == list(range(5, 17))
+
+
+async def test_upsert_faction_by_key(storage):
+    first = {"faction": "Sœurs Bénies", "game": "Grimdark Future", "version": "1"}
+    faction_id, created = await storage.upsert_faction(first)
+    assert created
+
+    again_id, created = await storage.upsert_faction({"faction": "Sœurs Bénies", "game": "Grimdark Future", "version": "2"})
+    assert not created and again_id == faction_id
+
+    docs = await storage.factions.find({"faction": "Sœurs Bénies"}).to_list(10)
+    assert len(docs) == 1 and docs[0]["version"] == "2" and docs[0]["id"] == faction_id
+
+
+async def test_partial_updates(storage):
+    doc = faction("Disciples de la Guerre", counter=1)
+    await storage.factions.insert_one(doc)
+
+    result = await storage.factions.update_one(
+        {"id": doc["id"]},
+        {"$set": {"units.0.base_cost": 85, "version": "2"}, "$unset": {"counter": ""}, "$inc": {"hits": 2}},
+    )
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    updated = await storage.factions.get(doc["id"])
+    assert updated["units"][0]["base_cost"] == 85
+    assert updated["version"] == "2" and updated["hits"] == 2 and "counter" not in updated
+
+    missing = await storage.factions.update_one({"id": "missing"}, {"$set": {"version": "3"}})
+    assert missing.matched_count == 0
+
+    after = await storage.factions.find_one_and_update({"id": doc["id"]}, {"$inc": {"hits": 1}}, projection={"hits": 1})
+    assert after == {"hits": 3}
+    before = await storage.factions.find_one_and_update({"id": doc["id"]}, {"$inc": {"hits": 1}}, return_new=False, projection={"hits": 1})
+    assert before == {"hits": 3}
+
+
+async def test_upsert_update(storage):
+    result = await storage.collection("stats").update_one({"id": "units"}, {"$inc": {"count": 1}}, upsert=True)
+    assert result.matched_count == 0
+    await storage.collection("stats").update_one({"id": "units"}, {"$inc": {"count": 1}}, upsert=True)
+    assert (await storage.collection("stats").get("units"))["count"] == 2
+
+
+async def test_upserted_id_is_the_document_id(storage):
+    stats = storage.collection("stats")
+    inserted = await stats.update_one({"id": "units"}, {"$inc": {"count": 1}}, upsert=True)
+    assert inserted.upserted_id == "units"
+    assert (await stats.update_one({"id": "units"}, {"$inc": {"count": 1}}, upsert=True)).upserted_id is None
+    replaced = await stats.replace_one({"id": "armies"}, {"id": "armies", "count": 0}, upsert=True)
+    assert replaced.upserted_id == "armies"
+
+
+async def test_only_unique_violations_are_duplicate_key_errors(storage):
+    if not isinstance(storage, MotorStorage):
+        pytest.skip("the embedded backends have no other write errors")
+    await storage.armies.insert_one({"id": "a", "name": "text"})
+    with pytest.raises(DuplicateKeyError):
+        await storage.armies.bulk_write([InsertOne({"id": "a"})])
+    with pytest.raises(Exception) as raised:
+        await storage.armies.bulk_write([UpdateOne({"id": "a"}, {"$inc": {"name": 1}})])
+    assert not isinstance(raised.value, DuplicateKeyError)
+
+
+async def test_replace_and_delete(storage):
+    doc = faction("A")
+    await storage.factions.insert_one(doc)
+    replaced = await storage.factions.replace_one({"id": doc["id"]}, {"id": doc["id"], "faction": "A2", "game": "x"})
+    assert replaced.matched_count == 1
+    assert (await storage.factions.get(doc["id"]))["faction"] == "A2"
+
+    assert (await storage.factions.delete_one({"id": doc["id"]})).deleted_count == 1
+    assert (await storage.factions.delete_one({"id": doc["id"]})).deleted_count == 0
+
+    await storage.factions.insert_many([faction("X"), faction("Y"), faction("Z", game="Other")])
+    assert (await storage.factions.delete_many({"game": "Age of Fantasy"})).deleted_count == 2
+
+
+async def test_unique_id_index(storage):
+    doc = faction("A")
+    await storage.factions.insert_one(doc)
+    with pytest.raises(DuplicateKeyError):
+        await storage.factions.insert_one(dict(doc))
+
+
+async def test_one_faction_per_game_and_name(storage):
+    await storage.factions.insert_one(faction("A"))
+    with pytest.raises(DuplicateKeyError):
+        await storage.factions.insert_one(faction("A"))
+    # An upsert keyed on (game, faction) finds the existing document instead
+    await storage.factions.bulk_write([
+        UpdateOne({"game": "Age of Fantasy", "faction": "A"}, {"$setOnInsert": faction("A")}, upsert=True),
+    ])
+    assert await storage.factions.count_documents({"faction": "A"}) == 1
+
+
+async def test_lease_is_exclusive_until_it_expires(storage):
+    assert await storage.acquire_lease("watcher", "w1", ttl=60)
+    assert not await storage.acquire_lease("watcher", "w2", ttl=60)
+    assert await storage.acquire_lease("watcher", "w1", ttl=-1)  # renewed, already expired
+    assert await storage.acquire_lease("watcher", "w2", ttl=60)
+    assert not await storage.acquire_lease("watcher", "w1", ttl=60)
+
+
+async def test_bulk_write(storage):
+    armies = storage.armies
+    await armies.insert_one({"id": "a", "total_points": 100})
+    result = await armies.bulk_write([
+        InsertOne({"id": "b", "total_points": 200}),
+        UpdateOne({"id": "a"}, {"$set": {"total_points": 150}}),
+        ReplaceOne({"id": "c"}, {"id": "c", "total_points": 300}, upsert=True),
+        DeleteOne({"id": "b"}),
+    ])
+    assert result.inserted_count == 1
+    assert result.matched_count == 1 and result.modified_count == 1
+    assert result.upserted_count == 1 and result.deleted_count == 1
+    docs = await armies.find({}, sort=[("id", ASCENDING)]).to_list(10)
+    assert [(d["id"], d["total_points"]) for d in docs] == [("a", 150), ("c", 300)]
+
+
+async def test_create_index_is_idempotent(storage):
+    spec = IndexSpec((("game", ASCENDING), ("faction", ASCENDING)), unique=True)
+    await storage.factions.create_index(spec)
+    await storage.factions.create_index(spec)
+    await storage.factions.insert_one(faction("A"))
+    assert len(await storage.factions.find({"game": "Age of Fantasy", "faction": "A"}).to_list(10)) == 1
+
+
+async def test_explain_reports_index_use(storage):
+    await storage.factions.insert_many([faction("A"), faction("B")])
+    by_id = await storage.factions.explain({"id": "x"})
+    assert by_id["stage"] == "IXSCAN" and by_id["index"] == "id_1"
+    assert (await storage.factions.explain({"undefined_field": 1}))["stage"] == "COLLSCAN"
+
+
+async def test_sort_on_descending_index_both_ways(storage):
+    await storage.armies.insert_many([{"id": f"army-{i}", "updated_at": f"2024-01-0{i // 2 + 1}"} for i in range(6)])
+    newest = await storage.armies.find({}, sort=[("updated_at", DESCENDING)]).to_list(None)
+    oldest = await storage.armies.find({}, sort=[("updated_at", ASCENDING)]).to_list(None)
+    assert [d["updated_at"] for d in newest] == sorted((d["updated_at"] for d in newest), reverse=True)
+    assert [d["updated_at"] for d in oldest] == sorted(d["updated_at"] for d in oldest)
+
+
+async def test_ping(storage):
+    assert await storage.ping()
@@ -0,0 +1,82 @@
+import asyncio
+
+import server
+from usage_stats import contribution, escape_key, unescape_key
+
+GAME = "Stats Test Game"
+
+
+def unit(name, *upgrades):
+    return {"id": name, "unit_name": name, "unit_type": "unit", "base_cost": 50, "total_cost": 50,
+            "selected_upgrades": [{"group": "Armes", "option_name": option, "cost": 5} for option in upgrades]}
+
+
+def army(faction, points_limit, *units):
+    return {"name": "List", "game": GAME, "faction": faction, "points_limit": points_limit, "units": list(units)}
+
+
+def test_keys_survive_escaping():
+    name = "Lance-flammes 2.0 ($) 100%"
+    assert "." not in escape_key(name) and unescape_key(escape_key(name)) == name
+    counts = contribution(army("Orcs", 1000, unit("Boyz", "Kikoup"), unit("Boyz")))[f"faction:{GAME}:Orcs"]
+    assert counts["unit_counts.Boyz"] == 2 and counts["upgrade_counts.Armes: Kikoup"] == 1
+
+
+def test_counters_follow_writes_and_match_a_rebuild(client, created, wait_for_job):
+    def create(*args):
+        return created.army(client.post("/api/armies", json=army(*args)).json()["id"])
+
+    a = create("Orcs", 1000, unit("Boyz", "Kikoup"), unit("Nob"))
+    b = create("Orcs", 2000, unit("Boyz"))
+    c = create("Elfes", 1500, unit("Archers"))
+
+    client.put(f"/api/armies/{a}", json={"units": [unit("Boyz", "Kikoup"), unit("Boyz"), unit("Boyz")]})
+    client.put("/api/armies", json={"updates": [{"id": b, "points_limit": 3000}]})
+    client.delete(f"/api/armies/{c}")
+
+    stats = client.get("/api/stats").json()["games"][GAME]
+    assert stats["armies"] == 2 and stats["average_units"] == 2.0 and stats["average_points_limit"] == 2000.0
+    assert stats["factions"] == [{"faction": "Orcs", "armies": 2}]
+    assert stats["units"] == [{"name": "Boyz", "count": 4}]
+    assert stats["upgrades"] == [{"name": "Armes: Kikoup", "count": 1}]
+
+    before = client.get("/api/stats").json()
+    result = wait_for_job(client, client.post("/api/stats/rebuild"))
+    assert result["status"] == "succeeded"
+    assert client.get("/api/stats").json() == before
+
+    client.post("/api/armies/bulk", json={"delete": [a, b]})
+    assert GAME not in client.get("/api/stats").json()["games"]
+
+
+def test_updates_during_a_rebuild_are_kept(client, created, monkeypatch):
+    created.army(client.post("/api/armies", json=army("Rebuild", 1000, unit("Boyz"))).json()["id"])
+    scan = server.storage.armies.find
+
+    async def slow_find(*args, **kwargs):
+        async for doc in scan(*args, **kwargs):
+            await asyncio.sleep(0)
+            yield doc
+
+    async def rebuild_while_writing():
+        monkeypatch.setattr(server.storage.armies, "find", slow_find)
+        rebuild = asyncio.ensure_future(server.usage_stats.rebuild())
+        await asyncio.sleep(0)
+        # An army created elsewhere after the scan started, recorded mid-rebuild
+        await server.usage_stats.record(None, army("Rebuild", 1000, unit("Nob")))
+        return await rebuild
+
+    assert client.portal.call(rebuild_while_writing)["held_counters"] == 2
+    monkeypatch.undo()
+    faction = next(f for f in client.get("/api/stats").json()["games"][GAME]["factions"] if f["faction"] == "Rebuild")
+    assert faction["armies"] == 2
+
+
+def test_failed_counter_updates_are_counted(client, monkeypatch):
+    async def failing_bulk_write(*args, **kwargs):
+        raise ConnectionError("down")
+
+    failures = client.get("/api/metrics").json()["usage_stats"]["failures"]
+    monkeypatch.setattr(server.usage_stats.counters, "bulk_write", failing_bulk_write)
+    client.portal.call(server.usage_stats.record, None, army("Orcs", 1000, unit("Boyz")))
+    assert client.get("/api/metrics").json()["usage_stats"]["failures"] == failures + 1
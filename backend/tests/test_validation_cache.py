@@ -0,0 +1,56 @@
+import copy
+
+
+import server
+from validation_cache import LRUCache, roster_fingerprint
+
+ROSTER = {
+    "points_limit": 500,
+    "game": "Age of Fantasy",
+    "faction": "Disciples de la Guerre",
+    "units": [
+        {"id": "a", "unit_name": "Hero", "unit_type": "hero", "base_cost": 100, "total_cost": 100,
+         "selected_upgrades": [], "combined_unit": False},
+        {"id": "b", "unit_name": "Big", "unit_type": "unit", "base_cost": 200, "total_cost": 200,
+         "selected_upgrades": [{"group": "A", "option_name": "X", "cost": 10}], "combined_unit": False},
+        {"id": "c", "unit_name": "Bigger", "unit_type": "unit", "base_cost": 250, "total_cost": 250,
+         "selected_upgrades": [], "combined_unit": False},
+    ],
+}
+
+
+def test_fingerprint_ignores_order_but_not_content():
+    reordered = {**ROSTER, "units": list(reversed(ROSTER["units"])), "name": "Renamed"}
+    assert roster_fingerprint(reordered) == roster_fingerprint(ROSTER)
+    upgraded = copy.deepcopy(ROSTER)
+    upgraded["units"][1]["selected_upgrades"][0]["option_name"] = "Y"
+    assert roster_fingerprint(upgraded) != roster_fingerprint(ROSTER)
+    assert roster_fingerprint(ROSTER, "hash-1") != roster_fingerprint(ROSTER, "hash-2")
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1, "evictions": 1, "hit_rate": 0.6667}
+
+
+def test_validate_is_memoized_and_keeps_roster_order(client):
+    server.validation_cache.clear()
+    first = client.post("/api/validate", json=ROSTER)
+    body = first.json()
+    assert not body["valid"] and first.headers["etag"] == f'"{body["fingerprint"]}"'
+    assert [e["unit_id"] for e in body["errors"] if e["unit_id"]] == ["b", "c"]
+
+    hits = server.validation_cache.hits
+    reordered = client.post("/api/validate", json={**ROSTER, "units": list(reversed(ROSTER["units"]))}).json()
+    assert server.validation_cache.hits == hits + 1
+    assert reordered["fingerprint"] == body["fingerprint"]
+    assert [e["unit_id"] for e in reordered["errors"] if e["unit_id"]] == ["c", "b"]
+
+    unchanged = client.post("/api/validate", json=ROSTER, headers={"If-None-Match": first.headers["etag"]})
+    assert unchanged.status_code == 200 and unchanged.json() == body
+    assert client.get("/api/metrics").json()["validation_cache"]["hit_rate"] > 0
@@ -0,0 +1,227 @@
+"""Usage counters for the army dashboards, maintained on write.
+
+Instead of aggregating over every army on each dashboard load, each army
+write applies the difference between the roster before and after it as
+``$inc`` updates to a few counter documents in the ``usage_stats``
+collection:
+
+- ``game:<game>``: armies, units and summed points_limit for the game
+- ``faction:<game>:<faction>``: armies and units of the faction, plus
+  ``unit_counts`` and ``upgrade_counts`` maps (unit name / "group: option"
+  -> times taken)
+
+Reading the dashboard touches one document per game and faction, however
+many armies exist. ``rebuild`` recomputes every counter from scratch by
+streaming the armies collection, e.g. after a bulk import or to correct
+drift; run it with ``python usage_stats.py rebuild``.
+
+While a rebuild runs, this worker holds its own counter updates and
+applies them once the rebuilt counters are in place, so they are neither
+wiped nor overwritten by the rebuild. The rebuilt counters replace the old
+ones document by document (stale documents are deleted afterwards), so
+readers never see an empty collection. A change whose army the scan had
+not reached yet is counted by both the scan and the held update; run
+rebuilds when writes are quiet.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from storage import ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Fields a contribution is computed from; projections fetch only these
+ARMY_FIELDS = {"game": 1, "faction": 1, "points_limit": 1, "units": 1}
+
+Counters = Dict[str, Counter]
+
+
+def escape_key(name: str) -> str:
+    """A unit or option name usable as a Mongo field name (no dots, no leading $)"""
+    return name.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def unescape_key(key: str) -> str:
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def contribution(army: Optional[Dict[str, Any]]) -> Counters:
+    """Counter increments one army adds, by counter document id"""
+    counters: Counters = defaultdict(Counter)
+    if not army:
+        return counters
+    game, faction = army.get("game"), army.get("faction")
+    units = army.get("units") or []
+    game_counts = counters[f"game:{game}"]
+    game_counts["armies"] += 1
+    game_counts["units"] += len(units)
+    game_counts["points"] += army.get("points_limit") or 0
+    faction_counts = counters[f"faction:{game}:{faction}"]
+    faction_counts["armies"] += 1
+    faction_counts["units"] += len(units)
+    for unit in units:
+        faction_counts[f"unit_counts.{escape_key(str(unit.get('unit_name')))}"] += 1
+        for upgrade in unit.get("selected_upgrades") or []:
+            option = f"{upgrade.get('group')}: {upgrade.get('option_name')}"
+            faction_counts[f"upgrade_counts.{escape_key(option)}"] += 1
+    return counters
+
+
+def _identity(doc_id: str) -> Dict[str, Any]:
+    kind, _, rest = doc_id.partition(":")
+    if kind == "game":
+        return {"kind": "game", "game": rest}
+    game, _, faction = rest.partition(":")
+    return {"kind": "faction", "game": game, "faction": faction}
+
+
+class UsageStats:
+    def __init__(self, storage):
+        self.storage = storage
+        # Counter updates that could not be written; `rebuild` corrects them
+        self.failures = 0
+        # Deltas held back while a rebuild runs, or None
+        self._held: Optional[Counters] = None
+
+    @property
+    def counters(self):
+        return self.storage.collection("usage_stats")
+
+    async def record(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> None:
+        """Apply the change from one army write (before/after is None on create/delete)"""
+        await self.record_many([(before, after)])
+
+    async def record_many(self, changes: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> None:
+        """Apply several army writes in one bulk write; a failure is logged, never raised"""
+        delta: Counters = defaultdict(Counter)
+        for before, after in changes:
+            for doc_id, counts in contribution(after).items():
+                delta[doc_id].update(counts)
+            for doc_id, counts in contribution(before).items():
+                delta[doc_id].subtract(counts)
+        if self._held is not None:
+            for doc_id, counts in delta.items():
+                self._held[doc_id].update(counts)
+            return
+        await self._apply(delta)
+
+    async def _apply(self, delta: Counters) -> None:
+        operations = [
+            UpdateOne(
+                {"id": doc_id},
+                {"$inc": {field: value for field, value in counts.items() if value}, "$setOnInsert": _identity(doc_id)},
+                upsert=True,
+            )
+            for doc_id, counts in delta.items() if any(counts.values())
+        ]
+        if not operations:
+            return
+        try:
+            await self.counters.bulk_write(operations, ordered=False)
+        except Exception as e:
+            # The army write already happened; `rebuild` corrects the counters
+            self.failures += 1
+            logger.error(f"Updating usage stats failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"failures": self.failures, "rebuilding": self._held is not None}
+
+    async def summary(self, top: int = 10) -> Dict[str, Any]:
+        """Dashboard figures per game, with the most used factions, units and upgrades"""
+        games: Dict[str, Dict[str, Any]] = {}
+        factions = []
+        async for doc in self.counters.find({}):
+            if doc.get("kind") == "game":
+                if doc.get("armies", 0) > 0:
+                    games[doc["game"]] = doc
+            elif doc.get("armies", 0) > 0:
+                factions.append(doc)
+
+        def ranked(counts: Dict[str, int]):
+            items = sorted(((unescape_key(k), v) for k, v in counts.items() if v > 0), key=lambda kv: (-kv[1], kv[0]))
+            return [{"name": name, "count": count} for name, count in items[:top]]
+
+        result = {}
+        for game, doc in sorted(games.items()):
+            armies = doc["armies"]
+            units, upgrades = Counter(), Counter()
+            game_factions = [f for f in factions if f["game"] == game]
+            for faction in game_factions:
+                units.update(faction.get("unit_counts", {}))
+                upgrades.update(faction.get("upgrade_counts", {}))
+            result[game] = {
+                "armies": armies,
+                "average_units": round(doc.get("units", 0) / armies, 2),
+                "average_points_limit": round(doc.get("points", 0) / armies, 1),
+                "factions": [
+                    {"faction": f["faction"], "armies": f["armies"]}
+                    for f in sorted(game_factions, key=lambda f: (-f["armies"], f["faction"]))[:top]
+                ],
+                "units": ranked(units),
+                "upgrades": ranked(upgrades),
+            }
+        return {"games": result}
+
+    async def rebuild(self, batch_size: int = 500) -> Dict[str, int]:
+        """Recompute every counter by streaming all armies"""
+        if self._held is not None:
+            raise RuntimeError("A usage stats rebuild is already running")
+        self._held = defaultdict(Counter)
+        try:
+            totals: Counters = defaultdict(Counter)
+            armies = 0
+            # Memory grows with the number of distinct games, factions and names, not armies
+            async for army in self.storage.armies.find({}, projection=ARMY_FIELDS, batch_size=batch_size):
+                armies += 1
+                for doc_id, counts in contribution(army).items():
+                    totals[doc_id].update(counts)
+
+            documents = []
+            for doc_id, counts in totals.items():
+                doc: Dict[str, Any] = {"id": doc_id, **_identity(doc_id)}
+                for field, value in counts.items():
+                    name, _, key = field.partition(".")
+                    if key:
+                        doc.setdefault(name, {})[key] = value
+                    else:
+                        doc[name] = value
+                documents.append(ReplaceOne({"id": doc_id}, doc, upsert=True))
+            for start in range(0, len(documents), batch_size):
+                await self.counters.bulk_write(documents[start:start + batch_size], ordered=False)
+            await self.counters.delete_many({"id": {"$nin": list(totals)}})
+        finally:
+            held, self._held = self._held, None
+            await self._apply(held)
+        logger.info(f"Rebuilt usage stats from {armies} armies ({len(documents)} counter documents)")
+        return {"armies": armies, "counters": len(documents), "held_counters": len(held)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the usage_stats counters")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="recompute every counter from the armies collection")
+    parser.parse_args(argv)
+
+    sys.path.insert(0, str(Path(__file__).parent))
+    import server
+
+    async def rebuild():
+        await server.storage.open()
+        try:
+            return await UsageStats(server.storage).rebuild()
+        finally:
+            await server.storage.close()
+
+    print(json.dumps(asyncio.run(rebuild()), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
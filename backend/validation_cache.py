@@ -0,0 +1,98 @@
+"""Memoized army validation, keyed by a canonical roster fingerprint.
+
+The builder re-validates after every edit, and undo/redo, toggling an
+upgrade back and several open tabs keep sending rosters it has just seen.
+``roster_fingerprint`` hashes everything validation depends on (points
+limit, game, faction content hash and the units, sorted, with their
+upgrades) so equal rosters map to one key in a bounded ``LRUCache``.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+# Bump when validation rules change so fingerprints held by clients expire
+RULES_VERSION = 1
+
+# Roster unit fields that can influence validation
+_UNIT_FIELDS = ("id", "unit_name", "unit_type", "base_cost", "total_cost", "combined_unit", "selected_upgrades")
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def roster_fingerprint(army_data: Dict[str, Any], faction_hash: Optional[str] = None) -> str:
+    """Stable hash of a roster; unit order and unrelated fields don't change it"""
+    units = sorted(
+        _canonical({k: unit.get(k) for k in _UNIT_FIELDS}) if isinstance(unit, dict) else _canonical(unit)
+        for unit in army_data.get("units", [])
+    )
+    key = _canonical({
+        "rules": RULES_VERSION,
+        "points_limit": army_data.get("points_limit", 1000),
+        "game": army_data.get("game"),
+        "faction": army_data.get("faction"),
+        "faction_hash": faction_hash,
+        "units": units,
+    })
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def in_roster_order(result: Dict[str, Any], units: List[Any]) -> Dict[str, Any]:
+    """A cached result with unit errors ordered like this request's roster"""
+    position = {unit.get("id"): i for i, unit in reversed(list(enumerate(units))) if isinstance(unit, dict)}
+    errors = result.get("errors", [])
+    unit_errors = iter(sorted(
+        (e for e in errors if e.get("unit_id") is not None),
+        key=lambda e: position.get(e["unit_id"], len(position)),
+    ))
+    # Roster-wide errors keep their place; unit errors fill the unit slots in order
+    reordered = [next(unit_errors) if e.get("unit_id") is not None else e for e in errors]
+    return {**result, "errors": reordered}
+
+
+class LRUCache:
+    """Bounded least-recently-used map with hit/miss counters"""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = max(1, maxsize)
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }